@@ -0,0 +1,88 @@
+"""Incremental achievement evaluation
+
+Every achievement in plants.ACHIEVEMENTS is earned once one stat reaches
+a threshold. AchievementIndex groups them by stat with the thresholds
+sorted, so the achievements a stat has reached are found by bisection and
+covered by one precomputed bitmask; AND NOT the user's earned mask leaves
+only the new ones. After a change only the stats it touched are looked
+at, and nothing is decoded or written when nothing new was earned.
+
+Earned achievements are kept as a mask too, bit i standing for IDS[i].
+"""
+from bisect import bisect_right
+from typing import Iterable, List, Optional
+
+from plants import ACHIEVEMENTS
+
+# Catalog order; new achievements go at the end so stored masks stay valid
+IDS = tuple(ACHIEVEMENTS)
+BITS = {ach_id: 1 << i for i, ach_id in enumerate(IDS)}
+
+# Stats a completed session changes
+SESSION_STATS = ("total_plants", "total_focus_minutes", "current_streak", "longest_streak")
+
+def ids_of(mask: int) -> List[str]:
+    """Achievement ids of the bits set in `mask`, in catalog order"""
+    ids = []
+    while mask:
+        low = mask & -mask
+        ids.append(IDS[low.bit_length() - 1])
+        mask ^= low
+    return ids
+
+def mask_of(earned: Iterable[str]) -> int:
+    """Mask of earned achievement ids; ids not in the catalog are left out"""
+    mask = getattr(earned, "mask", None)
+    if mask is not None:
+        return mask
+    mask = 0
+    for ach_id in earned:
+        mask |= BITS.get(ach_id, 0)
+    return mask
+
+class AchievementIndex:
+    """The catalog's thresholds by stat"""
+    
+    def __init__(self, catalog: dict = ACHIEVEMENTS):
+        grouped = {}
+        for ach_id, info in catalog.items():
+            grouped.setdefault(info["stat"], []).append((info["threshold"], BITS[ach_id]))
+        # stat -> (sorted thresholds, masks); masks[i] has the bits of
+        # thresholds[0..i], everything reached by a value >= thresholds[i]
+        self._by_stat = {}
+        for stat, entries in grouped.items():
+            entries.sort()
+            masks = []
+            mask = 0
+            for _, bit in entries:
+                mask |= bit
+                masks.append(mask)
+            self._by_stat[stat] = ([threshold for threshold, _ in entries], masks)
+    
+    @property
+    def stats(self) -> frozenset:
+        return frozenset(self._by_stat)
+    
+    def reached(self, stats, changed: Optional[Iterable[str]] = None) -> int:
+        """Mask of every achievement the given stats reach
+
+        Only stats named in `changed` are looked at, all of them when None.
+        """
+        mask = 0
+        for stat in self._by_stat if changed is None else changed:
+            entry = self._by_stat.get(stat)
+            if entry is None:
+                continue
+            value = stats.get(stat)
+            if value is None:
+                continue
+            i = bisect_right(entry[0], value)
+            if i:
+                mask |= entry[1][i - 1]
+        return mask
+    
+    def new_achievements(self, stats, earned, changed: Optional[Iterable[str]] = None) -> List[str]:
+        """Ids reached by the changed stats but not yet in `earned`"""
+        return ids_of(self.reached(stats, changed) & ~mask_of(earned))
+
+index = AchievementIndex()
@@ -0,0 +1,301 @@
+"""Handler load test: latency, throughput and bytes written per operation
+
+Generates a data file of synthetic users, then in a fresh process imports
+bot_modernized.py against it and drives the real handlers with a fake
+context: users picked at random run scenarios (a focus session from
+start to completion, browsing the forest and statistics, a newcomer's
+first session, ...) in a configurable mix. Every handler call is timed,
+and the bytes the process writes while it runs (/proc/self/io) are
+counted against it, so a change that makes saves bigger shows up too.
+
+Results are compared with benchmarks/baseline_handlers.json, keyed by
+backend, storage settings (DATA_* variables) and number of users; a p95
+or bytes-per-operation regression past the tolerance fails the run. The
+baseline is machine-specific: save one on the machine that checks it.
+
+    python benchmarks/bench_handlers.py --users 1000 10000
+    DATA_JOURNAL=1 python benchmarks/bench_handlers.py --users 1000000 --ops 5000
+    python benchmarks/bench_handlers.py --users 1000 10000 --save-baseline
+"""
+from datetime import datetime, timedelta
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline_handlers.json")
+
+# Scenario -> the handler calls it makes; "plant" picks an unlocked plant
+SCENARIOS = {
+    "focus": ("start_command", "start_focus", "duration", "plant", "complete_session"),
+    "browse": ("start_command", "my_forest", "statistics", "achievements", "leaderboard",
+               "back_to_menu"),
+    "newcomer": ("on_start", "start_command", "start_focus", "duration", "plant",
+                 "complete_session"),
+    "abandon": ("start_focus", "duration", "plant", "abandon_session"),
+    "settings": ("settings", "back_to_menu")
+}
+DEFAULT_MIX = "focus=45,browse=35,newcomer=10,abandon=5,settings=5"
+DURATIONS = (15, 25, 50)
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r}")
+        mix[name] = float(weight or 1)
+    return mix
+
+def storage_settings() -> str:
+    """DATA_* settings that change what is measured, e.g. "DATA_JOURNAL=1" """
+    settings = [f"{key}={value}" for key, value in sorted(os.environ.items())
+                if key.startswith("DATA_") and key not in ("DATA_FILE", "DATA_DB_FILE", "DATA_BACKEND")]
+    return ",".join(settings) or "default"
+
+def generate(directory: str, count: int, backend: str) -> str:
+    """A data file with `count` users; returns its DATA_FILE path"""
+    from bench_snapshot import make_user
+    rng = random.Random(count)
+    path = os.path.join(directory, f"users_{count}.json")
+    if backend == "sqlite":
+        from database import SQLiteUserDatabase
+        database = SQLiteUserDatabase(os.path.splitext(path)[0] + ".db")
+        batch = []
+        for i in range(count):
+            user_id = str(100000000 + i)
+            batch.append((user_id, make_user(user_id, rng)))
+            if len(batch) == 10000:
+                database.import_users(batch)
+                batch = []
+        database.import_users(batch)
+        database.close()
+        return path
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("{")
+        for i in range(count):
+            user_id = str(100000000 + i)
+            f.write(("," if i else "") + json.dumps(user_id) + ":")
+            json.dump(make_user(user_id, rng), f, ensure_ascii=False)
+        f.write("}")
+    return path
+
+def written_bytes() -> int:
+    """Bytes this process has passed to write() so far, 0 where unknown"""
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+class FakeContext:
+    """What the handlers use of maxgram's Context; replies are built but not sent"""
+    
+    def __init__(self, user_id: str, payload: str = None):
+        self.update = {"user_id": int(user_id)}
+        self.payload = payload
+        self.chat_id = int(user_id)
+        self.replies = 0
+    
+    def reply(self, text, keyboard=None, **kwargs):
+        # Sending would serialize the keyboard
+        if keyboard is not None:
+            keyboard.to_attachment()
+        self.replies += 1
+    
+    reply_callback = reply
+
+def percentile(values: list, share: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+def drive(args, path: str) -> dict:
+    """Runs in the child process: import the bot against `path` and time its handlers"""
+    started = time.perf_counter()
+    logging.disable(logging.INFO)
+    import bot_modernized as bot
+    from plants import get_available_plants
+    
+    class _SessionsOver(datetime):
+        """The handlers' clock, far enough ahead that every session may be completed"""
+        
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.now(tz) + timedelta(hours=2)
+    
+    bot.datetime = _SessionsOver
+    bot.leaderboard.rebuild(bot.db.iter_users())
+    bot.warm_keyboards(("ru", "en"))
+    opened = time.perf_counter() - started
+    
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    existing = args.users
+    newcomers = 0
+    timings = {}
+    
+    def call(user_id: str, step: str):
+        if step == "on_start":
+            handler, context = bot.on_start, FakeContext(user_id)
+        elif step == "start_command":
+            handler, context = bot.start_command, FakeContext(user_id)
+        else:
+            if step == "duration":
+                payload = f"duration_{rng.choice(DURATIONS)}"
+            elif step == "plant":
+                plant_id, _ = rng.choice(get_available_plants(bot.db.get_user(user_id)))
+                payload = f"plant_{plant_id}"
+            elif step == "leaderboard":
+                payload = rng.choice(("leaderboard", "leaderboard_total_focus_minutes",
+                                      "leaderboard_longest_streak"))
+            elif step == "settings":
+                payload = "settings"
+            else:
+                payload = step
+            handler, context = bot.handle_callback, FakeContext(user_id, payload)
+        before_bytes = written_bytes()
+        before = time.perf_counter()
+        handler(context)
+        seconds = time.perf_counter() - before
+        entry = timings.setdefault(step, [[], 0])
+        entry[0].append(seconds)
+        entry[1] += written_bytes() - before_bytes
+    
+    ops = 0
+    bytes_before = written_bytes()
+    run_started = time.perf_counter()
+    while ops < args.ops:
+        scenario = rng.choices(names, weights)[0]
+        if scenario == "newcomer":
+            user_id = str(900000000 + newcomers)
+            newcomers += 1
+        else:
+            user_id = str(100000000 + rng.randrange(existing))
+        for step in SCENARIOS[scenario]:
+            call(user_id, step)
+            ops += 1
+    handlers_seconds = time.perf_counter() - run_started
+    # Whatever the background flusher still holds counts too
+    bot.db.flush()
+    total_seconds = time.perf_counter() - run_started
+    total_bytes = written_bytes() - bytes_before
+    
+    operations = {}
+    for step, (latencies, written) in sorted(timings.items()):
+        latencies.sort()
+        operations[step] = {
+            "count": len(latencies),
+            "p50_ms": percentile(latencies, 0.50) * 1e3,
+            "p95_ms": percentile(latencies, 0.95) * 1e3,
+            "p99_ms": percentile(latencies, 0.99) * 1e3,
+            "bytes_per_op": written / len(latencies)
+        }
+    return {
+        "users": args.users,
+        "open_seconds": opened,
+        "ops": ops,
+        "ops_per_second": ops / handlers_seconds,
+        "bytes_per_op": total_bytes / ops,
+        "flush_seconds": total_seconds - handlers_seconds,
+        "operations": operations
+    }
+
+def measure(args, users: int, path: str) -> dict:
+    env = dict(os.environ, DATA_FILE=path, DATA_BACKEND=args.backend, BOT_TOKEN="bench",
+               BOT_WORKERS="0")
+    output = subprocess.check_output(
+        [sys.executable, __file__, "--drive", path, "--users", str(users), "--ops", str(args.ops),
+         "--mix", args.mix, "--seed", str(args.seed)],
+        env=env, cwd=os.path.dirname(path))
+    return json.loads(output.splitlines()[-1])
+
+def report(key: str, result: dict, baseline: dict, args) -> list:
+    """Print one run; returns its regressions against `baseline`"""
+    print(f"\n{key}: opened in {result['open_seconds']:.2f}s, "
+          f"{result['ops_per_second']:.0f} ops/s, {result['bytes_per_op']:.0f} bytes/op, "
+          f"final flush {result['flush_seconds']:.2f}s")
+    print(f"{'operation':<18} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'bytes/op':>10}  vs baseline")
+    regressions = []
+    for step, stats in result["operations"].items():
+        before = (baseline or {}).get("operations", {}).get(step)
+        change = ""
+        if before:
+            p95 = stats["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0.0
+            written = stats["bytes_per_op"] / before["bytes_per_op"] - 1 if before["bytes_per_op"] else 0.0
+            change = f"p95 {p95:+.0%}, bytes {written:+.0%}"
+            # Latency is noisy; sub-0.5 ms differences don't count
+            if p95 > args.tolerance and stats["p95_ms"] - before["p95_ms"] > 0.5:
+                regressions.append(f"{key} {step}: p95 {before['p95_ms']:.2f} -> {stats['p95_ms']:.2f} ms")
+            if written > args.bytes_tolerance and stats["bytes_per_op"] - before["bytes_per_op"] > 64:
+                regressions.append(f"{key} {step}: {before['bytes_per_op']:.0f} -> "
+                                   f"{stats['bytes_per_op']:.0f} bytes/op")
+        print(f"{step:<18} {stats['count']:>6} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} "
+              f"{stats['p99_ms']:>8.2f} {stats['bytes_per_op']:>10.0f}  {change}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--ops", type=int, default=2000, help="handler calls per run")
+    parser.add_argument("--mix", default=DEFAULT_MIX, type=str,
+                        help=f"scenario weights (default {DEFAULT_MIX})")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--dir", help="where to put generated files (default: temp dir)")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed p95 growth over the baseline (default 0.5)")
+    parser.add_argument("--bytes-tolerance", type=float, default=0.1,
+                        help="allowed bytes/op growth over the baseline (default 0.1)")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--drive", metavar="PATH", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    parse_mix(args.mix)
+    
+    if args.drive:
+        args.users = args.users[0]
+        print(json.dumps(drive(args, args.drive)))
+        return
+    
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baselines = json.load(f)
+    print(f"{args.ops} handler calls per run, mix {args.mix}, storage {storage_settings()}")
+    regressions = []
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        for users in args.users:
+            key = f"{args.backend}/{storage_settings()}/{users}"
+            path = generate(directory, users, args.backend)
+            result = measure(args, users, path)
+            regressions += report(key, result, None if args.save_baseline else baselines.get(key), args)
+            baselines[key] = result
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+    
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nBaseline saved to {args.baseline}")
+    elif regressions:
+        print("\nRegressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Restart benchmark: how long UserDatabase takes to come up
+
+Writes synthetic users as the bot used to store them in each DATA_FORMAT,
+lets a first UserDatabase start convert and index them, then opens the
+database again in a fresh process and reports the time until it is
+ready and the peak RSS. "dicts" is json.load of the JSON file as the bot
+used to write it, into plain dicts: what loading cost before users
+became models.User.
+
+    python benchmarks/bench_load.py --users 20000 100000
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_snapshot import make_user, peak_rss_kb
+from database import UserDatabase
+import snapshot
+
+# (name, DATA_FORMAT, DATA_CACHE_SIZE)
+SETUPS = (("json", "json", 0), ("json-lazy", "json", 1000),
+          ("binary", "binary", 0), ("binary-lazy", "binary", 1000))
+
+def generate(path: str, count: int, data_format: str):
+    """Write the users as a single file in the layout the bot used to have"""
+    rng = random.Random(count)
+    users = {str(100000000 + i): make_user(str(100000000 + i), rng) for i in range(count)}
+    if data_format == "binary":
+        snapshot.write(os.path.splitext(path)[0] + ".snap", users.items())
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(users, f, ensure_ascii=False)
+
+def load(setup: str, path: str):
+    """Runs in the child process"""
+    name, data_format, cache_size = next(entry for entry in SETUPS + (("dicts", "json", 0),)
+                                         if entry[0] == setup)
+    start = time.perf_counter()
+    if name == "dicts":
+        with open(path, 'r', encoding='utf-8') as f:
+            count = len(json.load(f))
+    else:
+        db = UserDatabase(path, flush_interval_ms=0, cache_size=cache_size,
+                          data_format=data_format)
+        count = sum(len(shard.index) for shard in db.shards)
+    seconds = time.perf_counter() - start
+    print(json.dumps({"users": count, "seconds": seconds, "peak_rss_mb": peak_rss_kb() / 1024}))
+
+def measure(setup: str, path: str) -> dict:
+    output = subprocess.check_output([sys.executable, __file__, "--load", setup, path])
+    return json.loads(output)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[20000, 100000])
+    parser.add_argument("--dir", help="where to put generated files (default: temp dir)")
+    parser.add_argument("--load", nargs=2, metavar=("SETUP", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.load:
+        load(*args.load)
+        return
+    
+    print(f"{'users':>9} {'setup':<12} {'load s':>8} {'peak RSS MB':>12}")
+    for count in args.users:
+        for data_format in ("json", "binary"):
+            with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+                path = os.path.join(directory, "users.json")
+                generate(path, count, data_format)
+                setups = [name for name, fmt, _ in SETUPS if fmt == data_format]
+                if data_format == "json":
+                    setups.insert(0, "dicts")
+                converted = False
+                for setup in setups:
+                    if setup != "dicts" and not converted:
+                        UserDatabase(path, flush_interval_ms=0, data_format=data_format).close()
+                        converted = True
+                    result = measure(setup, path)
+                    print(f"{count:>9} {setup:<12} {result['seconds']:>8.2f} "
+                          f"{result['peak_rss_mb']:>12.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Memory per user: nested dicts vs models.User
+
+Builds synthetic users the way the database loads them (parsed from
+JSON), then measures the heap they take with tracemalloc in each form.
+
+    python benchmarks/bench_memory.py --users 10000 100000
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_snapshot import make_user
+from models import User
+
+def measure(build) -> int:
+    gc.collect()
+    tracemalloc.start()
+    objects = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return size
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[10000, 100000])
+    args = parser.parse_args()
+    
+    print(f"{'users':>9} {'dict B/user':>12} {'model B/user':>13} {'saved':>6}")
+    for count in args.users:
+        rng = random.Random(count)
+        lines = [json.dumps(make_user(str(100000000 + i), rng), ensure_ascii=False)
+                 for i in range(count)]
+        dicts = measure(lambda: [json.loads(line) for line in lines])
+        models = measure(lambda: [User.from_dict(json.loads(line)) for line in lines])
+        print(f"{count:>9} {dicts / count:>12.0f} {models / count:>13.0f} "
+              f"{1 - models / dicts:>6.0%}")
+
+if __name__ == "__main__":
+    main()
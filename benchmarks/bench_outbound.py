@@ -0,0 +1,100 @@
+"""Load test: pushing notifications through the outbound queue
+
+Serves the stand-in API from fake_api.py in another process, with its own
+rate limit and a share of 503s, queues one notification per user, and reports
+how long queueing took a caller, how long sending took, and how often
+the API throttled or failed a send. With --restart-at the queue is closed
+part way and a new one sends the rest from the outbox.
+
+    python benchmarks/bench_outbound.py --messages 100000 --rate 1500 --api-limit 2000
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from outbound import Outbox, OutboundQueue
+
+def serve(args) -> tuple:
+    """Start fake_api.py on a free port; (process, url)"""
+    process = subprocess.Popen(
+        [sys.executable, "-u", os.path.join(ROOT, "fake_api.py"), "--port", "0", "--users", "0",
+         "--latency-ms", str(args.latency_ms), "--rate-limit", str(args.api_limit),
+         "--error-rate", str(args.error_rate)],
+        stdout=subprocess.PIPE, text=True)
+    # "Serving 0 updates on http://127.0.0.1:<port>"
+    url = process.stdout.readline().split()[-1]
+    return process, url
+
+def make_queue(args, url: str, path: str) -> OutboundQueue:
+    return OutboundQueue("test", url, Outbox(path), rate=args.rate, burst=args.rate / 10,
+                         workers=args.workers)
+
+def percentile(values: list, share: float) -> float:
+    return sorted(values)[min(len(values) - 1, int(len(values) * share))]
+
+def run(args, url: str):
+    api_stats = lambda: requests.get(url + "/stats").json()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "outbox.db")
+        queue = make_queue(args, url, path)
+        queue.start()
+        
+        # One call per notification, as reminders and warnings are queued
+        latencies = []
+        started = time.perf_counter()
+        for number in range(args.messages):
+            before = time.perf_counter()
+            queue.send_message(user_id=100000 + number, text=f"Notification {number}")
+            latencies.append(time.perf_counter() - before)
+        queued = time.perf_counter()
+        
+        if args.restart_at:
+            while api_stats()["messages"] < args.messages * args.restart_at:
+                time.sleep(0.1)
+            queue.close()
+            queue = make_queue(args, url, path)
+            print(f"Restarted with {queue.start()} messages in the outbox")
+        queue.drain()
+        sent = time.perf_counter()
+        stats = queue.stats()
+        queue.close()
+        left = len(Outbox(path))
+    api = api_stats()
+    
+    print(f"{args.messages} notifications queued in {queued - started:.2f}s: "
+          f"median {percentile(latencies, 0.5) * 1e6:.0f} us, "
+          f"p99 {percentile(latencies, 0.99) * 1e6:.0f} us, max {max(latencies) * 1e3:.1f} ms per call")
+    print(f"Sent in {sent - started:.2f}s ({api['messages'] / (sent - started):.0f}/s) "
+          f"to {api['recipients']} users, {api['duplicates']} sent twice, {left} left in the outbox")
+    print(f"API answered 429 {api['throttled']} times and 503 {api['errors']} times; "
+          f"queue retried {stats['retried']}, gave up on {stats['failed']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--rate", type=float, default=1500, help="queue's messages per second")
+    parser.add_argument("--api-limit", type=int, default=2000, help="API's messages per second")
+    parser.add_argument("--error-rate", type=float, default=0.01, help="share of sends failed with 503")
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--restart-at", type=float, default=0.0,
+                        help="close the queue after this share was sent and start a new one")
+    args = parser.parse_args()
+    
+    process, url = serve(args)
+    try:
+        run(args, url)
+    finally:
+        process.terminate()
+        process.wait()
+
+if __name__ == "__main__":
+    main()
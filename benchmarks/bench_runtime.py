@@ -0,0 +1,72 @@
+"""Load test: synchronous bot.run() vs the asyncio runtime
+
+Starts the stand-in API server from fake_api.py with generated traffic,
+runs each bot entry point against it in a fresh process with an empty
+data file, and reports how fast the updates were answered and how many
+API calls were in flight at once.
+
+    python benchmarks/bench_runtime.py --users 1000 --updates 5 --latency-ms 50
+"""
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import fake_api
+
+ENTRY_POINTS = {"sync": "bot_modernized.py", "async": "bot_async.py"}
+
+async def measure(runtime: str, args, directory: str) -> dict:
+    api = fake_api.FakeApi(args.latency_ms / 1000, poll_timeout=1)
+    updates = fake_api.make_updates(args.users, args.updates)
+    api.add_updates(updates)
+    runner = await fake_api.start(api)
+    env = dict(os.environ, BOT_TOKEN="test",
+               MAX_API_URL=f"http://127.0.0.1:{fake_api.bound_port(runner)}",
+               DATA_FILE=os.path.join(directory, f"{runtime}.json"))
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, ENTRY_POINTS[runtime])],
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + args.timeout
+        while api.replies < len(updates) and time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{runtime} bot exited with {process.returncode}")
+            await asyncio.sleep(0.1)
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        await runner.cleanup()
+    seconds = (api.last_reply or time.perf_counter()) - (api.first_delivery or time.perf_counter())
+    return {"answered": api.replies, "seconds": seconds, "max_in_flight": api.max_in_flight}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--updates", type=int, default=5, help="updates per user")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--runtimes", nargs="+", choices=list(ENTRY_POINTS), default=list(ENTRY_POINTS))
+    parser.add_argument("--timeout", type=float, default=600, help="seconds per runtime")
+    args = parser.parse_args()
+    
+    total = args.users * args.updates
+    print(f"{total} updates from {args.users} users, {args.latency_ms:g} ms per API call")
+    print(f"{'runtime':<8} {'answered':>9} {'seconds':>8} {'updates/s':>10} {'in flight':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for runtime in args.runtimes:
+            result = asyncio.run(measure(runtime, args, directory))
+            rate = result["answered"] / result["seconds"] if result["seconds"] > 0 else 0
+            print(f"{runtime:<8} {result['answered']:>9} {result['seconds']:>8.2f} "
+                  f"{rate:>10.0f} {result['max_in_flight']:>10}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Cold-start benchmark: JSON vs binary snapshot
+
+Generates synthetic users, writes them as the pretty-printed JSON the bot
+used to produce and as a binary snapshot, then loads each file in a fresh
+process and reports load time and peak RSS.
+
+    python benchmarks/bench_snapshot.py --users 100000 1000000
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import snapshot
+from plants import ACHIEVEMENTS, PLANT_SPECIES
+
+def make_user(user_id: str, rng: random.Random) -> dict:
+    created = datetime(2025, 1, 1) + timedelta(seconds=rng.randrange(300 * 86400))
+    plants = []
+    for _ in range(int(rng.expovariate(1 / 20))):
+        plants.append({
+            "type": rng.choice(list(PLANT_SPECIES)),
+            "grown_at": (created + timedelta(seconds=rng.randrange(86400 * 30),
+                                             microseconds=rng.randrange(10 ** 6))).isoformat(),
+            "session_minutes": rng.choice((15, 25, 50))
+        })
+    total_minutes = sum(plant["session_minutes"] for plant in plants)
+    return {
+        "user_id": user_id,
+        "created_at": created.isoformat(),
+        "language": rng.choice(("ru", "ru", "ru", "en")),
+        "plants": plants,
+        "current_session": None,
+        "stats": {
+            "total_focus_minutes": total_minutes,
+            "total_plants": len(plants),
+            "current_streak": rng.randrange(10),
+            "longest_streak": rng.randrange(10, 40),
+            "last_activity_date": (created + timedelta(days=rng.randrange(30))).date().isoformat(),
+            "streak_freezes": rng.randrange(3)
+        },
+        "preferences": {
+            "session_duration": 25,
+            "favorite_plant": "🌱"
+        },
+        "achievements": rng.sample(list(ACHIEVEMENTS), rng.randrange(len(ACHIEVEMENTS) + 1))
+    }
+
+def generate(directory: str, count: int):
+    rng = random.Random(count)
+    users = {str(100000000 + i): make_user(str(100000000 + i), rng) for i in range(count)}
+    json_path = os.path.join(directory, f"users_{count}.json")
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(users, f, ensure_ascii=False, indent=2)
+    snap_path = os.path.join(directory, f"users_{count}.snap")
+    snapshot.write(snap_path, users.items())
+    return json_path, snap_path
+
+def load(kind: str, path: str):
+    """Runs in the child process"""
+    start = time.perf_counter()
+    if kind == "json":
+        with open(path, 'r', encoding='utf-8') as f:
+            users = json.load(f)
+        count = len(users)
+    elif kind == "binary":
+        count = len(snapshot.load(path))
+    elif kind == "binary-users":
+        # What UserDatabase loads: models built from the stored fields
+        count = len(snapshot.load_users(path))
+    else:
+        # What the lazy cache needs at startup: the index only
+        with snapshot.SnapshotReader(path) as reader:
+            count = len(reader.index())
+    seconds = time.perf_counter() - start
+    print(json.dumps({"users": count, "seconds": seconds, "peak_rss_mb": peak_rss_kb() / 1024}))
+
+def peak_rss_kb() -> int:
+    # ru_maxrss survives exec on Linux and would report the parent's peak
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def measure(kind: str, path: str) -> dict:
+    output = subprocess.check_output([sys.executable, __file__, "--load", kind, path])
+    return json.loads(output)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--dir", help="where to put generated files (default: temp dir)")
+    parser.add_argument("--load", nargs=2, metavar=("KIND", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.load:
+        load(*args.load)
+        return
+    
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        print(f"{'users':>9} {'format':<14} {'size MB':>8} {'load s':>8} {'peak RSS MB':>12}")
+        for count in args.users:
+            json_path, snap_path = generate(directory, count)
+            for kind, path in (("json", json_path), ("binary", snap_path),
+                               ("binary-users", snap_path), ("binary-index", snap_path)):
+                result = measure(kind, path)
+                size = os.path.getsize(path) / 2 ** 20
+                print(f"{count:>9} {kind:<14} {size:>8.1f} {result['seconds']:>8.2f} "
+                      f"{result['peak_rss_mb']:>12.1f}")
+            os.remove(json_path)
+            os.remove(snap_path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""asyncio entry point for the bot
+
+Runs the handlers of bot_modernized.py without a thread per update.
+Updates are long-polled with aiohttp, and each one is handled by a
+coroutine. The handler itself, which reads and writes UserDatabase, runs
+on a small executor. Its API calls are recorded while it runs and sent
+from the event loop afterwards, so thousands of updates can wait on the
+network at once on a single core.
+
+    python3 bot_async.py
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+import asyncio
+import logging
+import os
+import signal
+
+import aiohttp
+from maxgram.context import Context
+from maxgram.types import UpdateType
+
+from bot_modernized import bot, raise_interrupt, start_services, stop_services
+from dispatch import update_key
+from plants import PLANT_SPECIES
+
+logger = logging.getLogger(__name__)
+
+API_URL = "https://botapi.max.ru"
+# Seconds the API may hold a long poll open
+POLL_TIMEOUT = 30
+
+class ApiError(Exception):
+    pass
+
+class AsyncApi:
+    """The parts of the MAX Bot API the handlers use, over aiohttp"""
+    
+    def __init__(self, token: str, session: aiohttp.ClientSession, base_url: str = None):
+        self.token = token
+        self.session = session
+        self.base_url = base_url or os.getenv("MAX_API_URL") or API_URL
+    
+    async def request(self, method: str, path: str, params: Dict[str, Any] = None,
+                      data: Dict[str, Any] = None, timeout: float = 60) -> Dict[str, Any]:
+        params = dict(params or {}, access_token=self.token)
+        async with self.session.request(method, self.base_url + path, params=params, json=data,
+                                        timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            if response.status >= 400:
+                raise ApiError(f"HTTP error {response.status}: {await response.text()}")
+            return await response.json()
+    
+    async def get_updates(self, marker: Optional[int] = None,
+                          types: List[str] = None) -> Dict[str, Any]:
+        params = {"timeout": POLL_TIMEOUT}
+        if marker is not None:
+            params["marker"] = marker
+        if types:
+            params["types"] = ",".join(types)
+        return await self.request("GET", "/updates", params, timeout=POLL_TIMEOUT + 30)
+    
+    async def send_message(self, chat_id: int, text: str,
+                           attachments: List[Dict[str, Any]] = None) -> Dict[str, Any]:
+        data = {"text": text}
+        if attachments:
+            data["attachments"] = attachments
+        return await self.request("POST", "/messages", {"chat_id": chat_id}, data)
+    
+    async def edit_message(self, message_id: str, text: str,
+                           attachments: List[Dict[str, Any]] = None) -> Dict[str, Any]:
+        data = {"text": text}
+        if attachments:
+            data["attachments"] = attachments
+        return await self.request("PUT", "/messages", {"message_id": message_id}, data)
+    
+    async def answer_callback(self, callback_id: str, text: str = None) -> Dict[str, Any]:
+        data = {"notification": text} if text else {}
+        return await self.request("POST", "/answers", {"callback_id": callback_id}, data)
+
+class _Outbox:
+    """Takes the place of maxgram's Api while a handler runs
+
+    Calls are recorded as (method name, args, kwargs) to be made by
+    AsyncApi once the handler returns.
+    """
+    
+    def __init__(self):
+        self.calls = []
+    
+    def __getattr__(self, name: str):
+        def call(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return {}
+        return call
+
+class AsyncRuntime:
+    """Long-polls updates and handles each one in a coroutine"""
+    
+    def __init__(self, bot, api: AsyncApi, db_workers: int = None, max_in_flight: int = None):
+        if db_workers is None:
+            # Handlers only hold a thread while they touch the database
+            db_workers = int(os.getenv("BOT_DB_WORKERS", "4"))
+        if max_in_flight is None:
+            # Beyond this polling waits for updates to finish
+            max_in_flight = int(os.getenv("BOT_MAX_IN_FLIGHT", "10000"))
+        self.bot = bot
+        self.api = api
+        self.executor = ThreadPoolExecutor(max_workers=db_workers, thread_name_prefix="bot-db")
+        self.max_in_flight = max_in_flight
+        self._slots = None
+        # user key -> the user's latest update task, which the next one waits for
+        self._tails = {}
+        self._running = False
+        self.in_flight = 0
+        self.processed = 0
+        self.failed = 0
+    
+    def _route(self, context: Context):
+        """What Bot._process_update does, with a context of our own"""
+        for handler in self.bot.handlers.get("update", []):
+            handler(context)
+        for handler in self.bot.handlers.get(context.update_type, []):
+            handler(context)
+        if context.update_type == UpdateType.MESSAGE_CREATED and "message" in context.update:
+            self.bot._process_message(context)
+    
+    async def _send(self, context: Context, outbox: _Outbox):
+        for name, args, kwargs in outbox.calls:
+            try:
+                await getattr(self.api, name)(*args, **kwargs)
+            except ApiError:
+                if name != "edit_message":
+                    raise
+                # Like Context.reply_callback: fall back to a new message
+                logger.exception("Error editing message, sending a new one")
+                await self.api.send_message(context._get_chat_id(), *args[1:], **kwargs)
+    
+    async def _handle(self, update: Dict[str, Any], previous: Optional[asyncio.Task]):
+        try:
+            if previous is not None:
+                # Updates of one user are handled in order
+                await asyncio.wait([previous])
+            outbox = _Outbox()
+            context = Context(update, outbox)
+            await asyncio.get_running_loop().run_in_executor(self.executor, self._route, context)
+            await self._send(context, outbox)
+            self.processed += 1
+        except Exception as e:
+            self.failed += 1
+            self.bot.handle_error(e, update)
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+    
+    def _forget(self, key: Optional[str], task: asyncio.Task):
+        if self._tails.get(key) is task:
+            del self._tails[key]
+    
+    def submit(self, update: Dict[str, Any]) -> asyncio.Task:
+        key = update_key(update)
+        self.in_flight += 1
+        task = asyncio.create_task(self._handle(update, self._tails.get(key)))
+        self._tails[key] = task
+        task.add_done_callback(lambda task: self._forget(key, task))
+        return task
+    
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "users_waiting": len(self._tails),
+            "processed": self.processed,
+            "failed": self.failed
+        }
+    
+    async def run(self, types: List[str] = None):
+        """Poll until stop() or cancellation, then finish what was received"""
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._running = True
+        marker = None
+        try:
+            while self._running:
+                try:
+                    data = await self.api.get_updates(marker, types)
+                except (aiohttp.ClientError, asyncio.TimeoutError, ApiError) as e:
+                    logger.error(f"Error getting updates: {e}")
+                    await asyncio.sleep(3)
+                    continue
+                marker = data.get("marker", marker)
+                for update in data.get("updates", []):
+                    await self._slots.acquire()
+                    self.submit(update)
+        finally:
+            tasks = list(self._tails.values())
+            if tasks:
+                await asyncio.wait(tasks)
+            self.executor.shutdown()
+    
+    def stop(self):
+        self._running = False
+
+async def main():
+    # aiohttp's default of 100 connections would cap the calls in flight
+    connector = aiohttp.TCPConnector(limit=int(os.getenv("BOT_MAX_CONNECTIONS", "1000")))
+    async with aiohttp.ClientSession(connector=connector) as session:
+        api = AsyncApi(os.getenv("BOT_TOKEN"), session)
+        await AsyncRuntime(bot, api).run()
+
+if __name__ == "__main__":
+    print("🤖 Лесной Фокус бот запускается (asyncio)...")
+    print("✅ База данных инициализирована")
+    print(f"🌱 Доступно растений: {len(PLANT_SPECIES)}")
+    start_services()
+    # docker stop sends SIGTERM, which would skip the shutdown below
+    signal.signal(signal.SIGTERM, raise_interrupt)
+    print("🚀 Бот запущен!\n")
+    
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\n🛑 Бот остановлен пользователем")
+    finally:
+        stop_services()
@@ -3,20 +3,120 @@ from dotenv import load_dotenv
 from maxgram import Bot
 from maxgram.keyboards import InlineKeyboard
 from database import db
-from plants import PLANT_SPECIES, get_available_plants, get_next_unlock, ACHIEVEMENTS
-from localization import get_message
+from dispatch import install as install_dispatch
+from scheduler import SessionTimers
+from outbound import OutboundQueue
+import metrics
+from profiling import profiler
+import profiling
+from plants import PLANT_SPECIES, get_next_unlock, plants_in_bucket, unlock_bucket, unlock_buckets, ACHIEVEMENTS
+from achievements import SESSION_STATS, index as achievement_index
+from leaderboard import Leaderboard, STATS as LEADERBOARD_STATS
+from models import daily_series, day_number, format_day
+import streak_job
+from localization import get_message, localized
+import localization
+import plants
 from datetime import datetime, timedelta
+import functools
+import logging
+import signal
 import threading
 import time
 
+logger = logging.getLogger(__name__)
+
+# Users listed on a leaderboard screen
+LEADERBOARD_SIZE = 10
+
 load_dotenv()
+# Local hour users whose streak is at risk are reminded at
+STREAK_REMINDER_HOUR = int(os.getenv("STREAK_REMINDER_HOUR", "18"))
+# Users allowed admin commands such as /profile, comma separated
+ADMIN_USER_IDS = frozenset(filter(None, (user_id.strip() for user_id in
+                                         os.getenv("ADMIN_USER_IDS", "").split(","))))
 bot = Bot(os.getenv("BOT_TOKEN"))
+if os.getenv("MAX_API_URL"):
+    # Another API server, e.g. the stand-in from fake_api.py
+    bot.api.client.BASE_URL = os.getenv("MAX_API_URL")
+# Worker pool running the handlers, one update per user at a time; set by
+# install_dispatcher(), which bot_async leaves out as it runs them itself
+dispatcher = None
+
+# ============= METRICS =============
+
+HANDLER_SECONDS = metrics.registry.histogram(
+    "forest_handler_seconds", "Time spent in update handlers", ("handler", "payload"))
+HANDLER_ERRORS = metrics.registry.counter(
+    "forest_handler_errors_total", "Handler calls that raised", ("handler", "payload"))
+
+# Callback payloads, labelled as they are
+_PAYLOADS = frozenset(("start_focus", "my_forest", "statistics", "achievements", "settings",
+                       "leaderboard", "back_to_menu", "complete_session", "abandon_session"))
+# Payloads carrying a value, labelled by prefix
+_PAYLOAD_PREFIXES = ("duration_", "plant_", "leaderboard_")
+
+def _payload_label(payload) -> str:
+    if not payload:
+        return ""
+    if payload in _PAYLOADS:
+        return payload
+    for prefix in _PAYLOAD_PREFIXES:
+        if payload.startswith(prefix):
+            return prefix + "*"
+    return metrics.OTHER
+
+def instrumented(handler):
+    """Time a handler in HANDLER_SECONDS, labelled with the callback payload,
+    and profile it while profiling is on"""
+    name = handler.__name__
+    
+    @functools.wraps(handler)
+    def timed(context):
+        payload = _payload_label(getattr(context, "payload", None))
+        started = time.perf_counter()
+        try:
+            if profiler.active:
+                return profiler.update(f"{name}:{payload}" if payload else name, handler, context)
+            return handler(context)
+        except Exception:
+            HANDLER_ERRORS.inc(name, payload)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name, payload)
+    return timed
 
 # ============= KEYBOARDS =============
 
-def get_main_menu_keyboard(lang="ru"):
-    """Main menu keyboard"""
-    return InlineKeyboard(
+class _CachedKeyboard(InlineKeyboard):
+    """Keyboard converted once; every reply shares the same attachment, so don't modify it"""
+    
+    def __init__(self, *rows):
+        super().__init__(*rows)
+        self._attachment = super().to_attachment()
+    
+    def to_attachment(self):
+        return self._attachment
+
+# (build, args) -> _CachedKeyboard, for the catalog and messages of _keyboards_version
+_keyboards = {}
+_keyboards_version = None
+
+def _cached_keyboard(build, *args) -> InlineKeyboard:
+    """build(*args) rows as a keyboard, built once until plants or messages change"""
+    global _keyboards_version
+    version = (plants.catalog_version, localization.messages_version)
+    if version != _keyboards_version:
+        _keyboards.clear()
+        _keyboards_version = version
+    key = (build, args)
+    keyboard = _keyboards.get(key)
+    if keyboard is None:
+        keyboard = _keyboards[key] = _CachedKeyboard(*build(*args))
+    return keyboard
+
+def _main_menu_rows(lang):
+    return [
         [
             {"text": get_message("btn_start_focus", lang), "callback": "start_focus"}
         ],
@@ -27,31 +127,30 @@ def get_main_menu_keyboard(lang="ru"):
         [
             {"text": get_message("btn_achievements", lang), "callback": "achievements"},
             {"text": get_message("btn_settings", lang), "callback": "settings"}
+        ],
+        [
+            {"text": get_message("btn_leaderboard", lang), "callback": "leaderboard"}
         ]
-    )
+    ]
 
-def get_duration_keyboard(lang="ru"):
-    """Session duration selection"""
-    return InlineKeyboard(
+def _duration_rows(lang):
+    return [
         [
             {"text": get_message("btn_25min", lang), "callback": "duration_25"}
         ],
         [
-            {"text": "⏱️ 15 минут (короткая)" if lang == "ru" else "⏱️ 15 minutes (short)", 
-             "callback": "duration_15"}
+            {"text": get_message("btn_15min", lang), "callback": "duration_15"}
         ],
         [
             {"text": get_message("btn_50min", lang), "callback": "duration_50"}
         ],
         [
-            {"text": "🔙 Назад" if lang == "ru" else "🔙 Back", "callback": "back_to_menu"}
+            {"text": get_message("btn_back", lang), "callback": "back_to_menu"}
         ]
-    )
+    ]
 
-def get_plant_selection_keyboard(user_id: str, lang="ru"):
-    """Show available plants for selection"""
-    user = db.get_user(user_id)
-    available = get_available_plants(user, is_premium=False)  # Check premium status
+def _plant_selection_rows(lang, bucket, is_premium):
+    available = plants_in_bucket(bucket, is_premium)
     
     rows = []
     for i in range(0, len(available), 2):  # 2 plants per row
@@ -59,30 +158,77 @@ def get_plant_selection_keyboard(user_id: str, lang="ru"):
         for j in range(2):
             if i + j < len(available):
                 plant_id, plant_info = available[i + j]
-                name = plant_info["name_ru"] if lang == "ru" else plant_info["name_en"]
+                name = localized(plant_info, "name", lang)
                 row.append({
                     "text": f"{plant_info['emoji']} {name}",
                     "callback": f"plant_{plant_id}"
                 })
         rows.append(row)
     
-    rows.append([{"text": "🔙 Назад" if lang == "ru" else "🔙 Back", "callback": "back_to_menu"}])
-    return InlineKeyboard(*rows)
+    rows.append([{"text": get_message("btn_back", lang), "callback": "back_to_menu"}])
+    return rows
 
-def get_session_keyboard(lang="ru"):
-    """Active session controls"""
-    return InlineKeyboard(
+def _session_rows(lang):
+    return [
         [
             {"text": get_message("btn_complete_session", lang), "callback": "complete_session"}
         ],
         [
             {"text": get_message("btn_abandon_session", lang), "callback": "abandon_session"}
         ]
-    )
+    ]
+
+def _leaderboard_rows(lang):
+    return [
+        [{"text": get_message(f"btn_leaderboard_{stat}", lang), "callback": f"leaderboard_{stat}"}
+         for stat in LEADERBOARD_STATS],
+        [
+            {"text": get_message("btn_back", lang), "callback": "back_to_menu"}
+        ]
+    ]
+
+def get_main_menu_keyboard(lang="ru"):
+    """Main menu keyboard"""
+    return _cached_keyboard(_main_menu_rows, lang)
+
+def get_duration_keyboard(lang="ru"):
+    """Session duration selection"""
+    return _cached_keyboard(_duration_rows, lang)
+
+def get_plant_selection_keyboard(user_id: str, lang="ru"):
+    """Show available plants for selection"""
+    user = db.get_user(user_id)
+    bucket = unlock_bucket(user["stats"]["total_plants"])
+    return _cached_keyboard(_plant_selection_rows, lang, bucket, False)  # Check premium status
+
+def get_session_keyboard(lang="ru"):
+    """Active session controls"""
+    return _cached_keyboard(_session_rows, lang)
+
+def get_leaderboard_keyboard(lang="ru"):
+    """Switch between leaderboards"""
+    return _cached_keyboard(_leaderboard_rows, lang)
+
+def warm_keyboards(languages=(localization.DEFAULT_LANGUAGE,)) -> int:
+    """Build the keyboards of `languages` ahead of the first reply
+
+    Other languages' keyboards are built when first used, so their packs
+    aren't loaded at startup.
+    """
+    for lang in languages:
+        get_main_menu_keyboard(lang)
+        get_duration_keyboard(lang)
+        get_session_keyboard(lang)
+        get_leaderboard_keyboard(lang)
+        for bucket in range(unlock_buckets()):
+            for is_premium in (False, True):
+                _cached_keyboard(_plant_selection_rows, lang, bucket, is_premium)
+    return len(_keyboards)
 
 # ============= BOT STARTED =============
 
 @bot.on("bot_started")
+@instrumented
 def on_start(context):
     """Handle bot start"""
     user_id = str(context.update.get("user_id", "unknown"))
@@ -97,6 +243,7 @@ def on_start(context):
 # ============= COMMANDS =============
 
 @bot.command("start")
+@instrumented
 def start_command(context):
     """Main menu"""
     user_id = str(context.update.get("user_id", "unknown"))
@@ -121,14 +268,54 @@ def start_command(context):
     )
 
 @bot.command("forest")
+@instrumented
 def forest_command(context):
     """Show user's forest"""
     user_id = str(context.update.get("user_id", "unknown"))
     show_forest(context, user_id)
 
+@bot.command("profile")
+def profile_command(context):
+    """/profile [trace] [<seconds>s] [<updates>u] starts profiling, /profile stop ends it; admins only"""
+    user_id = str(context.update.get("user_id", "unknown"))
+    if user_id not in ADMIN_USER_IDS:
+        return
+    lang = db.get_user(user_id).get("language", "ru")
+    words = context.message["body"]["text"].split()[1:]
+    
+    if words[:1] == ["stop"]:
+        # The report is sent when the files are written
+        if profiler.stop() is None:
+            context.reply(get_message("profile_idle", lang))
+        return
+    
+    seconds = updates = None
+    trace = False
+    for word in words:
+        if word == "trace":
+            trace = True
+        elif word.endswith("u") and word[:-1].isdigit():
+            updates = int(word[:-1])
+        elif word.rstrip("s").isdigit():
+            seconds = int(word.rstrip("s"))
+    if seconds is None and updates is None:
+        seconds, updates = profiling.PROFILE_SECONDS, profiling.PROFILE_UPDATES
+    
+    chat_id = context.chat_id
+    
+    def done(result):
+        outbound.send_message(chat_id=chat_id, text=get_message("profile_done", lang, **result))
+    
+    if profiler.start(seconds, updates, trace, on_done=done):
+        context.reply(get_message("profile_started", lang, seconds=f"{seconds:g}" if seconds else "-",
+                                  updates=updates or "-"))
+    else:
+        context.reply(get_message("profile_busy", lang))
+
 # ============= CALLBACK HANDLERS =============
 
 @bot.on("message_callback")
+@instrumented
 def handle_callback(context):
     """Handle all button callbacks"""
     button = context.payload
@@ -156,6 +343,11 @@ def handle_callback(context):
     elif button == "settings":
         show_settings(context, user_id, is_current=True)
     
+    elif button == "leaderboard" or button.startswith("leaderboard_"):
+        stat = button[len("leaderboard_"):] or LEADERBOARD_STATS[0]
+        if stat in LEADERBOARD_STATS:
+            show_leaderboard(context, user_id, stat, is_current=True)
+    
     elif button == "back_to_menu":
         context.reply_callback(
             get_message("main_menu", lang),
@@ -173,8 +365,9 @@ def handle_callback(context):
             is_current=True
         )
         # Store selected duration temporarily
-        user["temp_duration"] = duration
-        db.update_user(user_id, user)
+        with db.locked(user_id) as user:
+            user["temp_duration"] = duration
+            db.update_user(user_id, user)
     
     # ===== PLANT SELECTION =====
     elif button.startswith("plant_"):
@@ -182,22 +375,20 @@ def handle_callback(context):
         duration = user.get("temp_duration", 25)
         
         plant_info = PLANT_SPECIES[plant_id]
-        plant_name = plant_info["name_ru"] if lang == "ru" else plant_info["name_en"]
+        plant_name = localized(plant_info, "name", lang)
         
         # Start session
-        db.start_session(user_id, duration, plant_id)
+        session = db.start_session(user_id, duration, plant_id, chat_id=context.chat_id)
+        session_timers.watch(user_id, session)
         
         context.reply_callback(
-            get_message("session_started", lang, 
+            get_message("session_started", lang,
                        duration=duration,
                        plant=plant_info["emoji"],
                        plant_name=plant_name),
             keyboard=get_session_keyboard(lang),
             is_current=True
         )
-        
-        # Schedule session end reminder (for production, use proper task queue)
-        # For hackathon MVP, just rely on user clicking complete button
     
     # ===== SESSION COMPLETION =====
     elif button == "complete_session":
@@ -206,7 +397,7 @@ def handle_callback(context):
         
         if not session:
             context.reply_callback(
-                "Нет активной сессии" if lang == "ru" else "No active session",
+                get_message("no_active_session", lang),
                 is_current=True
             )
             return
@@ -218,26 +409,31 @@ def handle_callback(context):
         
         if elapsed < required * 0.8:  # At least 80% completion
             context.reply_callback(
-                f"⏱️ Еще рано! Подождите еще {int(required * 0.8 - elapsed)} минут" 
-                if lang == "ru" 
-                else f"⏱️ Too early! Wait {int(required * 0.8 - elapsed)} more minutes",
+                get_message("too_early", lang, minutes=int(required * 0.8 - elapsed)),
                 is_current=True
             )
             return
         
-        # Complete session
-        plant = db.complete_session(user_id)
+        # Complete session; new achievements are saved in the same write
+        with db.locked(user_id):
+            plant = db.complete_session(user_id)
+            achievement_text = check_achievements(user_id, lang, SESSION_STATS) if plant else ""
+        session_timers.forget(user_id)
+        if plant is None:
+            # Completed by another update in the meantime
+            context.reply_callback(
+                get_message("no_active_session", lang),
+                is_current=True
+            )
+            return
         user = db.get_user(user_id)  # Refresh user data
         
         plant_info = PLANT_SPECIES[plant["type"]]
-        plant_name = plant_info["name_ru"] if lang == "ru" else plant_info["name_en"]
-        
-        # Check for new achievements
-        achievement_text = check_achievements(user_id, lang)
+        plant_name = localized(plant_info, "name", lang)
         
         # Check for milestones
         if user["stats"]["current_streak"] in [3, 7, 14, 30, 50, 100]:
-            achievement_text += f"\n\n🎊 Серия {user['stats']['current_streak']} дней!" if lang == "ru" else f"\n\n🎊 {user['stats']['current_streak']} day streak!"
+            achievement_text += get_message("streak_milestone", lang, days=user["stats"]["current_streak"])
         
         context.reply_callback(
             get_message("session_completed", lang,
@@ -253,6 +449,7 @@ def handle_callback(context):
     
     elif button == "abandon_session":
         db.abandon_session(user_id)
+        session_timers.forget(user_id)
         context.reply_callback(
             get_message("plant_died", lang),
             keyboard=get_main_menu_keyboard(lang),
@@ -303,27 +500,27 @@ def show_statistics(context, user_id: str, is_current: bool = False):
     
     stats = user["stats"]
     
-    message = f"""📊 **Статистика**
-
-🌳 Растений выращено: {stats['total_plants']}
-⏱️ Время фокуса: {stats['total_focus_minutes']} минут ({round(stats['total_focus_minutes']/60, 1)} часов)
-🔥 Текущая серия: {stats['current_streak']} дней
-🏆 Лучшая серия: {stats['longest_streak']} дней
-💎 Заморозок серии: {stats['streak_freezes']}
-
-📅 Последняя активность: {stats['last_activity_date'] or 'Никогда'}
-🎯 Создан: {user['created_at'][:10]}
-""" if lang == "ru" else f"""📊 **Statistics**
-
-🌳 Plants grown: {stats['total_plants']}
-⏱️ Focus time: {stats['total_focus_minutes']} minutes ({round(stats['total_focus_minutes']/60, 1)} hours)
-🔥 Current streak: {stats['current_streak']} days
-🏆 Best streak: {stats['longest_streak']} days
-💎 Streak freezes: {stats['streak_freezes']}
-
-📅 Last activity: {stats['last_activity_date'] or 'Never'}
-🎯 Created: {user['created_at'][:10]}
-"""
+    message = get_message("statistics", lang,
+                         total_plants=stats["total_plants"],
+                         minutes=stats["total_focus_minutes"],
+                         hours=round(stats["total_focus_minutes"] / 60, 1),
+                         streak=stats["current_streak"],
+                         best_streak=stats["longest_streak"],
+                         freezes=stats["streak_freezes"],
+                         last_activity=stats["last_activity_date"] or get_message("never", lang),
+                         created=user["created_at"][:10])
+    
+    # Rolling sums: the same cost however long the history
+    series = daily_series(user)
+    today = day_number(datetime.now().date())
+    week_minutes, week_plants = series.totals(today, 7)
+    month_minutes, month_plants = series.totals(today, 30)
+    message += get_message("statistics_recent", lang,
+                           week_minutes=week_minutes, week_plants=week_plants,
+                           month_minutes=month_minutes, month_plants=month_plants,
+                           best_day=get_message("never", lang) if series.best_day is None
+                           else format_day(series.best_day),
+                           best_minutes=series.best_minutes)
     
     context.reply_callback(
         message,
@@ -336,13 +533,13 @@ def show_achievements(context, user_id: str, is_current: bool = False):
     user = db.get_user(user_id)
     lang = user.get("language", "ru")
     
-    message = "🏆 **Достижения**\n\n" if lang == "ru" else "🏆 **Achievements**\n\n"
+    message = get_message("achievements_title", lang)
     
     for ach_id, ach_info in ACHIEVEMENTS.items():
         earned = ach_id in user.get("achievements", [])
         status = "✅" if earned else "🔒"
-        name = ach_info["name_ru"] if lang == "ru" else ach_info.get("name_en", ach_info["name_ru"])
-        desc = ach_info["description_ru"] if lang == "ru" else ach_info.get("description_en", ach_info["description_ru"])
+        name = localized(ach_info, "name", lang)
+        desc = localized(ach_info, "description", lang)
         
         message += f"{status} {ach_info['icon']} **{name}**\n{desc}\n\n"
     
@@ -357,19 +554,7 @@ def show_settings(context, user_id: str, is_current: bool = False):
     user = db.get_user(user_id)
     lang = user.get("language", "ru")
     
-    message = """⚙️ **Настройки**
-
-🌍 Язык: Русский
-⏱️ Длительность по умолчанию: 25 минут
-
-Скоро появятся дополнительные настройки!
-""" if lang == "ru" else """⚙️ **Settings**
-
-🌍 Language: Russian
-⏱️ Default duration: 25 minutes
-
-More settings coming soon!
-"""
+    message = get_message("settings", lang)
     
     context.reply_callback(
         message,
@@ -377,40 +562,182 @@ More settings coming soon!
         is_current=is_current
     )
 
-def check_achievements(user_id: str, lang: str = "ru") -> str:
-    """Check and award new achievements"""
+def _public_name(user_id: str) -> str:
+    # Users have no public names; show just enough to tell them apart
+    return "•••" + user_id[-4:]
+
+def show_leaderboard(context, user_id: str, stat: str = "total_plants", is_current: bool = False):
+    """Show the best users by a stat and the user's own rank"""
     user = db.get_user(user_id)
-    earned_achievements = user.get("achievements", [])
-    new_achievements = []
+    lang = user.get("language", "ru")
     
-    for ach_id, ach_info in ACHIEVEMENTS.items():
-        if ach_id not in earned_achievements:
-            if ach_info["condition"](user):
-                earned_achievements.append(ach_id)
-                new_achievements.append(ach_info)
+    rows = []
+    for rank, other_id, score in leaderboard.top(stat, LEADERBOARD_SIZE):
+        name = get_message("leaderboard_you", lang) if other_id == user_id else _public_name(other_id)
+        rows.append(get_message("leaderboard_row", lang, rank=rank, user=name, score=score))
+    
+    own = leaderboard.rank(stat, user_id)
+    if own:
+        your_rank = get_message("leaderboard_your_rank", lang, rank=own[0], score=own[1], total=own[2])
+    else:
+        your_rank = get_message("leaderboard_unranked", lang)
+    
+    message = get_message("leaderboard", lang,
+                         title=get_message(f"leaderboard_{stat}", lang),
+                         rows="\n".join(rows) or get_message("leaderboard_empty", lang),
+                         your_rank=your_rank)
+    
+    context.reply_callback(
+        message,
+        keyboard=get_leaderboard_keyboard(lang),
+        is_current=is_current
+    )
+
+def check_achievements(user_id: str, lang: str = "ru", changed=None) -> str:
+    """Award achievements reached by the changed stats, all of them when None"""
+    # Held across the check so a concurrent update can't award one twice
+    with db.locked(user_id) as user:
+        earned_achievements = user.get("achievements", [])
+        new_ids = achievement_index.new_achievements(user["stats"], earned_achievements, changed)
+        if new_ids:
+            earned_achievements.extend(new_ids)
+            user["achievements"] = earned_achievements
+            db.update_user(user_id, user)
+    new_achievements = [ACHIEVEMENTS[ach_id] for ach_id in new_ids]
     
     if new_achievements:
-        user["achievements"] = earned_achievements
-        db.update_user(user_id, user)
-        
-        text = "\n\n🎊 **Новое достижение!**\n\n" if lang == "ru" else "\n\n🎊 **New Achievement!**\n\n"
+        text = get_message("new_achievement", lang)
         for ach in new_achievements:
-            name = ach["name_ru"] if lang == "ru" else ach.get("name_en", ach["name_ru"])
+            name = localized(ach, "name", lang)
             text += f"{ach['icon']} **{name}**\n"
         return text
     
     return ""
 
+def notify_session_end(user_id: str, session: dict):
+    """Remind the user to complete a session whose time is up"""
+    if session.get("chat_id") is None:
+        # Started before reminders were sent
+        return
+    lang = db.get_user(user_id).get("language", "ru")
+    plant_info = PLANT_SPECIES.get(session["plant_type"], {})
+    outbound.send_message(
+        session["chat_id"],
+        get_message("session_ready", lang,
+                    plant=plant_info.get("emoji", "🌱"),
+                    duration=session["duration_minutes"]),
+        [get_session_keyboard(lang).to_attachment()]
+    )
+
+def remind_streaks(user_ids):
+    """Warn users who haven't grown a plant today that their streak ends tonight"""
+    today = datetime.now().date().isoformat()
+    messages = []
+    for user_id in user_ids:
+        if not str(user_id).isdigit():
+            # Such as the "unknown" user of updates without a sender: nobody to write to
+            continue
+        try:
+            user = db.get_user(user_id)
+            stats = user["stats"]
+            if stats["last_activity_date"] == today or not stats["current_streak"]:
+                continue
+            lang = user.get("language", "ru")
+            messages.append((None, int(user_id),
+                             get_message("streak_at_risk", lang, streak=stats["current_streak"]),
+                             [get_main_menu_keyboard(lang).to_attachment()]))
+        except Exception:
+            # One broken user must not cost everyone else their reminder
+            logger.exception("Streak reminder for %s failed", user_id)
+    outbound.send_many(messages)
+
+def schedule_streak_reminders(summary: dict):
+    """Remind the users the streak job found at risk later in the day"""
+    due = datetime.now().replace(hour=STREAK_REMINDER_HOUR, minute=0, second=0, microsecond=0)
+    session_timers.scheduler.schedule("streak_reminders", max(due.timestamp(), time.time()),
+                                      remind_streaks, summary["at_risk_users"])
+
+# Messages the bot sends on its own, paced and retried; started by the entry point
+outbound = OutboundQueue(os.getenv("BOT_TOKEN"))
+
+# Fires the reminders and expires forgotten sessions; started by the entry point
+session_timers = SessionTimers(db, notify_session_end)
+
+# Kept current by completed sessions; filled from the stored users by the entry point
+leaderboard = Leaderboard()
+db.stats_listeners.append(leaderboard.update)
+
+# Read when scraped, so they cost nothing in between
+metrics.registry.gauge("forest_users", "Users stored", db.count_users)
+metrics.registry.gauge("forest_active_sessions", "Focus sessions running", lambda: len(session_timers))
+metrics.registry.gauge("forest_db_memory_users", "Users held in memory by the database",
+                       db.memory_stats, ("kind",))
+metrics.registry.gauge("forest_scheduler_timers", "Timers waiting to fire",
+                       lambda: len(session_timers.scheduler))
+metrics.registry.gauge("forest_outbound_messages", "Outbound queue", outbound.stats, ("state",))
+
+def install_dispatcher():
+    """Hand updates to a worker pool; None when BOT_WORKERS=0 keeps them inline"""
+    global dispatcher
+    if dispatcher is None:
+        dispatcher = install_dispatch(bot)
+        if dispatcher is not None:
+            metrics.registry.gauge("forest_dispatcher", "Update dispatcher queue and counters",
+                                   dispatcher.stats, ("stat",))
+    return dispatcher
+
+def start_metrics_server():
+    """Serve /metrics on METRICS_PORT if it is set; returns the address or None"""
+    port = os.getenv("METRICS_PORT")
+    if not port:
+        return None
+    server = metrics.serve(int(port), os.getenv("METRICS_HOST", "127.0.0.1"))
+    return "http://%s:%s/metrics" % server.server_address[:2]
+
+def start_services():
+    """Start what runs beside the handlers; the entry points call this first"""
+    print(f"📨 Сообщений в очереди: {outbound.start()}")
+    print(f"⏰ Активных сессий: {session_timers.start()}")
+    print(f"🏅 Участников рейтинга: {leaderboard.rebuild(db.iter_users())}")
+    # Breaks lapsed streaks and spends freezes every night
+    streak_job.schedule(session_timers.scheduler, db, schedule_streak_reminders)
+    print(f"⌨️ Клавиатур подготовлено: {warm_keyboards()}")
+    metrics_address = start_metrics_server()
+    if metrics_address:
+        print(f"📈 Метрики: {metrics_address}")
+    # kill -USR2 <pid> switches profiling on and off
+    profiling.install_signal()
+
+def stop_services():
+    """Stop them once no more updates are handled"""
+    session_timers.close()
+    # What isn't sent yet stays in the outbox for the next start
+    outbound.close()
+    # Write out changes still waiting for the background flusher
+    db.flush()
+
+def raise_interrupt(signum, frame):
+    """SIGTERM handler: stop the way Ctrl+C does, so stop_services() still runs"""
+    raise KeyboardInterrupt
+
 # ============= RUN BOT =============
 
 if __name__ == "__main__":
     print("🤖 Лесной Фокус бот запускается...")
     print("✅ База данных инициализирована")
     print(f"🌱 Доступно растений: {len(PLANT_SPECIES)}")
+    install_dispatcher()
+    start_services()
+    # docker stop sends SIGTERM, which would skip the shutdown below
+    signal.signal(signal.SIGTERM, raise_interrupt)
     print("🚀 Бот запущен!\n")
     
     try:
         bot.run()
     except KeyboardInterrupt:
         print("\n🛑 Бот остановлен пользователем")
+    finally:
         bot.stop()
+        if dispatcher is not None:
+            dispatcher.close()
+        stop_services()
@@ -0,0 +1,481 @@
+"""Several bot processes, each handling its own share of the users
+
+One bot process runs its handlers on one core and holds all the users
+itself. The supervisor started here runs a router and N workers instead:
+
+- the router long-polls the API as the bot does and passes every update to
+  the worker owning its user, over a local queue;
+- each worker is bot_modernized.py on one partition of the users, with its
+  own data files (user_data.part0of4.json ...), outbox, timers, metrics
+  port and share of the outbound rate;
+- completed sessions are passed on to the other workers, so each of them
+  keeps the whole leaderboard.
+
+A user belongs to partition blake2b(user_id) % N. Data written by a single
+process, or by a different N, is split into partitions once, with the bot
+stopped:
+
+    python cluster.py split --workers 4
+    python cluster.py run --workers 4
+
+Every database holds an exclusive lock on its files while open (see
+database.ProcessLock), so a second bot or worker on the same data refuses
+to start instead of overwriting it.
+"""
+from datetime import datetime
+from typing import List
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import signal
+import sys
+import threading
+
+from dotenv import load_dotenv
+
+import migrate
+import profiling
+from database import DatabaseLocked, SQLiteUserDatabase, UserDatabase
+from dispatch import update_key
+
+logger = logging.getLogger(__name__)
+
+# Updates waiting per worker; beyond this the router stops polling
+INBOX_SIZE = int(os.getenv("CLUSTER_INBOX_SIZE", "1000"))
+# Leaderboard entries per message when a worker shares its boards
+SHARE_BATCH = 10000
+# Seconds between checks that the workers are running
+RESTART_DELAY = 1.0
+# Seconds a worker has to finish its updates when the cluster stops
+STOP_TIMEOUT = 60.0
+# Exit code of a worker whose partition another process holds
+EXIT_LOCKED = 3
+
+def partition_of(user_id: str, count: int) -> int:
+    """Partition owning a user; unrelated to shard_of, so shards stay even"""
+    if count <= 1:
+        return 0
+    digest = hashlib.blake2b(user_id.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % count
+
+def partition_path(path: str, index: int, count: int) -> str:
+    # user_data.json -> user_data.part0of4.json
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.part{index}of{count}{ext}"
+
+def partition_environ(index: int, count: int) -> dict:
+    """DATA_FILE and the file overrides of one partition"""
+    environ = {"DATA_FILE": partition_path(os.getenv("DATA_FILE", "user_data.json"), index, count)}
+    for name in ("DATA_DB_FILE", "OUTBOX_FILE"):
+        if os.getenv(name):
+            environ[name] = partition_path(os.environ[name], index, count)
+    return environ
+
+def worker_environ(index: int, count: int) -> dict:
+    # Imported here: outbound reads its settings at import, and a worker
+    # imports this module before it has its own
+    from outbound import BURST, RATE
+    
+    environ = partition_environ(index, count)
+    # The API's limit is the bot's, whichever process sends
+    environ["OUTBOUND_RATE"] = str(RATE / count)
+    environ["OUTBOUND_BURST"] = str(max(1.0, BURST / count))
+    if os.getenv("METRICS_PORT"):
+        environ["METRICS_PORT"] = str(int(os.environ["METRICS_PORT"]) + index)
+    environ["PROFILE_DIR"] = os.path.join(profiling.profile_dir(), f"worker{index}")
+    return environ
+
+def _files(environ: dict) -> tuple:
+    """(database, outbox) files under the DATA_* settings in environ"""
+    data_file = environ.get("DATA_FILE") or "user_data.json"
+    stem = os.path.splitext(data_file)[0]
+    database = data_file
+    if os.getenv("DATA_BACKEND", "json") == "sqlite":
+        database = environ.get("DATA_DB_FILE") or stem + ".db"
+    return database, environ.get("OUTBOX_FILE") or stem + ".outbox.db"
+
+def _has_data(path: str) -> bool:
+    if os.getenv("DATA_BACKEND", "json") == "sqlite":
+        return os.path.exists(path)
+    stem = os.path.splitext(path)[0]
+    return any(os.path.exists(name) for name in (path, path + ".log", stem + ".snap", stem + ".snap.log")) \
+        or bool(migrate.find_shards(path) or migrate.find_shards(stem + ".snap"))
+
+def partition_counts(path: str) -> set:
+    """Worker counts of the partitions found next to the database at `path`"""
+    directory, name = os.path.split(path)
+    pattern = re.compile(re.escape(os.path.splitext(name)[0]) + r"\.part\d+of(\d+)\.")
+    return {int(match.group(1)) for match in map(pattern.match, os.listdir(directory or "."))
+            if match}
+
+def _sources(count: int) -> List[dict]:
+    """Settings of every data set not split into `count` partitions, oldest first"""
+    base = _files(os.environ)[0]
+    sources = [{}] if _has_data(base) else []
+    for other in sorted(partition_counts(base) - {count}):
+        sources += [environ for environ in (partition_environ(i, other) for i in range(other))
+                    if _has_data(_files(dict(os.environ, **environ))[0])]
+    return sources
+
+# ============= SPLIT =============
+
+def _open_database(path: str):
+    if os.getenv("DATA_BACKEND", "json") == "sqlite":
+        return SQLiteUserDatabase(path)
+    return UserDatabase(path)
+
+def _split_archive(path: str, count: int, archives: list) -> int:
+    """Append a JSON backend's archived plants to the partitions' archives"""
+    if not os.path.exists(path):
+        return 0
+    moved = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                user_id = json.loads(line)["id"]
+            except (ValueError, KeyError, TypeError):
+                # Torn by a crash; the users' records don't count it
+                continue
+            archives[partition_of(user_id, count)].write(line.rstrip(b"\n") + b"\n")
+            moved += 1
+    return moved
+
+def _split_outbox(path: str, count: int, outboxes: list) -> int:
+    """Move unsent messages to the outboxes of their users' partitions"""
+    from outbound import Outbox
+    
+    if not os.path.exists(path):
+        return 0
+    source = Outbox(path)
+    try:
+        batches = [[] for _ in range(count)]
+        for message_id, chat_id, user_id, attempts in source.pending():
+            key = user_id if user_id is not None else chat_id
+            index = partition_of(str(key), count) if key is not None else 0
+            batches[index].append((chat_id, user_id, source.body(message_id), attempts))
+    finally:
+        source.close()
+    for outbox, batch in zip(outboxes, batches):
+        ids = outbox.add([message[:3] for message in batch])
+        for message_id, message in zip(ids, batch):
+            if message[3]:
+                outbox.set_attempts(message_id, message[3])
+    return sum(map(len, batches))
+
+def _old_files(environ: dict) -> list:
+    """Files a data set was kept in, to be moved aside once it is split"""
+    database, outbox = _files(dict(os.environ, **environ))
+    directory, name = os.path.split(database)
+    stem = os.path.splitext(name)[0]
+    # The base data's prefix also covers every partition
+    partition = re.compile(re.escape(stem) + r"\.part\d+of\d+\.")
+    names = [os.path.join(directory, other) for other in os.listdir(directory or ".")
+             if (other == name or other.startswith(stem + ".")) and
+             (environ or not partition.match(other))]
+    names += glob.glob(glob.escape(outbox) + "*")
+    return sorted(set(names))
+
+def split(count: int, batch: int = 10000) -> tuple:
+    """Redistribute all users into `count` partitions; totals read and written"""
+    from outbound import Outbox
+    
+    base = _files(os.environ)[0]
+    if count in partition_counts(base):
+        raise ValueError(f"{base} is already split into {count} partitions")
+    sources = _sources(count)
+    if not sources:
+        raise ValueError(f"No data found at {base}")
+    
+    sqlite = os.getenv("DATA_BACKEND", "json") == "sqlite"
+    targets = [dict(os.environ, **partition_environ(i, count)) for i in range(count)]
+    paths = [_files(environ)[0] for environ in targets]
+    # A single file each; a JSON database shards it on first open
+    sinks, archives, outboxes = [], [], []
+    read = migrate.Totals()
+    try:
+        for environ, path in zip(targets, paths):
+            sinks.append(migrate.open_sink(path, "sqlite" if sqlite else "sharded", 1))
+            if not sqlite:
+                archives.append(open(os.path.splitext(path)[0] + ".archive.jsonl", 'ab'))
+            outboxes.append(Outbox(_files(environ)[1]))
+        for environ in sources:
+            database_path, outbox_path = _files(dict(os.environ, **environ))
+            print(f"Splitting {database_path}", file=sys.stderr)
+            database = _open_database(database_path)
+            try:
+                for user_id, user in database.iter_users():
+                    if not isinstance(user, dict):
+                        user = user.to_dict()
+                    sinks[partition_of(user_id, count)].write(user_id, user)
+                    read.add(user_id, user)
+                    if read.count % batch == 0:
+                        for sink in sinks:
+                            sink.checkpoint()
+                        print(f"{read.count} users", file=sys.stderr)
+            finally:
+                database.close()
+            if not sqlite:
+                _split_archive(database.archive_path, count, archives)
+            _split_outbox(outbox_path, count, outboxes)
+    except BaseException:
+        # Half written partitions would pass for split ones
+        for f in archives:
+            f.close()
+        for outbox in outboxes:
+            outbox.close()
+        for sink in sinks:
+            try:
+                sink.close()
+            except Exception:
+                pass
+        for i in range(count):
+            for name in _old_files(partition_environ(i, count)):
+                os.remove(name)
+        raise
+    for sink in sinks:
+        sink.close()
+    for f in archives:
+        f.close()
+    for outbox in outboxes:
+        outbox.close()
+    
+    written = migrate.Totals()
+    for path in paths:
+        totals = migrate.scan(path, "sqlite" if sqlite else "json")
+        written.count += totals.count
+        written.checksum = (written.checksum + totals.checksum) % migrate.CHECKSUM_MOD
+    if read == written:
+        # Kept rather than deleted, as migrate does with replaced files
+        backup = os.path.join(os.path.dirname(base),
+                              datetime.now().strftime("before-split-%Y%m%d-%H%M%S"))
+        os.makedirs(backup)
+        for environ in sources:
+            for name in _old_files(environ):
+                os.replace(name, os.path.join(backup, os.path.basename(name)))
+        print(f"Old files moved to {backup}", file=sys.stderr)
+    return read, written
+
+# ============= WORKERS =============
+
+def _work(index: int, count: int, inbox, events, environ: dict):
+    """A worker process: bot_modernized on one partition, fed by the router"""
+    # Ctrl+C reaches the whole process group; the supervisor stops workers in order
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Before bot_modernized and the modules it imports read their settings
+    os.environ.update(environ)
+    # Nothing waits for the router to read what is left when the worker exits
+    events.cancel_join_thread()
+    try:
+        import bot_modernized
+    except DatabaseLocked as e:
+        print(f"🔒 {e}", file=sys.stderr)
+        sys.exit(EXIT_LOCKED)
+    from bot_modernized import bot, db, leaderboard
+    
+    def share(user_id: str, stats):
+        events.put(("stats", [(user_id, {stat: stats.get(stat) for stat in leaderboard.stats})], None))
+    
+    db.stats_listeners.append(share)
+    dispatcher = bot_modernized.install_dispatcher()
+    bot_modernized.start_services()
+    events.put(("ready",))
+    
+    while True:
+        message = inbox.get()
+        if message is None:
+            break
+        if message[0] == "update":
+            try:
+                bot._process_update(message[1])
+            except Exception:
+                logger.exception("Worker %d failed to handle an update", index)
+        elif message[0] == "stats":
+            for user_id, stats in message[1]:
+                leaderboard.update(user_id, stats)
+        elif message[0] == "share":
+            # The own users' scores, for the worker named or for all
+            own = [entry for entry in leaderboard.entries() if partition_of(entry[0], count) == index]
+            for start in range(0, len(own), SHARE_BATCH):
+                events.put(("stats", own[start:start + SHARE_BATCH], message[1]))
+    
+    if dispatcher is not None:
+        dispatcher.close()
+    bot_modernized.stop_services()
+
+class _Worker:
+    """A worker process and the queues it was started with"""
+    
+    def __init__(self, context, index: int, count: int):
+        self.index = index
+        # Fresh queues for every start: one a process died reading may stay locked
+        self.inbox = context.Queue(INBOX_SIZE)
+        self.events = context.Queue()
+        self.process = context.Process(
+            target=_work, name=f"worker{index}",
+            args=(index, count, self.inbox, self.events, worker_environ(index, count)))
+
+class Supervisor:
+    """Routes updates to the workers, relays their scores and restarts them"""
+    
+    def __init__(self, count: int):
+        self.count = count
+        self.error = None
+        self._context = multiprocessing.get_context("spawn")
+        self._workers = [None] * count
+        self._stopping = threading.Event()
+    
+    def _start(self, index: int):
+        worker = _Worker(self._context, index, self.count)
+        worker.process.start()
+        self._workers[index] = worker
+        threading.Thread(target=self._relay, args=(worker,), name=f"relay{index}",
+                         daemon=True).start()
+    
+    def _send(self, index: int, message) -> bool:
+        """Queue a message for a worker, waiting while its inbox is full"""
+        while not self._stopping.is_set():
+            # A restarted worker has a new inbox
+            try:
+                self._workers[index].inbox.put(message, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def submit(self, update: dict):
+        """Pass an update to the worker owning its user; replaces bot._process_update"""
+        key = update_key(update)
+        self._send(partition_of(key, self.count) if key is not None else 0, ("update", update))
+    
+    def _relay(self, worker: _Worker):
+        """Pass a worker's scores on to the others until it exits"""
+        while True:
+            try:
+                event = worker.events.get(timeout=1)
+            except queue.Empty:
+                if not worker.process.is_alive() or self._stopping.is_set():
+                    return
+                continue
+            if event[0] == "ready":
+                logger.info("Worker %d is ready", worker.index)
+                # Its boards hold only its own users, the others' may be stale
+                for index in range(self.count):
+                    if index != worker.index:
+                        self._send(index, ("share", worker.index))
+                self._send(worker.index, ("share", None))
+            elif event[0] == "stats":
+                _, entries, target = event
+                for index in ([target] if target is not None else range(self.count)):
+                    if index != worker.index:
+                        self._send(index, ("stats", entries))
+    
+    def _monitor(self):
+        while not self._stopping.wait(RESTART_DELAY):
+            for index, worker in enumerate(self._workers):
+                if worker.process.is_alive():
+                    continue
+                if worker.process.exitcode == EXIT_LOCKED:
+                    self.error = f"partition {index} is in use by another process"
+                    # Stops polling in the main thread
+                    os.kill(os.getpid(), signal.SIGTERM)
+                    return
+                logger.warning("Worker %d exited with code %s; starting it again",
+                               index, worker.process.exitcode)
+                self._start(index)
+    
+    def forward_signal(self, signum, frame):
+        for worker in self._workers:
+            if worker is not None and worker.process.is_alive():
+                os.kill(worker.process.pid, signum)
+    
+    def start(self):
+        for index in range(self.count):
+            self._start(index)
+        threading.Thread(target=self._monitor, name="cluster-monitor", daemon=True).start()
+    
+    def stop(self):
+        """Let the workers finish the updates they were given, then wait for them"""
+        self._stopping.set()
+        for worker in self._workers:
+            try:
+                worker.inbox.put(None, timeout=STOP_TIMEOUT)
+            except queue.Full:
+                worker.process.terminate()
+        for worker in self._workers:
+            worker.process.join(STOP_TIMEOUT)
+            if worker.process.is_alive():
+                logger.error("Worker %d did not stop in time", worker.index)
+                worker.process.terminate()
+                worker.process.join()
+            # What a worker that died left in its inbox is not waited for
+            worker.inbox.cancel_join_thread()
+
+def _raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+def run(count: int):
+    from maxgram import Bot
+    
+    bot = Bot(os.getenv("BOT_TOKEN"))
+    if os.getenv("MAX_API_URL"):
+        bot.api.client.BASE_URL = os.getenv("MAX_API_URL")
+    supervisor = Supervisor(count)
+    bot._process_update = supervisor.submit
+    
+    print(f"🤖 Лесной Фокус бот запускается, рабочих процессов: {count}...")
+    # docker stop sends SIGTERM; stop as on Ctrl+C
+    signal.signal(signal.SIGTERM, _raise_interrupt)
+    if hasattr(signal, "SIGUSR2"):
+        # kill -USR2 <pid> switches profiling on and off in every worker
+        signal.signal(signal.SIGUSR2, supervisor.forward_signal)
+    supervisor.start()
+    try:
+        bot.run()
+    except KeyboardInterrupt:
+        print("\n🛑 Бот остановлен")
+    finally:
+        bot.stop()
+        supervisor.stop()
+    if supervisor.error:
+        print(f"🔒 {supervisor.error}", file=sys.stderr)
+        sys.exit(1)
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, text in (("run", "start the router and the workers"),
+                       ("split", "split the users into partitions, with the bot stopped")):
+        command = commands.add_parser(name, help=text)
+        command.add_argument("--workers", type=int,
+                             default=int(os.getenv("CLUSTER_WORKERS", str(os.cpu_count() or 1))))
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be 1 or more")
+    
+    if args.command == "split":
+        try:
+            read, written = split(args.workers)
+        except (ValueError, DatabaseLocked) as e:
+            parser.exit(1, f"{e}\n")
+        print(f"source:      {read}")
+        print(f"partitions:  {written}")
+        if read != written:
+            print("MISMATCH", file=sys.stderr)
+            sys.exit(1)
+        print("OK")
+        return
+    
+    if _sources(args.workers):
+        parser.exit(1, f"Data is not split into {args.workers} partitions yet; "
+                       f"stop the bot and run: python cluster.py split --workers {args.workers}\n")
+    run(args.workers)
+
+if __name__ == "__main__":
+    main()
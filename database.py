@@ -1,121 +1,1542 @@
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
+import itertools
 import json
+import logging
 import os
+import re
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import functools
+import gc
+import inspect
+import time
+try:
+    import fcntl
+except ImportError:
+    # Windows: no flock, so databases open unlocked
+    fcntl = None
+
+import metrics
+import snapshot
+from profiling import profiler
+from models import RECENT_PLANTS, PlantList, User, daily_series, day_number
+
+logger = logging.getLogger(__name__)
+
+OPERATIONS = metrics.registry.counter(
+    "forest_db_operations_total", "Database calls by method, not counting calls made by other methods",
+    ("operation",))
+SAVE_SECONDS = metrics.registry.histogram(
+    "forest_db_save_seconds", "Time to write a batch of changed users to the data files")
+SAVED_BYTES = metrics.registry.counter("forest_db_saved_bytes_total", "Bytes written to the data files")
+SAVED_USERS = metrics.registry.counter("forest_db_saved_users_total", "Users written to the data files")
+
+# How deep the current thread is in counted database calls
+_calls = threading.local()
+
+def _counted(method):
+    """Count calls of a public database method in OPERATIONS, and profile them when on"""
+    name = method.__name__
+    label = "db:" + name
+    if inspect.isgeneratorfunction(method):
+        return _counted_generator(method, name, label)
+    
+    @functools.wraps(method)
+    def counted(self, *args, **kwargs):
+        if getattr(_calls, "depth", 0):
+            return method(self, *args, **kwargs)
+        _calls.depth = 1
+        try:
+            if profiler.active:
+                return profiler.call(label, method, self, *args, **kwargs)
+            return method(self, *args, **kwargs)
+        finally:
+            _calls.depth = 0
+            OPERATIONS.inc(name)
+    return counted
+
+def _counted_generator(method, name: str, label: str):
+    """_counted for scans: what counts is the time spent producing the items,
+    not creating the generator or the caller's work between items"""
+    
+    @functools.wraps(method)
+    def counted(self, *args, **kwargs):
+        if getattr(_calls, "depth", 0):
+            yield from method(self, *args, **kwargs)
+            return
+        iterator = method(self, *args, **kwargs)
+        if profiler.active:
+            iterator = profiler.iterate(label, iterator)
+        try:
+            while True:
+                # Only while producing an item: the caller's own calls between
+                # items are counted as usual
+                _calls.depth = 1
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    _calls.depth = 0
+                yield item
+        finally:
+            iterator.close()
+            OPERATIONS.inc(name)
+    return counted
+
+def _profiled(method):
+    """Profile calls of a database method when profiling is on"""
+    label = "db:" + method.__name__
+    
+    @functools.wraps(method)
+    def profiled(self, *args, **kwargs):
+        if profiler.active:
+            return profiler.call(label, method, self, *args, **kwargs)
+        return method(self, *args, **kwargs)
+    return profiled
+
+def _new_user(user_id: str) -> dict:
+    """Default profile for a user seen for the first time"""
+    return {
+        "user_id": user_id,
+        "created_at": datetime.now().isoformat(),
+        "language": "ru",
+        "plants": [],
+        "current_session": None,
+        "stats": {
+            "total_focus_minutes": 0,
+            "total_plants": 0,
+            "current_streak": 0,
+            "longest_streak": 0,
+            "last_activity_date": None,
+            "streak_freezes": 2
+        },
+        "preferences": {
+            "session_duration": 25,
+            "favorite_plant": "🌱"
+        },
+        "achievements": []
+    }
+
+def _advance_streak(stats: dict):
+    """Update streak counters for activity today"""
+    today = datetime.now().date().isoformat()
+    last_activity = stats["last_activity_date"]
+    
+    if last_activity == today:
+        pass
+    elif last_activity == (datetime.now().date() - timedelta(days=1)).isoformat():
+        stats["current_streak"] += 1
+        if stats["current_streak"] > stats["longest_streak"]:
+            stats["longest_streak"] = stats["current_streak"]
+    else:
+        stats["current_streak"] = 1
+    
+    stats["last_activity_date"] = today
+
+# Where a user's raw JSON lives on disk
+SNAPSHOT, LOG = 0, 1
+
+# Layout of the .idx file and of the shard it indexes. A shard whose index
+# has another version is read once and rewritten (plants stored as
+# columns go back to the plant list).
+INDEX_VERSION = 2
+
+def shard_paths(path: str, count: int) -> List[str]:
+    """File names of `count` shards of the snapshot at `path`"""
+    if count <= 1:
+        return [path]
+    # user_data.json -> user_data.00.json ... user_data.63.json
+    stem, ext = os.path.splitext(path)
+    width = max(2, len(str(count - 1)))
+    return [f"{stem}.{i:0{width}d}{ext}" for i in range(count)]
+
+def shard_of(user_id: str, count: int) -> int:
+    # crc32 is stable across processes, unlike hash()
+    return zlib.crc32(user_id.encode('utf-8')) % count if count > 1 else 0
+
+def _dump(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+@contextmanager
+def _gc_paused():
+    """Hold off the cyclic garbage collector while loading every user
+
+    Loading allocates millions of objects, none of them in cycles, and
+    each burst of allocations would start a collection walking them all.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def _stored(users: dict):
+    """(user_id, user) pairs in the form shards keep, for users read from any file
+
+    Plants stored as columns (see PlantList.from_columns) go back to the
+    plant list, which is what user_data.json holds for every other reader.
+    """
+    for user_id, user in users.items():
+        if isinstance(user, dict) and isinstance(user.get("plants"), dict):
+            user = User.from_dict(user).to_dict()
+        yield user_id, user
+
+class DatabaseLocked(RuntimeError):
+    pass
+
+class ProcessLock:
+    """Exclusive flock on <path>.lock while a database has its files open
+
+    Two processes writing the same data would overwrite each other's
+    changes, so the second one to open fails instead. The kernel drops the
+    lock with the process; a crash never leaves a stale one behind.
+    Databases opened on the same path within one process share the lock.
+    """
+    # Lock path -> [open lock file, databases holding it]
+    _held = {}
+    _held_lock = threading.Lock()
+    
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path) + ".lock"
+        self._released = fcntl is None
+        if fcntl is None:
+            return
+        with self._held_lock:
+            held = self._held.get(self.path)
+            if held is not None:
+                held[1] += 1
+                return
+            f = open(self.path, "a+", encoding="utf-8")
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.seek(0)
+                owner = f.read().strip() or "another process"
+                f.close()
+                raise DatabaseLocked(f"{path} is in use by {owner}") from None
+            # For whoever finds the file; the lock itself is what counts
+            f.truncate(0)
+            f.write(f"pid {os.getpid()}\n")
+            f.flush()
+            self._held[self.path] = [f, 1]
+    
+    def release(self):
+        with self._held_lock:
+            if self._released:
+                return
+            self._released = True
+            held = self._held[self.path]
+            held[1] -= 1
+            if not held[1]:
+                del self._held[self.path]
+                fcntl.flock(held[0].fileno(), fcntl.LOCK_UN)
+                held[0].close()
+
+class _Shard:
+    """One snapshot file, its log and the on-disk index of both"""
+    
+    def __init__(self, path: str, binary: bool = False):
+        self.path = path
+        self.binary = binary
+        self.log_path = path + ".log"
+        self.index_path = path + ".idx"
+        self.log_file = None
+        self.log_size = 0
+        self.log_records = 0
+        self._readers = {}
+        # user_id -> (SNAPSHOT or LOG, offset, length) of the user's record
+        self.index = {}
+        # Bytes written to the shard's files so far
+        self.bytes_written = 0
+    
+    def load(self, models: bool = False) -> dict:
+        """Read every user of the shard into memory
+
+        With `models`, binary snapshot records come back as models.User,
+        decoded straight from their stored fields.
+        """
+        data = {}
+        if os.path.exists(self.path) and self.binary:
+            data = snapshot.load_users(self.path) if models else snapshot.load(self.path)
+        elif os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        # Replayed even with the journal switched off, so records logged
+        # before are not lost
+        for user_id, location, user in self.replay_log():
+            data[user_id] = user
+        return data
+    
+    def replay_log(self):
+        """Yield (user_id, location, user) for each logged record"""
+        self.log_records = 0
+        if not os.path.exists(self.log_path):
+            return
+        offset = 0
+        torn = False
+        with open(self.log_path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                if record is None or not line.endswith(b"\n"):
+                    torn = True
+                    break
+                # Records are {"id":<id>,"user":<user>}\n
+                start = offset + len(b'{"id":') + len(_dump(record["id"])) + len(b',"user":')
+                yield record["id"], (LOG, start, offset + len(line) - 2 - start), record["user"]
+                offset += len(line)
+                self.log_records += 1
+        if torn:
+            # Torn write from a crash - cut it off so later appends stay readable
+            os.truncate(self.log_path, offset)
+        self.log_size = offset
+    
+    def _reader(self, source):
+        reader = self._readers.get(source)
+        if reader is None:
+            if source == SNAPSHOT and self.binary:
+                reader = snapshot.SnapshotReader(self.path)
+            else:
+                reader = open(self.log_path if source == LOG else self.path, 'rb')
+            self._readers[source] = reader
+        return reader
+    
+    def read_raw(self, location) -> bytes:
+        """Record bytes in the format of the file they live in"""
+        source, offset, length = location
+        reader = self._reader(source)
+        if source == SNAPSHOT and self.binary:
+            return reader.raw(offset, length)
+        reader.seek(offset)
+        return reader.read(length)
+    
+    def read_user(self, user_id: str, location) -> dict:
+        source, offset, length = location
+        if source == SNAPSHOT and self.binary:
+            return self._reader(source).decode_user(user_id, offset, length)
+        return json.loads(self.read_raw(location))
+    
+    def _close_readers(self):
+        for reader in self._readers.values():
+            reader.close()
+        self._readers = {}
+    
+    def write_snapshot(self, users) -> dict:
+        """Atomically replace the snapshot with (user_id, user) pairs
+
+        A user may be given as raw bytes from read_raw, which are copied
+        as is. Returns the new location of every user.
+        """
+        if self.binary:
+            return self._write_binary_snapshot(users)
+        locations = {}
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            # One compact record per line keeps the snapshot valid JSON
+            f.write(b"{")
+            position = 1
+            separator = b"\n"
+            for user_id, user in users:
+                body = user if isinstance(user, bytes) else _dump(user)
+                head = separator + _dump(user_id) + b": "
+                f.write(head)
+                f.write(body)
+                locations[user_id] = (SNAPSHOT, position + len(head), len(body))
+                position += len(head) + len(body)
+                separator = b",\n"
+            f.write(b"\n}\n")
+            f.flush()
+            os.fsync(f.fileno())
+            self.bytes_written += position + 3
+        os.replace(tmp_path, self.path)
+        self._close_readers()
+        return locations
+    
+    def _write_binary_snapshot(self, users) -> dict:
+        # Raw records refer to the current string table, so extend it
+        strings = self._reader(SNAPSHOT).strings if os.path.exists(self.path) else []
+        writer = snapshot.SnapshotWriter(self.path, strings)
+        try:
+            for user_id, user in users:
+                writer.add(user_id, user)
+        except BaseException:
+            writer.abort()
+            raise
+        self._close_readers()
+        locations = writer.close()
+        self.bytes_written += os.path.getsize(self.path)
+        return {user_id: (SNAPSHOT, offset, length)
+                for user_id, (offset, length) in locations.items()}
+    
+    def write_index(self, locations: dict):
+        """Store snapshot offsets so a restart can skip parsing the snapshot"""
+        if self.binary:
+            # Binary snapshots carry their own index
+            return
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(f"# {INDEX_VERSION} {self._snapshot_stamp()}\n")
+            for user_id, (source, offset, length) in locations.items():
+                f.write(f"{offset} {length} {json.dumps(user_id, ensure_ascii=False)}\n")
+        self.bytes_written += os.path.getsize(tmp_path)
+        os.replace(tmp_path, self.index_path)
+    
+    def _snapshot_stamp(self) -> str:
+        """Size and modification time of the snapshot, which the index must match
+
+        The size alone would take a snapshot replaced by one of the same
+        length, e.g. restored from a backup, for the one indexed.
+        """
+        stat = os.stat(self.path)
+        return f"{stat.st_size} {stat.st_mtime_ns}"
+    
+    def load_index(self) -> bool:
+        """Read the index if it matches the current snapshot"""
+        if self.binary and os.path.exists(self.path):
+            for user_id, (offset, length) in self._reader(SNAPSHOT).index().items():
+                self.index[user_id] = (SNAPSHOT, offset, length)
+            return True
+        if not os.path.exists(self.index_path) or not os.path.exists(self.path):
+            return False
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            if f.readline() != f"# {INDEX_VERSION} {self._snapshot_stamp()}\n":
+                return False
+            for line in f:
+                offset, length, user_id = line.rstrip("\n").split(" ", 2)
+                self.index[json.loads(user_id)] = (SNAPSHOT, int(offset), int(length))
+        return True
+    
+    def append(self, users) -> dict:
+        """Append (user_id, user) records to the log, returning their locations"""
+        if self.log_file is None:
+            self.log_file = open(self.log_path, 'ab')
+        locations = {}
+        lines = []
+        for user_id, user in users:
+            head = b'{"id":' + _dump(user_id) + b',"user":'
+            body = _dump(user)
+            locations[user_id] = (LOG, self.log_size + len(head), len(body))
+            lines.append(head + body + b"}\n")
+            self.log_size += len(head) + len(body) + 2
+        data = b"".join(lines)
+        self.log_file.write(data)
+        self.log_file.flush()
+        self.bytes_written += len(data)
+        self.log_records += len(lines)
+        return locations
+    
+    def truncate_log(self):
+        if self.log_file is not None:
+            self.log_file.close()
+        self.log_file = open(self.log_path, 'wb')
+        self.log_size = 0
+        self.log_records = 0
+        self._close_readers()
+    
+    def remove_log(self):
+        """Drop a log whose records are in the snapshot now"""
+        self.close()
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+        self.log_size = 0
+        self.log_records = 0
+    
+    def close(self):
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+        self._close_readers()
+
+# Stripes of per-user locks; users sharing a stripe wait for each other
+LOCK_STRIPES = 64
+
+class _UserLocks:
+    """Striped locks: one user's operations are serialized, other users' mostly not"""
+    
+    def __init__(self, stripes: int = LOCK_STRIPES):
+        self._locks = [threading.RLock() for _ in range(stripes)]
+    
+    def __call__(self, user_id: str) -> threading.RLock:
+        return self._locks[hash(user_id) % len(self._locks)]
+
+class _Scope(threading.local):
+    """Per-thread nesting of user locks and the changes made under them"""
+    depth = 0
+    
+    def __init__(self):
+        self.pending = set()
 
 class UserDatabase:
-    """Local JSON-based database for hackathon MVP"""
+    """Local JSON-based database for hackathon MVP
+
+    Each user's operations hold that user's lock, so they are atomic with
+    respect to each other while other users proceed in parallel. Changes are
+    written once the outermost user lock is released, under `_lock`, which
+    serializes persistence; `_io_lock` guards the shard files and indexes.
+    Locks are only taken in that order.
+    """
     
-    def __init__(self, filepath: str = None):
+    def __init__(self, filepath: str = None, journal: bool = None,
+                 flush_interval_ms: int = None, shards: int = None,
+                 cache_size: int = None, data_format: str = None):
         if filepath is None:
             # Use environment variable or default
             filepath = os.getenv("DATA_FILE", "user_data.json")
+        if journal is None:
+            # Append-only log instead of rewriting the whole file on every change
+            journal = os.getenv("DATA_JOURNAL", "0") == "1"
+        if flush_interval_ms is None:
+            # 0 keeps every change durable before the handler returns
+            flush_interval_ms = int(os.getenv("DATA_FLUSH_INTERVAL_MS", "0"))
+        if shards is None:
+            shards = int(os.getenv("DATA_SHARDS", "1"))
+        if cache_size is None:
+            # 0 keeps every user in memory; otherwise users load on first access
+            cache_size = int(os.getenv("DATA_CACHE_SIZE", "0"))
+        if data_format is None:
+            data_format = os.getenv("DATA_FORMAT", "json")
+        if data_format not in ("json", "binary"):
+            raise ValueError(f"Unknown DATA_FORMAT: {data_format}")
         self.filepath = filepath
+        self._process_lock = ProcessLock(filepath)
+        self.binary = data_format == "binary"
+        # Binary snapshots live next to the JSON file: user_data.snap
+        self.snapshot_path = os.path.splitext(filepath)[0] + ".snap" if self.binary else filepath
+        self.journal = journal
+        self.compact_every = int(os.getenv("DATA_COMPACT_EVERY", "10000"))
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_max_dirty = int(os.getenv("DATA_FLUSH_MAX_DIRTY", "1000"))
+        self.lazy = cache_size > 0
+        self.cache_size = cache_size
+        # Plants kept in memory per user before the older ones move to the
+        # archive file; 0 keeps them all
+        self.plants_hot = int(os.getenv("DATA_PLANTS_HOT", "0"))
+        # One archive whatever the shard count or format
+        self.archive_path = os.path.splitext(filepath)[0] + ".archive.jsonl"
+        self._archive_file = None
+        self._archive_lock = threading.Lock()
+        self.shards = [_Shard(path, self.binary) for path in shard_paths(self.snapshot_path, shards)]
+        self._user_locks = _UserLocks()
+        self._scope = _Scope()
+        self._lock = threading.RLock()
+        self._io_lock = threading.RLock()
+        self._cache_lock = threading.Lock()
+        # user_id -> (user, save number) changed but not written yet; the
+        # save number tells a later change from the one being written
+        self._dirty = {}
+        self._saves = itertools.count()
+        self._flush_cond = threading.Condition()
+        self._closed = False
+        # listener(user_id, stats), called with the user locked once a
+        # completed session has changed the user's stats
+        self.stats_listeners = []
         self.data = self._load_data()
+        with self._lock, self._io_lock:
+            for shard in self.shards:
+                # A log left from a run with the journal on is folded in too
+                if shard.log_records >= self.compact_every or (shard.log_records and not self.journal):
+                    self._compact_shard(shard)
+        
+        self._flusher = None
+        if self.flush_interval > 0:
+            self._flusher = threading.Thread(target=self._flush_loop,
+                                             name="db-flusher", daemon=True)
+            self._flusher.start()
+    
+    def _shard_for(self, user_id: str) -> _Shard:
+        return self.shards[shard_of(user_id, len(self.shards))]
+    
+    def _stale_shard_paths(self) -> List[str]:
+        """Shard files written with a different DATA_SHARDS or DATA_FORMAT"""
+        directory, name = os.path.split(self.filepath)
+        stem, ext = os.path.splitext(name)
+        # A shard may be down to its log if it was never compacted
+        pattern = re.compile(re.escape(stem) + r"\.\d+(" + re.escape(ext) + r"|\.snap)(?=(\.log)?$)")
+        current = {shard.path for shard in self.shards}
+        paths = {os.path.join(directory, match.group(0))
+                 for match in map(pattern.match, os.listdir(directory or ".")) if match}
+        return sorted(path for path in paths if path not in current)
     
     def _load_data(self) -> dict:
-        if os.path.exists(self.filepath):
-            with open(self.filepath, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return {}
+        # First start after switching on sharding or changing the format:
+        # import the single file(s) written before
+        current = {shard.path for shard in self.shards}
+        legacy = [_Shard(path, path.endswith(".snap"))
+                  for path in (self.filepath, os.path.splitext(self.filepath)[0] + ".snap")
+                  if path not in current and
+                  (os.path.exists(path) or os.path.exists(path + ".log"))]
+        stale = [_Shard(path, path.endswith(".snap")) for path in self._stale_shard_paths()]
+        if legacy or stale:
+            self._redistribute(legacy, stale)
+        
+        with ThreadPoolExecutor(max_workers=min(len(self.shards), os.cpu_count() or 1)) as pool:
+            list(pool.map(self._open_shard, self.shards))
+            if self.lazy:
+                return OrderedDict()
+            with _gc_paused():
+                parts = list(pool.map(self._load_users, self.shards))
+        data = {}
+        for part in parts:
+            data.update(part)
+        return data
+    
+    def _redistribute(self, legacy: List[_Shard], stale: List[_Shard]):
+        """Move users into the shards that own them now, then retire old files"""
+        # Oldest sources first so newer records win
+        sources = legacy + stale + self.shards
+        with ThreadPoolExecutor(max_workers=min(len(sources), os.cpu_count() or 1)) as pool:
+            parts = list(pool.map(_Shard.load, sources))
+        by_shard = {shard: {} for shard in self.shards}
+        for part in parts:
+            for user_id, user in part.items():
+                by_shard[self._shard_for(user_id)][user_id] = user
+        for shard, users in by_shard.items():
+            shard.index = shard.write_snapshot(_stored(users))
+            shard.write_index(shard.index)
+            self._retire_log(shard)
+        for shard in legacy:
+            # Keep the old file around rather than deleting user data
+            for path in (shard.path, shard.log_path):
+                if os.path.exists(path):
+                    os.replace(path, path + ".bak")
+        for shard in stale:
+            for path in (shard.path, shard.log_path, shard.index_path):
+                if os.path.exists(path):
+                    os.remove(path)
+    
+    def _load_users(self, shard: _Shard) -> dict:
+        return {user_id: User.from_dict(user)
+                for user_id, user in shard.load(models=True).items()}
+    
+    def _open_shard(self, shard: _Shard):
+        """Index a shard without reading its users"""
+        if shard.load_index():
+            for user_id, location, user in shard.replay_log():
+                shard.index[user_id] = location
+            return
+        # No usable index (first start or an older snapshot format): read
+        # this shard once and rewrite it with one
+        data = shard.load()
+        shard.index = shard.write_snapshot(_stored(data))
+        shard.write_index(shard.index)
+        self._retire_log(shard)
     
-    def _save_data(self):
-        with open(self.filepath, 'w', encoding='utf-8') as f:
-            json.dump(self.data, f, ensure_ascii=False, indent=2)
+    @contextmanager
+    def _user_scope(self, user_id: str = None):
+        """Hold a user's lock; changes are written when the outermost scope exits
+
+        Without a user id it only defers the writes, to batch them.
+        """
+        scope = self._scope
+        scope.depth += 1
+        try:
+            if user_id is None:
+                yield
+            else:
+                with self._user_locks(user_id):
+                    yield
+        finally:
+            scope.depth -= 1
+            if not scope.depth and scope.pending:
+                self._commit()
+    
+    @contextmanager
+    def locked(self, user_id: str):
+        """Hold a user's lock across a read-modify-write in a handler
+
+            with db.locked(user_id) as user:
+                user["achievements"].append(ach_id)
+                db.update_user(user_id, user)
+        """
+        with self._user_scope(user_id):
+            yield self.get_user(user_id)
+    
+    def _lookup(self, user_id: str) -> Optional[dict]:
+        """Cached or on-disk user, None if unknown; the user's lock is held"""
+        with self._cache_lock:
+            user = self.data.get(user_id)
+            if user is not None:
+                if self.lazy:
+                    self.data.move_to_end(user_id)
+                return user
+        user = self._load_user(user_id)
+        if user is not None:
+            self._cache(user_id, user)
+        return user
+    
+    def _load_user(self, user_id: str) -> Optional[dict]:
+        """User not in the cache: waiting to be written or on disk"""
+        with self._flush_cond:
+            entry = self._dirty.get(user_id)
+        if entry is not None:
+            return entry[0]
+        if not self.lazy:
+            return None
+        shard = self._shard_for(user_id)
+        with self._io_lock:
+            location = shard.index.get(user_id)
+            if location is None:
+                return None
+            user = shard.read_user(user_id, location)
+        return User.from_dict(user)
+    
+    def _cache(self, user_id: str, user: dict):
+        with self._cache_lock:
+            self.data[user_id] = user
+            while self.lazy and len(self.data) > self.cache_size:
+                # Least recently used user sits at the front; one with
+                # unwritten changes stays reachable through _dirty
+                self.data.popitem(last=False)
+    
+    def _user_ids(self) -> List[str]:
+        """Users on disk, then new ones not written yet"""
+        with self._io_lock, self._flush_cond:
+            user_ids = [user_id for shard in self.shards for user_id in shard.index]
+            user_ids += [user_id for user_id in self._dirty
+                         if user_id not in self._shard_for(user_id).index]
+        return user_ids
+    
+    @_counted
+    def iter_users(self):
+        """Yield (user_id, user) for every user without filling the cache
+
+        Users are not locked, so one changing meanwhile may be seen half done.
+        """
+        for user_id in self._user_ids():
+            with self._cache_lock:
+                user = self.data.get(user_id)
+            if user is None:
+                user = self._load_user(user_id)
+            if user is not None:
+                yield user_id, user
+    
+    def iter_stats(self):
+        """Yield (user_id, stats) for every user"""
+        for user_id, user in self.iter_users():
+            yield user_id, user["stats"]
+    
+    def count_users(self) -> int:
+        """Users stored or waiting to be written"""
+        if not self.lazy:
+            with self._cache_lock:
+                return len(self.data)
+        with self._io_lock, self._flush_cond:
+            return sum(len(shard.index) for shard in self.shards) + \
+                sum(1 for user_id in self._dirty if user_id not in self._shard_for(user_id).index)
+    
+    def memory_stats(self) -> dict:
+        """Users held in memory, and those with changes not written yet"""
+        with self._cache_lock:
+            cached = len(self.data)
+        with self._flush_cond:
+            unsaved = len(self._dirty)
+        return {"cached_users": cached, "unsaved_users": unsaved}
+    
+    @_counted
+    def update_stats(self, changes) -> int:
+        """Apply (user_id, expected, new) stat changes in one write
+
+        A user's stats change only if they still hold the `expected` values.
+        Returns how many users changed.
+        """
+        changed = 0
+        with self._user_scope():
+            for user_id, expected, new in changes:
+                with self._user_scope(user_id):
+                    user = self._lookup(user_id)
+                    if user is None:
+                        continue
+                    stats = user["stats"]
+                    if any(stats.get(key) != value for key, value in expected.items()):
+                        continue
+                    stats.update(new)
+                    self._save_user(user_id, user)
+                    changed += 1
+        return changed
+    
+    def _save_user(self, user_id: str, user: dict):
+        """Queue a changed user for writing"""
+        with self._flush_cond:
+            self._dirty[user_id] = (user, next(self._saves))
+            if self.flush_interval > 0:
+                # Group commit: the flusher thread picks it up shortly
+                if len(self._dirty) >= self.flush_max_dirty:
+                    self._flush_cond.notify()
+                return
+        self._scope.pending.add(user_id)
+        if not self._scope.depth:
+            self._commit()
+    
+    def _commit(self):
+        user_ids, self._scope.pending = self._scope.pending, set()
+        with self._lock:
+            self._write_users(user_ids)
+    
+    @_profiled
+    def _write_users(self, user_ids):
+        started = time.perf_counter()
+        # Copy each user under its lock so a change is never written half done
+        records = {}
+        for user_id in user_ids:
+            with self._user_locks(user_id):
+                with self._flush_cond:
+                    entry = self._dirty.get(user_id)
+                if entry is not None:
+                    records[user_id] = entry, entry[0].to_dict()
+        
+        if not records:
+            return
+        
+        # Only the shards holding these users are touched
+        by_shard = {}
+        for user_id, (entry, user) in records.items():
+            by_shard.setdefault(self._shard_for(user_id), {})[user_id] = user
+        with self._io_lock:
+            written = sum(shard.bytes_written for shard in by_shard)
+            for shard, users in by_shard.items():
+                if not self.journal:
+                    self._write_snapshot(shard, users)
+                    continue
+                shard.index.update(shard.append(users.items()))
+                if shard.log_records >= self.compact_every:
+                    self._compact_shard(shard)
+            written = sum(shard.bytes_written for shard in by_shard) - written
+        
+        with self._flush_cond:
+            for user_id, (entry, user) in records.items():
+                # Unless it changed again meanwhile
+                if self._dirty.get(user_id) is entry:
+                    del self._dirty[user_id]
+        SAVE_SECONDS.observe(time.perf_counter() - started)
+        SAVED_BYTES.inc(amount=written)
+        SAVED_USERS.inc(amount=len(records))
     
+    def _flush_loop(self):
+        while not self._closed:
+            with self._flush_cond:
+                self._flush_cond.wait_for(
+                    lambda: self._closed or len(self._dirty) >= self.flush_max_dirty,
+                    timeout=self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Background flush failed")
+    
+    def flush(self):
+        """Write out every change still waiting to be written"""
+        with self._flush_cond:
+            user_ids = list(self._dirty)
+        if self._scope.depth:
+            # Under a user lock: leave it to the end of the scope
+            self._scope.pending.update(user_ids)
+            return
+        # Changes stay queued until written, so a failed flush is retried
+        with self._lock:
+            self._write_users(user_ids)
+    
+    def _write_snapshot(self, shard: _Shard, users: dict):
+        """Rewrite a shard with `users` changed and the rest copied from disk"""
+        def records():
+            for user_id, location in shard.index.items():
+                if user_id in users:
+                    yield user_id, users[user_id]
+                elif location[0] == SNAPSHOT or not shard.binary:
+                    # Unchanged users are copied without parsing
+                    yield user_id, shard.read_raw(location)
+                else:
+                    yield user_id, shard.read_user(user_id, location)
+            for user_id, user in users.items():
+                if user_id not in shard.index:
+                    yield user_id, user
+        
+        shard.index = shard.write_snapshot(records())
+        shard.write_index(shard.index)
+    
+    def _compact_shard(self, shard: _Shard):
+        self._write_snapshot(shard, {})
+        # Replaying records on top of the new snapshot is idempotent,
+        # so a crash before the truncation below loses nothing
+        self._retire_log(shard)
+    
+    def _retire_log(self, shard: _Shard):
+        if self.journal:
+            shard.truncate_log()
+        elif shard.log_records:
+            shard.remove_log()
+    
+    def compact(self):
+        """Fold the logs into fresh snapshots and truncate them"""
+        with self._lock, self._io_lock:
+            for shard in self.shards:
+                self._compact_shard(shard)
+    
+    def _write_archive(self, lines: List[bytes]):
+        with self._archive_lock:
+            if self._archive_file is None:
+                self._archive_file = open(self.archive_path, 'ab')
+                if self._archive_file.tell():
+                    with open(self.archive_path, 'rb') as f:
+                        f.seek(-1, os.SEEK_END)
+                        if f.read(1) != b"\n":
+                            # Torn line from a crash - end it so it stays on its own
+                            self._archive_file.write(b"\n")
+            self._archive_file.write(b"".join(lines))
+            self._archive_file.flush()
+            os.fsync(self._archive_file.fileno())
+    
+    def _archive_line(self, user_id: str, plants: PlantList, number: int) -> bytes:
+        return _dump({"id": user_id, "from": plants.archived,
+                      "plants": plants[:number]}) + b"\n"
+    
+    def _archive_user(self, user_id: str, user: dict, keep: int) -> bool:
+        """Move all but the last `keep` plants of a user whose lock is held"""
+        plants = user["plants"]
+        if not isinstance(plants, PlantList) or len(plants) <= keep:
+            return False
+        self._write_archive([self._archive_line(user_id, plants, len(plants) - keep)])
+        # Only drop plants once they are safely archived
+        plants.archive(keep)
+        self._save_user(user_id, user)
+        return True
+    
+    def archive_plants(self, keep: int = RECENT_PLANTS) -> int:
+        """Move old plants of every user to the archive file, keeping totals"""
+        changed = 0
+        user_ids = self._user_ids()
+        for i in range(0, len(user_ids), 1000):
+            lines = []
+            # user_id -> (plants archived before, plants to archive now)
+            batch = {}
+            for user_id in user_ids[i:i + 1000]:
+                with self._user_locks(user_id):
+                    user = self._lookup(user_id)
+                    plants = user["plants"] if user is not None else None
+                    if isinstance(plants, PlantList) and len(plants) > keep:
+                        number = len(plants) - keep
+                        lines.append(self._archive_line(user_id, plants, number))
+                        batch[user_id] = plants.archived, number
+            if not lines:
+                continue
+            self._write_archive(lines)
+            
+            # One write for the whole batch
+            with self._user_scope():
+                for user_id, (start, number) in batch.items():
+                    with self._user_scope(user_id):
+                        user = self._lookup(user_id)
+                        # Skip users archived by someone else meanwhile
+                        if user["plants"].archived == start:
+                            user["plants"].archive(len(user["plants"]) - number)
+                            self._save_user(user_id, user)
+                            changed += 1
+        return changed
+    
+    def archived_plants(self, user_id: str):
+        """Yield a user's archived plants, oldest first"""
+        if not os.path.exists(self.archive_path):
+            return
+        seen = 0
+        with open(self.archive_path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record["id"] != user_id:
+                    continue
+                # A crash between archiving and saving the user archives
+                # the same plants again
+                yield from record["plants"][max(seen - record["from"], 0):]
+                seen = max(seen, record["from"] + len(record["plants"]))
+    
+    def close(self):
+        """Stop the flusher, write pending changes and release files"""
+        self._closed = True
+        if self._flusher is not None:
+            with self._flush_cond:
+                self._flush_cond.notify()
+            self._flusher.join()
+        self.flush()
+        with self._io_lock:
+            for shard in self.shards:
+                shard.close()
+        with self._archive_lock:
+            if self._archive_file is not None:
+                self._archive_file.close()
+                self._archive_file = None
+        self._process_lock.release()
+    
+    @_counted
     def get_user(self, user_id: str) -> dict:
         """Get user data or create new user profile"""
-        if user_id not in self.data:
-            self.data[user_id] = {
-                "user_id": user_id,
-                "created_at": datetime.now().isoformat(),
-                "language": "ru",
-                "plants": [],
-                "current_session": None,
-                "stats": {
-                    "total_focus_minutes": 0,
-                    "total_plants": 0,
-                    "current_streak": 0,
-                    "longest_streak": 0,
-                    "last_activity_date": None,
-                    "streak_freezes": 2
-                },
-                "preferences": {
-                    "session_duration": 25,
-                    "favorite_plant": "🌱"
-                },
-                "achievements": []
-            }
-            self._save_data()
-        return self.data[user_id]
+        with self._user_scope(user_id):
+            user = self._lookup(user_id)
+            if user is None:
+                user = User.from_dict(_new_user(user_id))
+                self._cache(user_id, user)
+                self._save_user(user_id, user)
+            return user
     
+    @_counted
     def update_user(self, user_id: str, data: dict):
         """Update user data"""
-        if user_id in self.data:
-            self.data[user_id].update(data)
-            self._save_data()
+        with self._user_scope(user_id):
+            user = self._lookup(user_id)
+            if user is not None:
+                user.update(data)
+                self._save_user(user_id, user)
     
-    def start_session(self, user_id: str, duration: int, plant_type: str):
+    @_counted
+    def start_session(self, user_id: str, duration: int, plant_type: str,
+                      chat_id: int = None):
         """Start a focus session"""
-        user = self.get_user(user_id)
-        session = {
-            "start_time": datetime.now().isoformat(),
-            "duration_minutes": duration,
-            "plant_type": plant_type,
-            "status": "active"
-        }
-        user["current_session"] = session
-        self.update_user(user_id, user)
-        return session
+        with self._user_scope(user_id):
+            user = self.get_user(user_id)
+            session = {
+                "start_time": datetime.now().isoformat(),
+                "duration_minutes": duration,
+                "plant_type": plant_type,
+                "status": "active"
+            }
+            if chat_id is not None:
+                # Where to send the end-of-session reminder
+                session["chat_id"] = chat_id
+            user["current_session"] = session
+            self.update_user(user_id, user)
+            return user["current_session"]
     
+    @_counted
     def complete_session(self, user_id: str):
         """Complete a focus session and award plant"""
-        user = self.get_user(user_id)
-        session = user.get("current_session")
-        
-        if not session or session["status"] != "active":
+        with self._user_scope(user_id):
+            user = self.get_user(user_id)
+            session = user.get("current_session")
+            
+            if not session or session["status"] != "active":
+                return None
+            
+            session["status"] = "completed"
+            session["end_time"] = datetime.now().isoformat()
+            
+            now = datetime.now()
+            plant = {
+                "type": session["plant_type"],
+                "grown_at": now.isoformat(),
+                "session_minutes": session["duration_minutes"]
+            }
+            # Built from the plants before this one the first time
+            series = daily_series(user)
+            series.add(day_number(now.date()), session["duration_minutes"])
+            user["daily"] = series
+            user["plants"].append(plant)
+            
+            user["stats"]["total_focus_minutes"] += session["duration_minutes"]
+            user["stats"]["total_plants"] += 1
+            
+            _advance_streak(user["stats"])
+            user["current_session"] = None
+            
+            self.update_user(user_id, user)
+            for listener in self.stats_listeners:
+                listener(user_id, user["stats"])
+            if self.plants_hot and len(user["plants"]) > self.plants_hot:
+                self._archive_user(user_id, user, RECENT_PLANTS)
+            return plant
+    
+    @_counted
+    def active_sessions(self):
+        """Yield (user_id, session) for every session still running
+
+        Reads every user once, so it is meant for startup.
+        """
+        for user_id, user in self.iter_users():
+            session = user.get("current_session")
+            if session and session["status"] == "active":
+                yield user_id, dict(session)
+    
+    @_counted
+    def abandon_session(self, user_id: str):
+        """User abandoned session - plant dies"""
+        with self._user_scope(user_id):
+            user = self.get_user(user_id)
+            if user.get("current_session"):
+                user["current_session"]["status"] = "abandoned"
+                user["current_session"] = None
+                self.update_user(user_id, user)
+                return True
+            return False
+
+class _StoredPlants(Sequence):
+    """A user's plant history in SQLite, read when something asks for it
+
+    get_user hands this out instead of a list: most handlers never look
+    at the plants, the count is a COUNT(*) and a tail slice such as
+    plants[-10:] for the forest view reads only those rows. Anything
+    else reads the whole history once. Plants are added by
+    complete_session, not through this list.
+    """
+    
+    def __init__(self, database: "SQLiteUserDatabase", user_id: str):
+        self.database = database
+        self.user_id = user_id
+        self._plants = None
+    
+    def _query(self, order: str, *args) -> list:
+        with self.database._lock:
+            rows = self.database.conn.execute(
+                "SELECT type, grown_at, session_minutes FROM plants "
+                f"WHERE user_id = ? ORDER BY {order}", (self.user_id, *args)).fetchall()
+        return [dict(row) for row in rows]
+    
+    def _load(self) -> list:
+        if self._plants is None:
+            self._plants = self._query("id")
+        return self._plants
+    
+    def __len__(self):
+        if self._plants is not None:
+            return len(self._plants)
+        with self.database._lock:
+            return self.database.conn.execute(
+                "SELECT COUNT(*) FROM plants WHERE user_id = ?", (self.user_id,)).fetchone()[0]
+    
+    def __getitem__(self, index):
+        if self._plants is None and isinstance(index, slice) and \
+                index.start is not None and index.start < 0 and \
+                index.stop is None and index.step is None:
+            return self._query("id DESC LIMIT ?", -index.start)[::-1]
+        return self._load()[index]
+    
+    def __iter__(self):
+        return iter(self._load())
+    
+    def __eq__(self, other):
+        if isinstance(other, _StoredPlants):
+            other = other._load()
+        return isinstance(other, list) and self._load() == other
+    
+    __hash__ = None
+    
+    def __repr__(self):
+        return f"_StoredPlants({self._load()!r})"
+
+class SQLiteUserDatabase:
+    """SQLite-backed database with the same API as UserDatabase
+
+    The connection is shared by all threads under `_lock`; user locks keep
+    each user's read-modify-write sequences atomic.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            created_at TEXT NOT NULL,
+            language TEXT NOT NULL DEFAULT 'ru',
+            total_focus_minutes INTEGER NOT NULL DEFAULT 0,
+            total_plants INTEGER NOT NULL DEFAULT 0,
+            current_streak INTEGER NOT NULL DEFAULT 0,
+            longest_streak INTEGER NOT NULL DEFAULT 0,
+            last_activity_date TEXT,
+            streak_freezes INTEGER NOT NULL DEFAULT 2,
+            session_duration INTEGER NOT NULL DEFAULT 25,
+            favorite_plant TEXT NOT NULL DEFAULT '🌱',
+            extra TEXT
+        );
+        CREATE TABLE IF NOT EXISTS plants (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT NOT NULL REFERENCES users(user_id),
+            type TEXT NOT NULL,
+            grown_at TEXT NOT NULL,
+            session_minutes INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS plants_by_user ON plants(user_id, id);
+        CREATE TABLE IF NOT EXISTS sessions (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT NOT NULL REFERENCES users(user_id),
+            start_time TEXT NOT NULL,
+            end_time TEXT,
+            duration_minutes INTEGER NOT NULL,
+            plant_type TEXT NOT NULL,
+            status TEXT NOT NULL,
+            chat_id INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS sessions_by_user ON sessions(user_id, status);
+        CREATE INDEX IF NOT EXISTS active_sessions ON sessions(start_time) WHERE status = 'active';
+        CREATE TABLE IF NOT EXISTS achievements (
+            user_id TEXT NOT NULL REFERENCES users(user_id),
+            achievement_id TEXT NOT NULL,
+            earned_at TEXT NOT NULL,
+            PRIMARY KEY (user_id, achievement_id)
+        ) WITHOUT ROWID;
+    """
+    
+    STATS_COLUMNS = ("total_focus_minutes", "total_plants", "current_streak",
+                     "longest_streak", "last_activity_date", "streak_freezes")
+    PREFERENCES_COLUMNS = ("session_duration", "favorite_plant")
+    # Top-level keys with dedicated tables or columns; anything else goes to `extra`
+    KNOWN_KEYS = ("user_id", "created_at", "language", "plants", "current_session",
+                  "stats", "preferences", "achievements")
+    
+    def __init__(self, filepath: str = None):
+        if filepath is None:
+            # Keep the database next to the JSON file unless told otherwise
+            filepath = os.getenv("DATA_DB_FILE") or \
+                os.path.splitext(os.getenv("DATA_FILE", "user_data.json"))[0] + ".db"
+        self.filepath = filepath
+        self._process_lock = ProcessLock(filepath)
+        self.conn = sqlite3.connect(filepath, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(self.SCHEMA)
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(sessions)")}
+        if "chat_id" not in columns:
+            # Databases created before reminders were sent
+            self.conn.execute("ALTER TABLE sessions ADD COLUMN chat_id INTEGER")
+        self._user_locks = _UserLocks()
+        self._lock = threading.RLock()
+        # listener(user_id, stats), called with the user locked once a
+        # completed session has changed the user's stats
+        self.stats_listeners = []
+    
+    def flush(self):
+        """Nothing to do - every change is committed by its transaction"""
+    
+    def close(self):
+        with self._lock:
+            self.conn.close()
+        self._process_lock.release()
+    
+    @contextmanager
+    def locked(self, user_id: str):
+        """Hold a user's lock across a read-modify-write in a handler"""
+        with self._user_locks(user_id):
+            yield self.get_user(user_id)
+    
+    def _fetch_user(self, user_id: str, lazy: bool = False) -> Optional[dict]:
+        """The user's record; with `lazy` the plants are read on first use"""
+        row = self.conn.execute(
+            "SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
             return None
         
-        session["status"] = "completed"
-        session["end_time"] = datetime.now().isoformat()
-        
-        plant = {
-            "type": session["plant_type"],
-            "grown_at": datetime.now().isoformat(),
-            "session_minutes": session["duration_minutes"]
+        user = {
+            "user_id": user_id,
+            "created_at": row["created_at"],
+            "language": row["language"],
+            "plants": _StoredPlants(self, user_id) if lazy else [
+                dict(plant) for plant in self.conn.execute(
+                    "SELECT type, grown_at, session_minutes FROM plants "
+                    "WHERE user_id = ? ORDER BY id", (user_id,))],
+            "current_session": None,
+            "stats": {column: row[column] for column in self.STATS_COLUMNS},
+            "preferences": {column: row[column] for column in self.PREFERENCES_COLUMNS},
+            "achievements": [ach["achievement_id"] for ach in self.conn.execute(
+                "SELECT achievement_id FROM achievements "
+                "WHERE user_id = ? ORDER BY earned_at", (user_id,))]
         }
-        user["plants"].append(plant)
+        session = self._active_session(user_id)
+        if session:
+            user["current_session"] = self._session(session)
+        if row["extra"]:
+            user.update(json.loads(row["extra"]))
+        return user
+    
+    def _session(self, row) -> dict:
+        session = dict(row)
+        if session.get("chat_id") is None:
+            session.pop("chat_id", None)
+        return session
+    
+    def _active_session(self, user_id: str):
+        return self.conn.execute(
+            "SELECT start_time, duration_minutes, plant_type, status, chat_id FROM sessions "
+            "WHERE user_id = ? AND status = 'active' ORDER BY id DESC LIMIT 1",
+            (user_id,)).fetchone()
+    
+    def _insert_user(self, user: dict):
+        self.conn.execute(
+            "INSERT INTO users (user_id, created_at, language) VALUES (?, ?, ?)",
+            (user["user_id"], user["created_at"], user["language"]))
+        self._write_user(user["user_id"], user)
+    
+    def _write_user(self, user_id: str, data: dict):
+        """Write the keys present in `data` to their tables"""
+        columns = {}
+        for key in ("created_at", "language"):
+            if key in data:
+                columns[key] = data[key]
+        for column in self.STATS_COLUMNS:
+            if column in data.get("stats", {}):
+                columns[column] = data["stats"][column]
+        for column in self.PREFERENCES_COLUMNS:
+            if column in data.get("preferences", {}):
+                columns[column] = data["preferences"][column]
         
-        user["stats"]["total_focus_minutes"] += session["duration_minutes"]
-        user["stats"]["total_plants"] += 1
+        extra = {key: value for key, value in data.items() if key not in self.KNOWN_KEYS}
+        if extra:
+            row = self.conn.execute(
+                "SELECT extra FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            stored = json.loads(row["extra"]) if row["extra"] else {}
+            stored.update(extra)
+            columns["extra"] = json.dumps(stored, ensure_ascii=False)
         
-        today = datetime.now().date().isoformat()
-        last_activity = user["stats"]["last_activity_date"]
+        if columns:
+            assignments = ", ".join(f"{column} = ?" for column in columns)
+            self.conn.execute(f"UPDATE users SET {assignments} WHERE user_id = ?",
+                              (*columns.values(), user_id))
         
-        if last_activity == today:
+        plants = data.get("plants")
+        if isinstance(plants, _StoredPlants) and plants.database is self and \
+                plants.user_id == user_id:
+            # Read from this very history, so nothing is new
             pass
-        elif last_activity == (datetime.now().date() - timedelta(days=1)).isoformat():
-            user["stats"]["current_streak"] += 1
-            if user["stats"]["current_streak"] > user["stats"]["longest_streak"]:
-                user["stats"]["longest_streak"] = user["stats"]["current_streak"]
-        else:
-            user["stats"]["current_streak"] = 1
+        elif "plants" in data:
+            # History is append-only, so only the tail can be new
+            stored = self.conn.execute(
+                "SELECT COUNT(*) FROM plants WHERE user_id = ?", (user_id,)).fetchone()[0]
+            self.conn.executemany(
+                "INSERT INTO plants (user_id, type, grown_at, session_minutes) VALUES (?, ?, ?, ?)",
+                [(user_id, plant["type"], plant["grown_at"], plant["session_minutes"])
+                 for plant in data["plants"][stored:]])
+        
+        if "achievements" in data:
+            now = datetime.now().isoformat()
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO achievements (user_id, achievement_id, earned_at) "
+                "VALUES (?, ?, ?)",
+                [(user_id, ach_id, now) for ach_id in data["achievements"]])
+        
+        if "current_session" in data:
+            self._sync_session(user_id, data["current_session"])
+    
+    def _sync_session(self, user_id: str, session: Optional[dict]):
+        active = self._active_session(user_id)
+        if active and (not session or session["start_time"] != active["start_time"]):
+            # Session was replaced or cleared without going through complete/abandon
+            self.conn.execute(
+                "UPDATE sessions SET status = 'abandoned', end_time = ? "
+                "WHERE user_id = ? AND status = 'active'",
+                (datetime.now().isoformat(), user_id))
+            active = None
+        if session and session["status"] == "active" and not active:
+            self.conn.execute(
+                "INSERT INTO sessions (user_id, start_time, duration_minutes, plant_type, status, chat_id) "
+                "VALUES (?, ?, ?, ?, 'active', ?)",
+                (user_id, session["start_time"], session["duration_minutes"],
+                 session["plant_type"], session.get("chat_id")))
+    
+    @_counted
+    def iter_users(self, after: str = None):
+        """Yield (user_id, user) for every user in user_id order"""
+        while True:
+            with self._lock:
+                rows = self.conn.execute(
+                    "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT 500",
+                    (after if after is not None else "",)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                after = row["user_id"]
+                with self._lock:
+                    user = self._fetch_user(after)
+                if user is not None:
+                    yield after, user
+    
+    def iter_stats(self, after: str = None):
+        """Yield (user_id, stats) for every user in user_id order, reading only the users table"""
+        query = (f"SELECT user_id, {', '.join(self.STATS_COLUMNS)} FROM users "
+                 "WHERE user_id > ? ORDER BY user_id LIMIT 10000")
+        columns = self.STATS_COLUMNS
+        while True:
+            with self._lock:
+                cursor = self.conn.cursor()
+                # Plain tuples; much cheaper than Row for a full scan
+                cursor.row_factory = None
+                rows = cursor.execute(query, (after if after is not None else "",)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row[0], dict(zip(columns, row[1:]))
+            after = rows[-1][0]
+    
+    @_counted
+    def update_stats(self, changes, batch: int = 10000) -> int:
+        """Apply (user_id, expected, new) stat changes, a transaction per batch
+
+        A user's stats change only if they still hold the `expected` values.
+        Returns how many users changed.
+        """
+        changed = 0
+        pending = []
         
-        user["stats"]["last_activity_date"] = today
-        user["current_session"] = None
+        def write():
+            nonlocal changed
+            # Changes to the same columns go through one executemany
+            groups = {}
+            for user_id, expected, new in pending:
+                groups.setdefault((tuple(new), tuple(expected)), []).append(
+                    (*new.values(), user_id, *expected.values()))
+            with self._lock, self.conn:
+                for (new_columns, expected_columns), rows in groups.items():
+                    for column in new_columns + expected_columns:
+                        if column not in self.STATS_COLUMNS:
+                            raise ValueError(f"Unknown stat: {column}")
+                    assignments = ", ".join(f"{column} = ?" for column in new_columns)
+                    conditions = "".join(f" AND {column} IS ?" for column in expected_columns)
+                    cursor = self.conn.executemany(
+                        f"UPDATE users SET {assignments} WHERE user_id = ?{conditions}", rows)
+                    changed += cursor.rowcount
+            pending.clear()
         
-        self.update_user(user_id, user)
-        return plant
+        for change in changes:
+            pending.append(change)
+            if len(pending) >= batch:
+                write()
+        if pending:
+            write()
+        return changed
+    
+    def count_users(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
     
+    def memory_stats(self) -> dict:
+        """Nothing is held in memory; every read goes to SQLite"""
+        return {}
+    
+    def import_users(self, users):
+        """Insert or replace whole (user_id, user) records in one transaction"""
+        with self._lock, self.conn:
+            for user_id, user in users:
+                for table in ("plants", "sessions", "achievements", "users"):
+                    self.conn.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+                self._insert_user(dict(user, user_id=user_id))
+    
+    @_counted
+    def get_user(self, user_id: str) -> dict:
+        """Get user data or create new user profile"""
+        with self._user_locks(user_id), self._lock:
+            user = self._fetch_user(user_id, lazy=True)
+            if user is None:
+                user = _new_user(user_id)
+                with self.conn:
+                    self._insert_user(user)
+            return user
+    
+    @_counted
+    def update_user(self, user_id: str, data: dict):
+        """Update user data"""
+        with self._user_locks(user_id), self._lock:
+            with self.conn:
+                exists = self.conn.execute(
+                    "SELECT 1 FROM users WHERE user_id = ?", (user_id,)).fetchone()
+                if exists:
+                    self._write_user(user_id, data)
+    
+    @_counted
+    def start_session(self, user_id: str, duration: int, plant_type: str,
+                      chat_id: int = None):
+        """Start a focus session"""
+        with self._user_locks(user_id), self._lock:
+            self.get_user(user_id)
+            session = {
+                "start_time": datetime.now().isoformat(),
+                "duration_minutes": duration,
+                "plant_type": plant_type,
+                "status": "active"
+            }
+            if chat_id is not None:
+                session["chat_id"] = chat_id
+            with self.conn:
+                self._sync_session(user_id, session)
+            return session
+    
+    @_counted
+    def complete_session(self, user_id: str):
+        """Complete a focus session and award plant"""
+        with self._user_locks(user_id), self._lock:
+            user = self.get_user(user_id)
+            session = user.get("current_session")
+            
+            if not session or session["status"] != "active":
+                return None
+            
+            moment = datetime.now()
+            now = moment.isoformat()
+            plant = {
+                "type": session["plant_type"],
+                "grown_at": now,
+                "session_minutes": session["duration_minutes"]
+            }
+            stats = user["stats"]
+            stats["total_focus_minutes"] += session["duration_minutes"]
+            stats["total_plants"] += 1
+            _advance_streak(stats)
+            series = daily_series(user)
+            series.add(day_number(moment.date()), session["duration_minutes"])
+            
+            with self.conn:
+                self.conn.execute(
+                    "UPDATE sessions SET status = 'completed', end_time = ? "
+                    "WHERE user_id = ? AND status = 'active'", (now, user_id))
+                self.conn.execute(
+                    "INSERT INTO plants (user_id, type, grown_at, session_minutes) VALUES (?, ?, ?, ?)",
+                    (user_id, plant["type"], plant["grown_at"], plant["session_minutes"]))
+                self._write_user(user_id, {"stats": stats, "daily": series.to_dict()})
+            for listener in self.stats_listeners:
+                listener(user_id, stats)
+            return plant
+    
+    @_counted
+    def active_sessions(self):
+        """Yield (user_id, session) for every session still running"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT user_id, start_time, duration_minutes, plant_type, status, chat_id "
+                "FROM sessions WHERE status = 'active' ORDER BY start_time").fetchall()
+        for row in rows:
+            session = self._session(row)
+            yield session.pop("user_id"), session
+    
+    @_counted
     def abandon_session(self, user_id: str):
         """User abandoned session - plant dies"""
-        user = self.get_user(user_id)
-        if user.get("current_session"):
-            user["current_session"]["status"] = "abandoned"
-            user["current_session"] = None
-            self.update_user(user_id, user)
-            return True
-        return False
+        with self._user_locks(user_id), self._lock:
+            self.get_user(user_id)
+            with self.conn:
+                cursor = self.conn.execute(
+                    "UPDATE sessions SET status = 'abandoned', end_time = ? "
+                    "WHERE user_id = ? AND status = 'active'",
+                    (datetime.now().isoformat(), user_id))
+            return cursor.rowcount > 0
+
+def create_database():
+    """Pick the storage backend from DATA_BACKEND"""
+    backend = os.getenv("DATA_BACKEND", "json")
+    if backend == "json":
+        return UserDatabase()
+    if backend == "sqlite":
+        return SQLiteUserDatabase()
+    raise ValueError(f"Unknown DATA_BACKEND: {backend}")
 
-# Initialize global database
-db = UserDatabase()
+def __getattr__(name):
+    # Initialize global database on first use, so tools importing this
+    # module don't load the data file
+    if name == "db":
+        global db
+        db = create_database()
+        return db
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
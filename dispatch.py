@@ -0,0 +1,186 @@
+"""Worker-pool dispatch of bot updates with per-user ordering
+
+The polling loop hands every update to Dispatcher.submit, which queues it
+and returns. Workers run the handlers; updates of one user run one at a
+time in arrival order, while different users are handled in parallel.
+A user with more updates waiting goes back to the end of the pool's queue
+after each one, so a busy user can't starve everyone else.
+
+    dispatcher = install(bot)
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Handlers mostly wait on the network, so more threads than cores pay off
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+def update_key(update: dict) -> Optional[str]:
+    """Who an update belongs to: updates with the same key keep their order"""
+    user_id = update.get("user_id")
+    if user_id is None:
+        user_id = (update.get("user") or {}).get("user_id")
+    if user_id is None:
+        user_id = ((update.get("callback") or {}).get("user") or {}).get("user_id")
+    if user_id is None:
+        user_id = ((update.get("message") or {}).get("sender") or {}).get("user_id")
+    if user_id is None:
+        user_id = update.get("chat_id")
+    return None if user_id is None else str(user_id)
+
+class Dispatcher:
+    """Runs `process(update)` on a thread pool, one update per user at a time"""
+    
+    def __init__(self, process, workers: int = None, max_pending: int = None,
+                 max_pending_per_user: int = None):
+        if workers is None:
+            workers = int(os.getenv("BOT_WORKERS", str(DEFAULT_WORKERS)))
+        if max_pending is None:
+            # Beyond this submit blocks, which stops the polling loop
+            max_pending = int(os.getenv("BOT_MAX_PENDING", "1000"))
+        if max_pending_per_user is None:
+            # Beyond this a user's new updates are dropped
+            max_pending_per_user = int(os.getenv("BOT_MAX_PENDING_PER_USER", "20"))
+        self.process = process
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_pending_per_user = max_pending_per_user
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bot-worker")
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        # user key -> deque of (update, queued at); a key is present while
+        # a worker task for that user is scheduled or running
+        self._queues = {}
+        self._pending = 0
+        self._in_flight = 0
+        self._closed = False
+        # Metrics
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.blocked_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.high_water = 0
+    
+    def submit(self, update: dict) -> bool:
+        """Queue an update; False if it was dropped"""
+        key = update_key(update)
+        with self._lock:
+            if self._drop(key):
+                return False
+            if self._pending >= self.max_pending and not self._closed:
+                self.blocked += 1
+                start = time.monotonic()
+                self._not_full.wait_for(lambda: self._pending < self.max_pending or self._closed)
+                self.blocked_seconds += time.monotonic() - start
+                if self._closed:
+                    raise RuntimeError("Dispatcher is closed")
+                # Other submits may have filled the user's queue meanwhile
+                if self._drop(key):
+                    # Pass the free slot on to the next blocked submit
+                    self._not_full.notify()
+                    return False
+            if self._closed:
+                raise RuntimeError("Dispatcher is closed")
+            
+            queue = self._queues.get(key)
+            self._pending += 1
+            self.high_water = max(self.high_water, self._pending)
+            schedule = queue is None
+            if schedule:
+                queue = self._queues[key] = deque()
+            queue.append((update, time.monotonic()))
+        if schedule:
+            self._pool.submit(self._run, key)
+        return True
+    
+    def _drop(self, key: Optional[str]) -> bool:
+        """Count and log a dropped update if the user has too many waiting"""
+        queue = self._queues.get(key)
+        if queue is None or len(queue) < self.max_pending_per_user:
+            return False
+        self.dropped += 1
+        logger.warning("Dropping update for %s: %d already waiting", key, len(queue))
+        return True
+    
+    def _run(self, key: Optional[str]):
+        """Handle the oldest update of a user"""
+        with self._lock:
+            update, queued_at = self._queues[key].popleft()
+            self._in_flight += 1
+            self.wait_seconds += time.monotonic() - queued_at
+        
+        failed = False
+        try:
+            self.process(update)
+        except Exception:
+            failed = True
+            logger.exception("Update handler failed")
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._pending -= 1
+                self.processed += 1
+                self.failed += failed
+                self._not_full.notify()
+                if not self._pending:
+                    self._idle.notify_all()
+                more = bool(self._queues[key])
+                if not more:
+                    del self._queues[key]
+            if more:
+                # Back of the line, behind other users
+                self._pool.submit(self._run, key)
+    
+    def stats(self) -> dict:
+        """Queue depth and counters"""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "pending": self._pending,
+                "in_flight": self._in_flight,
+                "queued": self._pending - self._in_flight,
+                "users_waiting": len(self._queues),
+                "high_water": self.high_water,
+                "processed": self.processed,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "blocked": self.blocked,
+                "blocked_seconds": self.blocked_seconds,
+                "avg_wait_ms": self.wait_seconds / self.processed * 1000 if self.processed else 0.0
+            }
+    
+    def join(self, timeout: float = None) -> bool:
+        """Wait until every queued update is handled"""
+        with self._lock:
+            return self._idle.wait_for(lambda: not self._pending, timeout)
+    
+    def close(self):
+        """Stop taking updates and finish the queued ones"""
+        with self._lock:
+            self._closed = True
+            self._not_full.notify_all()
+        self.join()
+        self._pool.shutdown()
+
+def install(bot, workers: int = None) -> Optional[Dispatcher]:
+    """Route the bot's updates through a Dispatcher
+
+    Returns None and leaves handlers running inline when BOT_WORKERS=0.
+    """
+    if workers is None:
+        workers = int(os.getenv("BOT_WORKERS", str(DEFAULT_WORKERS)))
+    if workers <= 0:
+        return None
+    dispatcher = Dispatcher(bot._process_update, workers)
+    # Polling calls whatever _process_update is when the bot starts
+    bot._process_update = dispatcher.submit
+    return dispatcher
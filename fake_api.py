@@ -0,0 +1,231 @@
+"""Stand-in MAX Bot API server for offline load tests
+
+Serves long-polled /updates from a queue of generated updates and accepts
+the calls the bot makes in reply, each after a configurable delay that
+plays the part of network latency. Point a bot at it with MAX_API_URL:
+
+    python fake_api.py --port 8081 --users 1000 --updates 10 --latency-ms 50
+    MAX_API_URL=http://127.0.0.1:8081 BOT_TOKEN=test python bot_async.py
+
+Like the real API it can throttle sent messages, answering 429 with a
+Retry-After past --rate-limit messages a second, and fail a share of them
+with 503 (--error-rate), to exercise the retries of outbound.py.
+"""
+from collections import Counter, deque
+import argparse
+import asyncio
+import itertools
+import random
+import time
+
+from aiohttp import web
+
+# Callbacks every generated user goes through after /start; each one
+# gets exactly one message edited in reply
+CALLBACKS = ("start_focus", "my_forest", "statistics", "achievements", "back_to_menu")
+
+def make_updates(users: int, per_user: int) -> list:
+    """/start, then button presses, for each user; interleaved like real traffic"""
+    updates = []
+    for step in range(per_user):
+        for number in range(users):
+            user_id = 100000 + number
+            user = {"user_id": user_id, "name": f"User {number}", "is_bot": False}
+            if step == 0:
+                updates.append({
+                    "update_type": "message_created",
+                    "timestamp": int(time.time() * 1000),
+                    "user_id": user_id,
+                    "message": {"sender": user, "recipient": {"chat_id": user_id},
+                                "body": {"mid": f"mid.in.{number}.{step}", "text": "/start"}}
+                })
+                continue
+            updates.append({
+                "update_type": "message_callback",
+                "timestamp": int(time.time() * 1000),
+                "user_id": user_id,
+                "chat_id": user_id,
+                "callback": {"callback_id": f"cb.{number}.{step}", "user": user,
+                             "payload": CALLBACKS[(step - 1) % len(CALLBACKS)],
+                             "message": {"body": {"mid": f"mid.menu.{number}"}}}
+            })
+    return updates
+
+class FakeApi:
+    """The API endpoints plus counters of what the bot sent"""
+    
+    def __init__(self, latency: float = 0.0, poll_timeout: float = 30.0,
+                 rate_limit: int = 0, error_rate: float = 0.0):
+        self.latency = latency
+        self.poll_timeout = poll_timeout
+        # Sent messages allowed per second, 0 for no limit
+        self.rate_limit = rate_limit
+        # Share of sent messages failed with 503
+        self.error_rate = error_rate
+        # Times of the messages accepted in the last second
+        self._window = deque()
+        self.updates = deque()
+        self._arrived = asyncio.Event()
+        self._message_ids = itertools.count(1)
+        self.delivered = 0
+        self.messages = 0
+        self.edits = 0
+        self.answers = 0
+        self.throttled = 0
+        self.errors = 0
+        # "chat:<id>" or "user:<id>" -> messages it got
+        self.recipients = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.first_delivery = None
+        self.last_reply = None
+    
+    def add_updates(self, updates):
+        self.updates.extend(updates)
+        self._arrived.set()
+    
+    @property
+    def replies(self) -> int:
+        """Messages sent or edited, one per generated update"""
+        return self.messages + self.edits
+    
+    async def _call(self):
+        # Round trip to the "network"
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+    
+    async def get_updates(self, request: web.Request) -> web.Response:
+        limit = int(request.query.get("limit", "100"))
+        timeout = float(request.query.get("timeout", self.poll_timeout))
+        if not self.updates:
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        batch = [self.updates.popleft() for _ in range(min(limit, len(self.updates)))]
+        if batch and self.first_delivery is None:
+            self.first_delivery = time.perf_counter()
+        self.delivered += len(batch)
+        return web.json_response({"updates": batch, "marker": self.delivered})
+    
+    def _throttle(self) -> bool:
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        window = self._window
+        while window and window[0] <= now - 1:
+            window.popleft()
+        if len(window) >= self.rate_limit:
+            return True
+        window.append(now)
+        return False
+    
+    async def send_message(self, request: web.Request) -> web.Response:
+        await request.json()
+        if self._throttle():
+            self.throttled += 1
+            return web.json_response({"code": "too.many.requests"}, status=429,
+                                     headers={"Retry-After": "1"})
+        await self._call()
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response({"code": "service.unavailable"}, status=503)
+        if "user_id" in request.query:
+            self.recipients["user:" + request.query["user_id"]] += 1
+        else:
+            self.recipients["chat:" + request.query.get("chat_id", "")] += 1
+        self.messages += 1
+        self.last_reply = time.perf_counter()
+        return web.json_response({"message": {"body": {"mid": f"mid.out.{next(self._message_ids)}"}}})
+    
+    async def edit_message(self, request: web.Request) -> web.Response:
+        await request.json()
+        await self._call()
+        self.edits += 1
+        self.last_reply = time.perf_counter()
+        return web.json_response({"success": True})
+    
+    async def answer_callback(self, request: web.Request) -> web.Response:
+        await self._call()
+        self.answers += 1
+        return web.json_response({"success": True})
+    
+    async def get_stats(self, request: web.Request) -> web.Response:
+        """Not part of the MAX API: the counters, for load tests in another process"""
+        return web.json_response({
+            "messages": self.messages, "edits": self.edits, "answers": self.answers,
+            "throttled": self.throttled, "errors": self.errors,
+            "recipients": len(self.recipients),
+            "duplicates": sum(count - 1 for count in self.recipients.values()),
+            "max_in_flight": self.max_in_flight
+        })
+    
+    async def get_me(self, request: web.Request) -> web.Response:
+        return web.json_response({"user_id": 1, "name": "Fake bot", "is_bot": True})
+    
+    async def patch_me(self, request: web.Request) -> web.Response:
+        return web.json_response(await request.json())
+    
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/updates", self.get_updates)
+        app.router.add_post("/messages", self.send_message)
+        app.router.add_put("/messages", self.edit_message)
+        app.router.add_post("/answers", self.answer_callback)
+        app.router.add_get("/me", self.get_me)
+        app.router.add_get("/stats", self.get_stats)
+        app.router.add_patch("/me", self.patch_me)
+        return app
+
+async def start(api: FakeApi, host: str = "127.0.0.1", port: int = 0) -> web.AppRunner:
+    """Serve `api` in the running loop; port 0 picks a free one"""
+    runner = web.AppRunner(api.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner
+
+def bound_port(runner: web.AppRunner) -> int:
+    return runner.addresses[0][1]
+
+async def serve(args):
+    api = FakeApi(args.latency_ms / 1000, rate_limit=args.rate_limit, error_rate=args.error_rate)
+    api.add_updates(make_updates(args.users, args.updates))
+    runner = await start(api, args.host, args.port)
+    print(f"Serving {api.delivered + len(api.updates)} updates on "
+          f"http://{args.host}:{bound_port(runner)}")
+    expected = len(api.updates)
+    try:
+        if expected:
+            while api.replies < expected:
+                await asyncio.sleep(0.5)
+            seconds = api.last_reply - api.first_delivery
+            print(f"{expected} updates answered in {seconds:.2f}s ({expected / seconds:.0f}/s), "
+                  f"up to {api.max_in_flight} calls in flight")
+        # Keep serving until interrupted
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--updates", type=int, default=10, help="updates per user")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--rate-limit", type=int, default=0, help="sent messages per second, 0 for no limit")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of sent messages failed with 503")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
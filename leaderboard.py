@@ -0,0 +1,216 @@
+"""Global leaderboards kept up to date as sessions complete
+
+Each board counts users per score in a Fenwick tree, so a user's rank is
+a prefix sum and the score at any rank is found by descending the tree,
+both O(log S) for S possible scores. Users are kept by score too, so the
+top N are the groups at the highest scores. Boards change in place when a
+session completes and are rebuilt from the stored users at startup.
+
+    leaderboard = Leaderboard()
+    leaderboard.rebuild(db.iter_users())
+    db.stats_listeners.append(leaderboard.update)
+"""
+from typing import Iterable, List, Optional, Tuple
+import heapq
+import threading
+
+# Stats with a board
+STATS = ("total_plants", "total_focus_minutes", "longest_streak")
+# Scores above this share the top bucket; keeps the trees bounded
+MAX_SCORE = (1 << 20) - 1
+
+class FenwickTree:
+    """Counts of non-negative integer scores; grows as higher scores appear"""
+    __slots__ = ("tree",)
+    
+    def __init__(self, size: int = 1024):
+        self.tree = [0] * (size + 1)
+    
+    @classmethod
+    def from_counts(cls, counts: List[int]) -> "FenwickTree":
+        """Tree over counts[score], built in O(S)"""
+        size = 1024
+        while size < len(counts):
+            size *= 2
+        tree = cls.__new__(cls)
+        tree.tree = [0] + counts + [0] * (size - len(counts))
+        data = tree.tree
+        for i in range(1, size + 1):
+            parent = i + (i & -i)
+            if parent <= size:
+                data[parent] += data[i]
+        return tree
+    
+    @property
+    def size(self) -> int:
+        return len(self.tree) - 1
+    
+    def counts(self) -> List[int]:
+        """Count per score, O(S)"""
+        counts = self.tree[1:]
+        for i in range(len(counts), 0, -1):
+            parent = i + (i & -i)
+            if parent <= len(counts):
+                counts[parent - 1] -= counts[i - 1]
+        return counts
+    
+    def add(self, score: int, delta: int):
+        if score >= self.size:
+            grown = FenwickTree.from_counts(self.counts() + [0] * (score + 1 - self.size))
+            self.tree = grown.tree
+        tree = self.tree
+        i = score + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+    
+    def count_at_most(self, score: int) -> int:
+        """How many scores are <= score"""
+        tree = self.tree
+        i = min(score + 1, len(tree) - 1)
+        total = 0
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+    
+    def kth(self, k: int) -> int:
+        """The k-th smallest score, counting from 1"""
+        tree = self.tree
+        position = 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            following = position + step
+            if following < len(tree) and tree[following] < k:
+                position = following
+                k -= tree[following]
+            step >>= 1
+        return position
+
+def _score(value) -> int:
+    if not isinstance(value, int) or value < 0:
+        return 0
+    return min(value, MAX_SCORE)
+
+class _Board:
+    """One stat's scores"""
+    
+    def __init__(self):
+        self.tree = FenwickTree()
+        # user_id -> score
+        self.scores = {}
+        # score -> user ids with it
+        self.holders = {}
+    
+    def set(self, user_id: str, score: int):
+        previous = self.scores.get(user_id)
+        if previous == score:
+            return
+        if previous is not None:
+            self.tree.add(previous, -1)
+            holders = self.holders[previous]
+            holders.discard(user_id)
+            if not holders:
+                del self.holders[previous]
+        self.scores[user_id] = score
+        self.tree.add(score, 1)
+        self.holders.setdefault(score, set()).add(user_id)
+    
+    def discard(self, user_id: str):
+        score = self.scores.pop(user_id, None)
+        if score is not None:
+            self.tree.add(score, -1)
+            holders = self.holders[score]
+            holders.discard(user_id)
+            if not holders:
+                del self.holders[score]
+    
+    def load(self, scores: dict):
+        self.scores = scores
+        self.holders = {}
+        counts = [0] * (max(scores.values(), default=0) + 1)
+        for user_id, score in scores.items():
+            counts[score] += 1
+            self.holders.setdefault(score, set()).add(user_id)
+        self.tree = FenwickTree.from_counts(counts)
+    
+    def rank(self, score: int) -> int:
+        """1 + how many users score higher; ties share a rank"""
+        return 1 + len(self.scores) - self.tree.count_at_most(score)
+    
+    def top(self, n: int) -> List[Tuple[int, str, int]]:
+        entries = []
+        # Users not yet listed; the best of them is the remaining-th smallest
+        remaining = len(self.scores)
+        while remaining and len(entries) < n:
+            score = self.tree.kth(remaining)
+            holders = self.holders[score]
+            rank = len(self.scores) - remaining + 1
+            # Ties in user id order
+            for user_id in heapq.nsmallest(n - len(entries), holders):
+                entries.append((rank, user_id, score))
+            remaining -= len(holders)
+        return entries
+
+class Leaderboard:
+    """Boards for STATS, updated from completed sessions"""
+    
+    def __init__(self, stats: Iterable[str] = STATS):
+        self.stats = tuple(stats)
+        self._boards = {stat: _Board() for stat in self.stats}
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        with self._lock:
+            return len(self._boards[self.stats[0]].scores) if self.stats else 0
+    
+    def update(self, user_id: str, stats):
+        """Take a user's current stats; fits db.stats_listeners"""
+        scores = [(board, _score(stats.get(stat))) for stat, board in self._boards.items()]
+        with self._lock:
+            for board, score in scores:
+                board.set(user_id, score)
+    
+    def remove(self, user_id: str):
+        with self._lock:
+            for board in self._boards.values():
+                board.discard(user_id)
+    
+    def rebuild(self, users: Iterable[Tuple[str, dict]]) -> int:
+        """Replace the boards with the stats of (user_id, user) pairs
+
+        Users who never completed a session are left out.
+        """
+        scores = {stat: {} for stat in self.stats}
+        for user_id, user in users:
+            stats = user["stats"]
+            if not stats.get("total_plants"):
+                continue
+            for stat in self.stats:
+                scores[stat][user_id] = _score(stats.get(stat))
+        with self._lock:
+            for stat, board in self._boards.items():
+                board.load(scores[stat])
+        return len(scores[self.stats[0]]) if self.stats else 0
+    
+    def entries(self) -> List[Tuple[str, dict]]:
+        """(user_id, {stat: score}) of every user on the boards; fits update()"""
+        with self._lock:
+            boards = self._boards.items()
+            users = self._boards[self.stats[0]].scores if self.stats else {}
+            return [(user_id, {stat: board.scores[user_id] for stat, board in boards})
+                    for user_id in users]
+    
+    def top(self, stat: str, n: int = 10) -> List[Tuple[int, str, int]]:
+        """(rank, user_id, score) of the n best, best first"""
+        with self._lock:
+            return self._boards[stat].top(n)
+    
+    def rank(self, stat: str, user_id: str) -> Optional[Tuple[int, int, int]]:
+        """(rank, score, users ranked), None if the user isn't on the board"""
+        with self._lock:
+            board = self._boards[stat]
+            score = board.scores.get(user_id)
+            if score is None:
+                return None
+            return board.rank(score), score, len(board.scores)
@@ -1,108 +1,198 @@
-MESSAGES = {
-    # Welcome & Start
-    "welcome": {
-        "ru": "🌱 Добро пожаловать в Лесной Фокус!\n\nЯ помогу вам сосредоточиться на работе и вырастить виртуальный лес. Каждая сессия концентрации выращивает новое растение.\n\nИспользуйте /start чтобы увидеть меню.",
-        "en": "🌱 Welcome to Forest Focus!\n\nI'll help you stay focused and grow a virtual forest. Each focus session grows a new plant.\n\nUse /start to see the menu."
-    },
-    
-    "main_menu": {
-        "ru": "🌳 **Главное меню**\n\nВыберите действие:",
-        "en": "🌳 **Main Menu**\n\nChoose an action:"
-    },
-    
-    # Session Management
-    "start_session_prompt": {
-        "ru": "⏱️ **Начать сессию фокуса**\n\nВыберите длительность:",
-        "en": "⏱️ **Start Focus Session**\n\nChoose duration:"
-    },
-    
-    "choose_plant": {
-        "ru": "🌱 **Выберите растение для выращивания**\n\nДоступные растения:",
-        "en": "🌱 **Choose Plant to Grow**\n\nAvailable plants:"
-    },
-    
-    "session_started": {
-        "ru": "🌱 **Сессия началась!**\n\n⏱️ Длительность: {duration} минут\n🌿 Растение: {plant}\n\n💡 Сосредоточьтесь на работе. Если вы покинете бот, растение погибнет!\n\nЗавершите сессию через {duration} минут кнопкой ниже.",
-        "en": "🌱 **Session Started!**\n\n⏱️ Duration: {duration} minutes\n🌿 Plant: {plant}\n\n💡 Stay focused. If you leave, your plant will die!\n\nComplete session in {duration} minutes using button below."
-    },
-    
-    "session_completed": {
-        "ru": "🎉 **Отличная работа!**\n\n✅ Сессия завершена\n{plant} **{plant_name}** вырос в вашем лесу!\n\n📊 Статистика:\n🌳 Всего растений: {total}\n⏱️ Время фокуса: {minutes} мин\n🔥 Серия: {streak} дней\n\n{achievement_text}",
-        "en": "🎉 **Great Work!**\n\n✅ Session completed\n{plant} **{plant_name}** grew in your forest!\n\n📊 Stats:\n🌳 Total plants: {total}\n⏱️ Focus time: {minutes} min\n🔥 Streak: {streak} days\n\n{achievement_text}"
-    },
-    
-    "plant_died": {
-        "ru": "😢 **Растение погибло...**\n\nВы покинули сессию раньше времени. Попробуйте снова!",
-        "en": "😢 **Plant Died...**\n\nYou left the session early. Try again!"
-    },
-    
-    # Statistics
-    "forest_view": {
-        "ru": "🌲 **Ваш лес**\n\n🌳 Растений выращено: {total}\n⏱️ Часов фокуса: {hours}\n🔥 Текущая серия: {streak} дней\n🏆 Лучшая серия: {best_streak} дней\n\n{recent_plants}\n\n💡 Следующее растение откроется через {next} растений",
-        "en": "🌲 **Your Forest**\n\n🌳 Plants grown: {total}\n⏱️ Focus hours: {hours}\n🔥 Current streak: {streak} days\n🏆 Best streak: {best_streak} days\n\n{recent_plants}\n\n💡 Next plant unlocks in {next} plants"
-    },
-    
-    # Streak
-    "streak_broken": {
-        "ru": "💔 **Серия прервана**\n\nВы не выращивали растения вчера. Серия сброшена до 1.\n\n💎 У вас есть {freezes} заморозок серии. Используйте их, чтобы сохранить прогресс!",
-        "en": "💔 **Streak Broken**\n\nYou didn't grow plants yesterday. Streak reset to 1.\n\n💎 You have {freezes} streak freezes. Use them to save progress!"
-    },
+"""Localized messages, loaded one language at a time
+
+Every language is a JSON pack in locales/ mapping message keys to
+str.format templates. A pack is read the first time its language is
+needed, so languages nobody uses cost no startup time or memory. Loading
+compiles each template into an f-string function and checks that it only
+uses placeholders the default language's template has, so a broken
+translation fails when it loads instead of in the middle of a reply.
+
+A key missing from a pack comes from the next language in its fallback
+chain: the languages listed under "@fallback" in the pack, the base
+language of a regional one (pt-BR -> pt), then FALLBACK_LANGUAGE and
+DEFAULT_LANGUAGE. So a language without a pack gets English, as every
+language but Russian always did.
+"""
+import json
+import logging
+import os
+import re
+import string
+import threading
+
+logger = logging.getLogger(__name__)
+
+LOCALES_DIR = os.getenv("LOCALES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "locales"))
+DEFAULT_LANGUAGE = "ru"
+# For languages that aren't Russian and lack a key or a pack
+FALLBACK_LANGUAGE = "en"
+
+# What an f-string accepts as a format spec without nested fields
+_SPEC = re.compile(r"[^{}\\'\"\n]*\Z")
+
+class LocalizationError(ValueError):
+    pass
+
+class Template:
+    """A message template compiled into a function"""
+    __slots__ = ("text", "fields", "_render")
     
-    "milestone_reached": {
-        "ru": "🎊 **Веха достигнута!**\n\n🔥 Серия {days} дней!\n\n{reward_text}",
-        "en": "🎊 **Milestone Reached!**\n\n🔥 {days} day streak!\n\n{reward_text}"
-    },
+    def __init__(self, text: str, where: str = "template"):
+        if not isinstance(text, str):
+            raise LocalizationError(f"{where}: expected a string")
+        try:
+            parsed = list(string.Formatter().parse(text))
+        except ValueError as e:
+            raise LocalizationError(f"{where}: {e}") from None
+        
+        fields = []
+        pieces = []
+        for literal, name, spec, conversion in parsed:
+            pieces.append(literal.replace("{", "{{").replace("}", "}}"))
+            if name is None:
+                continue
+            if not name.isidentifier():
+                raise LocalizationError(f"{where}: placeholder {{{name}}} is not a name")
+            if conversion not in (None, "r", "s", "a") or not _SPEC.match(spec or ""):
+                raise LocalizationError(f"{where}: unsupported format in {{{name}}}")
+            if name not in fields:
+                fields.append(name)
+            pieces.append("{_%d%s%s}" % (fields.index(name),
+                                         "!" + conversion if conversion else "",
+                                         ":" + spec if spec else ""))
+        self.text = text
+        self.fields = frozenset(fields)
+        if not fields:
+            constant = "".join(literal for literal, _, _, _ in parsed)
+            self._render = lambda kwargs: constant
+        else:
+            source = "def render(kwargs):\n"
+            for i, name in enumerate(fields):
+                source += f"    _{i} = kwargs[{name!r}]\n"
+            source += f"    return f{''.join(pieces)!r}\n"
+            namespace = {}
+            try:
+                exec(compile(source, where, "exec"), namespace)
+            except SyntaxError as e:
+                raise LocalizationError(f"{where}: {e.msg}") from None
+            self._render = namespace["render"]
     
-    # Buttons
-    "btn_start_focus": {
-        "ru": "🎯 Начать фокус",
-        "en": "🎯 Start Focus"
-    },
-    "btn_my_forest": {
-        "ru": "🌲 Мой лес",
-        "en": "🌲 My Forest"
-    },
-    "btn_statistics": {
-        "ru": "📊 Статистика",
-        "en": "📊 Statistics"
-    },
-    "btn_achievements": {
-        "ru": "🏆 Достижения",
-        "en": "🏆 Achievements"
-    },
-    "btn_settings": {
-        "ru": "⚙️ Настройки",
-        "en": "⚙️ Settings"
-    },
-    "btn_help": {
-        "ru": "❓ Помощь",
-        "en": "❓ Help"
-    },
-    "btn_complete_session": {
-        "ru": "✅ Завершить сессию",
-        "en": "✅ Complete Session"
-    },
-    "btn_abandon_session": {
-        "ru": "❌ Прервать (растение погибнет)",
-        "en": "❌ Abandon (plant dies)"
-    },
-    "btn_25min": {
-        "ru": "⏱️ 25 минут (Pomodoro)",
-        "en": "⏱️ 25 minutes (Pomodoro)"
-    },
-    "btn_50min": {
-        "ru": "⏱️ 50 минут",
-        "en": "⏱️ 50 minutes"
-    },
-    "btn_custom": {
-        "ru": "🔧 Своя длительность",
-        "en": "🔧 Custom duration"
-    }
-}
+    def format(self, kwargs: dict) -> str:
+        """Same as text.format(**kwargs)"""
+        return self._render(kwargs)
+
+# language -> its pack's templates, or None when there is no pack
+_packs = {}
+# language -> templates with the fallbacks filled in
+_messages = {}
+# language -> its fallback chain
+_chains = {}
+_lock = threading.Lock()
+# Bumped by messages_changed(), for caches built from the messages
+messages_version = 0
+
+def _read_pack(lang: str):
+    """Compiled templates and declared fallbacks of a pack, None if there isn't one"""
+    if not lang or os.sep in lang or "/" in lang or lang.startswith("."):
+        return None
+    path = os.path.join(LOCALES_DIR, f"{lang}.json")
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    fallbacks = data.pop("@fallback", [])
+    if isinstance(fallbacks, str):
+        fallbacks = [fallbacks]
+    templates = {key: Template(text, f"{path}: {key}") for key, text in data.items()}
+    return templates, fallbacks
+
+def _pack(lang: str):
+    if lang not in _packs:
+        pack = _read_pack(lang)
+        if pack is not None and lang != DEFAULT_LANGUAGE:
+            reference = _pack(DEFAULT_LANGUAGE)
+            reference = reference[0] if reference else {}
+            for key, template in pack[0].items():
+                extra = template.fields - reference[key].fields if key in reference else ()
+                if extra:
+                    raise LocalizationError(f"{lang}: {key} uses {', '.join(sorted(extra))}, "
+                                            f"which {DEFAULT_LANGUAGE} doesn't")
+        _packs[lang] = pack
+    return _packs[lang]
+
+def _fallback_chain(lang: str) -> tuple:
+    chain = []
+    pending = [lang]
+    while pending:
+        current = pending.pop(0)
+        if current in chain:
+            continue
+        chain.append(current)
+        pack = _pack(current)
+        if pack is not None:
+            pending[:0] = pack[1]
+        if "-" in current:
+            pending.append(current.split("-")[0])
+    if DEFAULT_LANGUAGE not in chain:
+        if FALLBACK_LANGUAGE not in chain:
+            chain.append(FALLBACK_LANGUAGE)
+        chain.append(DEFAULT_LANGUAGE)
+    return tuple(chain)
+
+def _load(lang: str) -> dict:
+    with _lock:
+        messages = _messages.get(lang)
+        if messages is None:
+            _chains[lang] = _fallback_chain(lang)
+            chain = [current for current in _chains[lang] if _pack(current) is not None]
+            if not chain:
+                messages = {}
+            elif len(chain) == 1:
+                # Nothing to merge; share the pack's own dict
+                messages = _pack(chain[0])[0]
+            else:
+                messages = {}
+                for current in reversed(chain):
+                    messages.update(_pack(current)[0])
+            _messages[lang] = messages
+            logger.info("Loaded messages for %s from %s", lang, ", ".join(chain))
+        return messages
+
+def messages_changed():
+    """Call after editing a pack so packs are read again on next use"""
+    global messages_version
+    with _lock:
+        _packs.clear()
+        _messages.clear()
+        _chains.clear()
+        messages_version += 1
+
+def loaded_languages() -> list:
+    return sorted(_messages)
 
 def get_message(key: str, lang: str = "ru", **kwargs) -> str:
     """Get localized message with formatting"""
-    template = MESSAGES.get(key, {}).get(lang, "")
-    if kwargs:
-        return template.format(**kwargs)
-    return template
+    messages = _messages.get(lang)
+    if messages is None:
+        messages = _load(lang)
+    template = messages.get(key)
+    if template is None:
+        return ""
+    return template.format(kwargs) if kwargs else template.text
+
+def fallback_chain(lang: str) -> tuple:
+    """Languages searched for a key, in order"""
+    chain = _chains.get(lang)
+    while chain is None:
+        _load(lang)
+        chain = _chains.get(lang)
+    return chain
+
+def localized(info: dict, field: str, lang: str = "ru") -> str:
+    """info["<field>_<lang>"] of a catalog entry, along the fallback chain"""
+    for current in fallback_chain(lang):
+        value = info.get(f"{field}_{current}")
+        if value is not None:
+            return value
+    return ""
@@ -0,0 +1,260 @@
+"""Counters, histograms and gauges in the Prometheus text format
+
+Metrics are registered once at import and updated in place: a counter
+increment or a histogram observation is a dict lookup and a few additions
+under a lock, cheap enough for every update and every database call.
+Gauges cost nothing until scraped; they are read from a function then.
+
+    handled = registry.histogram("forest_handler_seconds", "Handler latency", ("handler",))
+    handled.observe(0.012, "start_command")
+    serve(9100)  # GET http://127.0.0.1:9100/metrics
+
+Label values past MAX_SERIES per metric are counted under "other", so an
+unexpected label can't grow memory without bound.
+"""
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterable, Optional, Tuple
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds; from a cache hit to a full rewrite of a large data file
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Label combinations kept per metric
+MAX_SERIES = 1000
+OTHER = "other"
+
+_clock = time.perf_counter
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+class _Metric:
+    kind = "untyped"
+    
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+    
+    def _key(self, values: tuple, series: dict) -> tuple:
+        if len(values) != len(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {values}")
+        if values not in series and len(series) >= MAX_SERIES:
+            return (OTHER,) * len(self.labels)
+        return values
+    
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += self._samples()
+        return lines
+    
+    def _samples(self) -> list:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    """A total that only goes up"""
+    kind = "counter"
+    
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+    
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            key = self._key(labels, self._values)
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def value(self, *labels) -> float:
+        with self._lock:
+            return self._values.get(labels, 0)
+    
+    def _samples(self) -> list:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                for key, value in values]
+
+class _Timer:
+    """Observes the seconds its `with` block took"""
+    __slots__ = ("histogram", "labels", "started")
+    
+    def __init__(self, histogram: "Histogram", labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+    
+    def __enter__(self):
+        self.started = _clock()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.histogram.observe(_clock() - self.started, *self.labels)
+
+class Histogram(_Metric):
+    """Observations counted into fixed buckets, with their sum"""
+    kind = "histogram"
+    
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket (the last one past the highest bound), sum]
+        self._series = {}
+    
+    def observe(self, value: float, *labels):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                key = self._key(labels, self._series)
+                series = self._series.get(key)
+                if series is None:
+                    series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+    
+    def time(self, *labels) -> _Timer:
+        """with histogram.time("label"): ... observes the block's duration"""
+        return _Timer(self, labels)
+    
+    def count(self, *labels) -> int:
+        with self._lock:
+            series = self._series.get(labels)
+            return sum(series[0]) if series else 0
+    
+    def _samples(self) -> list:
+        with self._lock:
+            snapshot = sorted((key, list(counts), total) for key, (counts, total) in self._series.items())
+        lines = []
+        for key, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, key, f'le="{_format_value(float(bound))}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class Gauge(_Metric):
+    """A value read when scraped: read() returns a number, or {label values: number}"""
+    kind = "gauge"
+    
+    def __init__(self, name: str, documentation: str, read: Callable, labels: Iterable[str] = ()):
+        super().__init__(name, documentation, labels)
+        self.read = read
+    
+    def _samples(self) -> list:
+        try:
+            values = self.read()
+        except Exception:
+            logger.exception("Reading gauge %s failed", self.name)
+            return []
+        if values is None:
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f"{self.name}{_format_labels(self.labels, key if isinstance(key, tuple) else (key,))} "
+                f"{_format_value(float(value))}" for key, value in sorted(values.items())]
+
+class Registry:
+    """The metrics rendered together; names are unique"""
+    
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+    
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+    
+    def unregister(self, name: str):
+        with self._lock:
+            self._metrics.pop(name, None)
+    
+    def counter(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+    
+    def histogram(self, name: str, documentation: str, labels: Iterable[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+    
+    def gauge(self, name: str, documentation: str, read: Callable, labels: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, read, labels))
+    
+    def get(self, name: str) -> Optional[_Metric]:
+        with self._lock:
+            return self._metrics.get(name)
+    
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+# Metrics of this process; modules register theirs here at import
+registry = Registry()
+
+def _resident_bytes() -> Optional[int]:
+    """From /proc; None where there is no /proc"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+registry.gauge("process_resident_memory_bytes", "Resident memory size in bytes", _resident_bytes)
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = registry
+    
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood the log
+        pass
+
+def serve(port: int, host: str = "127.0.0.1", registry: Registry = registry) -> ThreadingHTTPServer:
+    """Serve GET /metrics on a daemon thread; port 0 picks a free one"""
+    handler = type("MetricsHandler", (_Handler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+    logger.info("Serving metrics on http://%s:%s/metrics", host, server.server_address[1])
+    return server
@@ -0,0 +1,416 @@
+"""Streaming import/export of user data between storage formats
+
+Reads users one at a time from a JSON snapshot (pretty-printed or the
+one-record-per-line layout), a JSON lines file, a binary snapshot, a set of
+shard files or a SQLite database, and writes them as JSON lines, shard
+files or SQLite. Memory stays flat however many users there are.
+
+Every run counts the users and sums a per-user digest on both sides, then
+reads the result back to check it. A checkpoint next to the destination
+lets an interrupted run continue with --resume.
+
+    python migrate.py export user_data.json users.jsonl
+    python migrate.py export user_data.json user_data.json --to sharded --shards 64 --out-dir new/
+    python migrate.py export users.jsonl user_data.db --resume
+    python migrate.py verify user_data.json user_data.db
+
+The source should not be written to while it is exported; stop the bot or
+compact its journal first.
+"""
+from typing import Iterator, Optional, Tuple
+import argparse
+import codecs
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+
+import snapshot
+from database import SQLiteUserDatabase, shard_of, shard_paths
+from models import PlantList
+
+FORMATS = ("json", "jsonl", "binary", "sharded", "sqlite")
+CHUNK_SIZE = 1 << 20
+CHECKSUM_MOD = 1 << 256
+WHITESPACE = re.compile(r"[ \t\r\n]*")
+
+def _dump(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def digest(user_id: str, user: dict) -> int:
+    """Digest of a user that doesn't depend on the storage format"""
+    canonical = dict(user)
+    # Earned achievements are a set; SQLite doesn't keep their order
+    if isinstance(canonical.get("achievements"), list):
+        canonical["achievements"] = sorted(canonical["achievements"])
+    data = json.dumps([user_id, canonical], ensure_ascii=False, sort_keys=True,
+                      separators=(',', ':'))
+    return int.from_bytes(hashlib.sha256(data.encode('utf-8')).digest(), 'big')
+
+class Totals:
+    """User count and an order-independent checksum"""
+    
+    def __init__(self, count: int = 0, checksum: int = 0):
+        self.count = count
+        self.checksum = checksum
+    
+    def add(self, user_id: str, user: dict):
+        self.count += 1
+        self.checksum = (self.checksum + digest(user_id, user)) % CHECKSUM_MOD
+    
+    def __eq__(self, other):
+        return (self.count, self.checksum) == (other.count, other.checksum)
+    
+    def __str__(self):
+        return f"{self.count} users, checksum {self.checksum:064x}"
+
+# Readers yield (user_id, user, position); starting again from a position
+# continues right after that user
+
+def read_json(path: str, position: int = 0) -> Iterator[Tuple[str, dict, int]]:
+    """Stream the members of a top-level JSON object without loading it"""
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    with open(path, 'rb') as f:
+        f.seek(position)
+        buffer = ""
+        start = cursor = 0  # buffer[start] is at byte `position`
+        eof = False
+        
+        def fill() -> bool:
+            nonlocal buffer, start, cursor, eof
+            if eof:
+                return False
+            chunk = f.read(max(CHUNK_SIZE, len(buffer) - start))
+            eof = not chunk
+            buffer = buffer[start:] + utf8.decode(chunk, final=eof)
+            cursor -= start
+            start = 0
+            return True
+        
+        def skip_space():
+            nonlocal cursor
+            while True:
+                cursor = WHITESPACE.match(buffer, cursor).end()
+                if cursor < len(buffer) or not fill():
+                    return
+        
+        def expect(chars: str) -> str:
+            nonlocal cursor
+            skip_space()
+            if cursor >= len(buffer) or buffer[cursor] not in chars:
+                found = buffer[cursor:cursor + 20] or "end of file"
+                raise ValueError(f"{path}: expected {chars!r} after byte {position}, "
+                                 f"found {found!r}")
+            cursor += 1
+            return buffer[cursor - 1]
+        
+        def parse():
+            nonlocal cursor
+            skip_space()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, cursor)
+                except ValueError:
+                    if fill():
+                        continue
+                    raise
+                cursor = end
+                return value
+        
+        if position == 0:
+            expect("{")
+            skip_space()
+            if buffer[cursor:cursor + 1] == "}":
+                return
+        elif expect(",}") == "}":
+            return
+        while True:
+            user_id = parse()
+            expect(":")
+            user = parse()
+            position += len(buffer[start:cursor].encode('utf-8'))
+            start = cursor
+            yield user_id, user, position
+            if expect(",}") == "}":
+                return
+
+def read_jsonl(path: str, position: int = 0) -> Iterator[Tuple[str, dict, int]]:
+    """One {"id": ..., "user": ...} record per line, as in the journal"""
+    with open(path, 'rb') as f:
+        f.seek(position)
+        for line in f:
+            position += len(line)
+            if line.strip():
+                record = json.loads(line)
+                yield record["id"], record["user"], position
+
+def read_binary(path: str, position: int = 0) -> Iterator[Tuple[str, dict, int]]:
+    with snapshot.SnapshotReader(path) as reader:
+        for number, (user_id, offset, length) in enumerate(reader.iter_index(), 1):
+            if number > position:
+                yield user_id, reader.decode(user_id, offset, length), number
+
+def read_sqlite(path: str, position: Optional[str] = None) -> Iterator[Tuple[str, dict, str]]:
+    database = SQLiteUserDatabase(path)
+    try:
+        for user_id, user in database.iter_users(after=position):
+            yield user_id, user, user_id
+    finally:
+        database.close()
+
+def find_shards(path: str) -> list:
+    """Shard files of the snapshot at `path`, e.g. user_data.00.json ..."""
+    stem, ext = os.path.splitext(path)
+    pattern = re.compile(re.escape(os.path.basename(stem)) + r"\.\d+" + re.escape(ext) + "$")
+    return sorted(name for name in glob.glob(glob.escape(stem) + ".*" + ext)
+                  if pattern.match(os.path.basename(name)))
+
+def read_sharded(path: str, position=None) -> Iterator[Tuple[str, dict, list]]:
+    files = find_shards(path)
+    if not files:
+        raise FileNotFoundError(f"No shard files for {path}")
+    first, inner = position or (0, None)
+    for number in range(first, len(files)):
+        name = files[number]
+        read = read_binary if snapshot.is_snapshot(name) else read_json
+        for user_id, user, inner in read(name, inner or 0):
+            yield user_id, user, [number, inner]
+        inner = None
+
+def plain_plants(records):
+    """Plants stored as columns (see PlantList.from_columns), back in the usual list form"""
+    for user_id, user, position in records:
+        if isinstance(user, dict) and isinstance(user.get("plants"), dict):
+            try:
+                user = dict(user, plants=PlantList.from_columns(user["plants"]).to_list())
+            except (KeyError, TypeError, ValueError, OverflowError):
+                # Copied as stored
+                pass
+        yield user_id, user, position
+
+def open_source(path: str, kind: str, position=None):
+    if kind == "sharded":
+        return plain_plants(read_sharded(path, position))
+    if kind == "sqlite":
+        return read_sqlite(path, position)
+    reader = {"json": read_json, "jsonl": read_jsonl, "binary": read_binary}[kind]
+    return plain_plants(reader(path, position or 0))
+
+def detect_format(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".jsonl":
+        return "jsonl"
+    if ext in (".db", ".sqlite", ".sqlite3"):
+        return "sqlite"
+    if os.path.isfile(path):
+        return "binary" if snapshot.is_snapshot(path) else "json"
+    if find_shards(path):
+        return "sharded"
+    return "binary" if ext == ".snap" else "json"
+
+# Sinks keep what they have written durable at every checkpoint and can
+# pick up from the state they returned there
+
+class JsonlSink:
+    def __init__(self, path: str, state: Optional[dict] = None):
+        self.path = path
+        self.file = open(path, 'r+b' if state else 'wb')
+        if state:
+            self.file.truncate(state["size"])
+            self.file.seek(state["size"])
+    
+    def write(self, user_id: str, user: dict):
+        self.file.write(_dump({"id": user_id, "user": user}) + b"\n")
+    
+    def checkpoint(self) -> dict:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return {"size": self.file.tell()}
+    
+    def close(self):
+        self.checkpoint()
+        self.file.close()
+
+class ShardedSink:
+    """Shard files in UserDatabase's layout, renamed into place when done"""
+    
+    def __init__(self, path: str, shards: int, state: Optional[dict] = None):
+        self.paths = shard_paths(path, shards)
+        self.files = []
+        for number, name in enumerate(self.paths):
+            if state:
+                f = open(name + ".tmp", 'r+b')
+                f.truncate(state["sizes"][number])
+                f.seek(state["sizes"][number])
+            else:
+                f = open(name + ".tmp", 'wb')
+                f.write(b"{")
+            self.files.append(f)
+    
+    def write(self, user_id: str, user: dict):
+        f = self.files[shard_of(user_id, len(self.files))]
+        # Same one-record-per-line layout as UserDatabase snapshots
+        f.write((b"\n" if f.tell() == 1 else b",\n") + _dump(user_id) + b": " + _dump(user))
+    
+    def checkpoint(self) -> dict:
+        for f in self.files:
+            f.flush()
+            os.fsync(f.fileno())
+        return {"sizes": [f.tell() for f in self.files]}
+    
+    def close(self):
+        for f in self.files:
+            f.write(b"\n}\n")
+        self.checkpoint()
+        for f, name in zip(self.files, self.paths):
+            f.close()
+            os.replace(name + ".tmp", name)
+
+class SqliteSink:
+    """Each checkpoint commits one transaction; replaying users is harmless"""
+    
+    def __init__(self, path: str, state: Optional[dict] = None):
+        self.database = SQLiteUserDatabase(path)
+        self.pending = []
+    
+    def write(self, user_id: str, user: dict):
+        self.pending.append((user_id, user))
+    
+    def checkpoint(self) -> dict:
+        self.database.import_users(self.pending)
+        self.pending = []
+        return {}
+    
+    def close(self):
+        self.checkpoint()
+        self.database.close()
+
+def open_sink(path: str, kind: str, shards: int, state: Optional[dict] = None):
+    if kind == "jsonl":
+        return JsonlSink(path, state)
+    if kind == "sharded":
+        return ShardedSink(path, shards, state)
+    if kind == "sqlite":
+        return SqliteSink(path, state)
+    raise ValueError(f"Cannot export to {kind}")
+
+def scan(path: str, kind: str) -> Totals:
+    totals = Totals()
+    for user_id, user, _ in open_source(path, kind):
+        totals.add(user_id, user)
+    return totals
+
+def _save_checkpoint(path: str, state: dict):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def export(source: str, destination: str, source_kind: str, kind: str,
+           shards: int = 1, batch: int = 10000, resume: bool = False) -> Tuple[Totals, Totals]:
+    """Copy every user from source to destination, then read it back
+
+    Returns totals for what was read and for what the destination holds.
+    """
+    checkpoint_path = destination + ".checkpoint"
+    state = None
+    if resume and os.path.exists(checkpoint_path):
+        with open(checkpoint_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if (state["source"], state["to"], state["shards"]) != \
+                (os.path.abspath(source), kind, shards):
+            raise ValueError(f"{checkpoint_path} belongs to a different export")
+        print(f"Resuming after {state['count']} users", file=sys.stderr)
+    
+    totals = Totals(state["count"], int(state["checksum"], 16)) if state else Totals()
+    position = state["position"] if state else None
+    sink = open_sink(destination, kind, shards, state and state["sink"])
+    
+    def save():
+        _save_checkpoint(checkpoint_path, {
+            "source": os.path.abspath(source), "to": kind, "shards": shards,
+            "position": position, "count": totals.count,
+            "checksum": f"{totals.checksum:x}", "sink": sink.checkpoint()
+        })
+    
+    for user_id, user, position in open_source(source, source_kind, position):
+        sink.write(user_id, user)
+        totals.add(user_id, user)
+        if totals.count % batch == 0:
+            save()
+            print(f"{totals.count} users", file=sys.stderr)
+    sink.close()
+    
+    written = scan(destination, kind)
+    if written == totals and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return totals, written
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    command = commands.add_parser("export", help="copy users into another format")
+    command.add_argument("source")
+    command.add_argument("destination")
+    command.add_argument("--from", dest="source_format", choices=FORMATS)
+    command.add_argument("--to", choices=("jsonl", "sharded", "sqlite"))
+    command.add_argument("--shards", type=int, default=int(os.getenv("DATA_SHARDS", "1")))
+    command.add_argument("--out-dir", help="put destination files here")
+    command.add_argument("--batch", type=int, default=10000,
+                         help="users between checkpoints (default: %(default)s)")
+    command.add_argument("--resume", action="store_true",
+                         help="continue an interrupted export")
+    
+    for name, text in (("verify", "compare two data sets"), ("stats", "count and checksum")):
+        command = commands.add_parser(name, help=text)
+        command.add_argument("source")
+        if name == "verify":
+            command.add_argument("destination")
+        command.add_argument("--from", dest="source_format", choices=FORMATS)
+        if name == "verify":
+            command.add_argument("--to", choices=FORMATS)
+    args = parser.parse_args()
+    
+    source_kind = args.source_format or detect_format(args.source)
+    journal = args.source + ".log"
+    if os.path.exists(journal) and os.path.getsize(journal):
+        print(f"warning: {journal} has journaled changes that are not exported; "
+              f"compact the database first", file=sys.stderr)
+    if args.command == "stats":
+        print(scan(args.source, source_kind))
+        return
+    
+    destination = args.destination
+    if args.command == "export":
+        if args.out_dir:
+            os.makedirs(args.out_dir, exist_ok=True)
+            destination = os.path.join(args.out_dir, os.path.basename(destination))
+        kind = args.to or ("sharded" if args.shards > 1 else detect_format(destination))
+        if kind not in ("jsonl", "sharded", "sqlite"):
+            parser.error(f"cannot export to {kind}; use --to jsonl, sharded or sqlite")
+        if kind == "sharded" and args.shards < 2:
+            parser.error("--to sharded needs --shards 2 or more")
+        exists = find_shards(destination) if kind == "sharded" else os.path.exists(destination)
+        if exists and not (args.resume and os.path.exists(destination + ".checkpoint")):
+            parser.error(f"{destination} already exists")
+        read, written = export(args.source, destination, source_kind, kind,
+                               args.shards, args.batch, args.resume)
+    else:
+        read = scan(args.source, source_kind)
+        written = scan(destination, args.to or detect_format(destination))
+    
+    print(f"source:      {read}")
+    print(f"destination: {written}")
+    if read != written:
+        print("MISMATCH", file=sys.stderr)
+        sys.exit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,818 @@
+"""Compact in-memory user records
+
+Users loaded by UserDatabase are User objects rather than nested dicts:
+fields live in __slots__, timestamps are integer microseconds since the
+epoch, dates are day numbers, languages and plant types are small ids into
+a process-wide symbol table, plants are three parallel arrays and earned
+achievements a bitmask.
+
+Every record still behaves like the dict it replaces - user["stats"]
+["total_plants"], user.get("current_session"), user["plants"][-10:] and
+user.update(...) read and write the familiar JSON values - so handlers
+don't change. Attributes (user.stats.total_plants, user.created_at) give
+the stored form. Conversion happens only at the persistence boundary,
+with from_dict and to_dict.
+"""
+from array import array
+from collections import Counter
+from collections.abc import MutableMapping
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from operator import itemgetter
+from typing import Optional
+import re
+import sys
+import threading
+
+from achievements import BITS as _ACHIEVEMENT_BITS, ids_of as _achievement_ids
+
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_DAY = date(1970, 1, 1).toordinal()
+_MICROSECOND = timedelta(microseconds=1)
+_DAY = 86400 * 10 ** 6
+
+def parse_timestamp(value) -> Optional[int]:
+    """Microseconds since epoch, None unless it converts back unchanged"""
+    if not isinstance(value, str):
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if moment.tzinfo is not None or moment.isoformat() != value:
+        return None
+    return (moment - _EPOCH) // _MICROSECOND
+
+# What isoformat() writes for a naive datetime, the only form parse_timestamp takes
+_ISO_TIMESTAMP = r"[0-9]{4}-[0-9]{2}-[0-9]{2}T(?:[01][0-9]|2[0-3]):[0-5][0-9]:[0-5][0-9](?:\.(?!000000)[0-9]{6})?"
+_ISO_TIMESTAMPS = re.compile(f"(?:{_ISO_TIMESTAMP}\n)*{_ISO_TIMESTAMP}")
+
+def parse_timestamps(values: list) -> Optional[list]:
+    """parse_timestamp of every value, or None unless all of them convert
+
+    One match over the joined strings checks their form, which costs far
+    less than formatting each datetime again to compare.
+    """
+    if not values:
+        return []
+    try:
+        if not _ISO_TIMESTAMPS.fullmatch("\n".join(values)):
+            return None
+        return [(moment - _EPOCH) // _MICROSECOND for moment in map(datetime.fromisoformat, values)]
+    except (TypeError, ValueError):
+        return None
+
+@lru_cache(maxsize=4096)
+def _date_prefix(day: int) -> str:
+    return date.fromordinal(day + _EPOCH_DAY).isoformat() + "T"
+
+def format_timestamp(micros: int) -> str:
+    """Same output as datetime.isoformat(), without building a datetime"""
+    day, micros = divmod(micros, _DAY)
+    seconds, fraction = divmod(micros, 10 ** 6)
+    minutes, second = divmod(seconds, 60)
+    hour, minute = divmod(minutes, 60)
+    if fraction:
+        return "%s%02d:%02d:%02d.%06d" % (_date_prefix(day), hour, minute, second, fraction)
+    return "%s%02d:%02d:%02d" % (_date_prefix(day), hour, minute, second)
+
+def parse_day(value) -> Optional[int]:
+    """Days since epoch, None unless it converts back unchanged"""
+    if not isinstance(value, str):
+        return None
+    try:
+        day = date.fromisoformat(value)
+    except ValueError:
+        return None
+    if day.isoformat() != value:
+        return None
+    return day.toordinal() - _EPOCH_DAY
+
+@lru_cache(maxsize=4096)
+def format_day(day: int) -> str:
+    return date.fromordinal(day + _EPOCH_DAY).isoformat()
+
+class _Raw:
+    """A value kept exactly as loaded because it doesn't fit the typed field"""
+    __slots__ = ("value",)
+    
+    def __init__(self, value):
+        self.value = value
+
+# Languages, plant types and the like: a handful of distinct strings shared
+# by every user
+SYMBOLS = []
+_symbol_ids = {}
+_symbols_lock = threading.Lock()
+
+def symbol(value: str) -> int:
+    symbol_id = _symbol_ids.get(value)
+    if symbol_id is None:
+        with _symbols_lock:
+            symbol_id = _symbol_ids.get(value)
+            if symbol_id is None:
+                symbol_id = _symbol_ids[value] = len(SYMBOLS)
+                SYMBOLS.append(value)
+    return symbol_id
+
+# Field codecs: (stored -> public, public -> stored)
+
+def _load_timestamp(value):
+    if type(value) is int:
+        return format_timestamp(value)
+    return value.value if type(value) is _Raw else value
+
+def _store_timestamp(value):
+    micros = parse_timestamp(value)
+    if micros is not None:
+        return micros
+    # Strings and None are unambiguous; anything else is wrapped
+    return value if value is None or isinstance(value, str) else _Raw(value)
+
+def _load_day(value):
+    if type(value) is int:
+        return format_day(value)
+    return value.value if type(value) is _Raw else value
+
+def _store_day(value):
+    day = parse_day(value)
+    if day is not None:
+        return day
+    return value if value is None or isinstance(value, str) else _Raw(value)
+
+def _load_symbol(value):
+    return SYMBOLS[value] if type(value) is int else value.value
+
+def _store_symbol(value):
+    return symbol(value) if isinstance(value, str) else _Raw(value)
+
+def _store_string(value):
+    return sys.intern(value) if type(value) is str else value
+
+TIMESTAMP = (_load_timestamp, _store_timestamp)
+DAY = (_load_day, _store_day)
+SYMBOL = (_load_symbol, _store_symbol)
+STRING = (None, _store_string)
+
+class _Missing:
+    """Marks a field the loaded record didn't have"""
+    __slots__ = ()
+    
+    def __repr__(self):
+        return "MISSING"
+
+MISSING = _Missing()
+
+class Record(MutableMapping):
+    """Dict-compatible record whose known keys are stored in slots
+
+    FIELDS lists the keys kept in slots, in the order to_dict writes them;
+    CODECS maps a field to (load, store) functions between the stored and
+    the JSON form. Any other key goes to the `extra` dict.
+    """
+    __slots__ = ("extra",)
+    FIELDS = ()
+    CODECS = {}
+    _field_set = frozenset()
+    
+    def __init__(self, **values):
+        for key in self.FIELDS:
+            setattr(self, key, MISSING)
+        self.extra = None
+        for key, value in values.items():
+            self[key] = value
+    
+    @classmethod
+    def from_dict(cls, data):
+        # Plain dicts skip the slower ABC isinstance check
+        if type(data) is not dict and isinstance(data, cls):
+            return data
+        record = cls.__new__(cls)
+        codecs = cls.CODECS
+        for key in cls.FIELDS:
+            value = data.get(key, MISSING)
+            if value is not MISSING and key in codecs:
+                value = codecs[key][1](value)
+            setattr(record, key, value)
+        extra = {key: value for key, value in data.items() if key not in cls._field_set}
+        record.extra = extra or None
+        return record
+    
+    @classmethod
+    def from_stored(cls, values: dict, rest: dict = None):
+        """Record from fields already in stored form, plus JSON values for other keys
+
+        For decoders whose format holds the stored form (epochs, day
+        numbers, symbol ids), so nothing is converted twice.
+        """
+        record = cls.__new__(cls)
+        for key in cls.FIELDS:
+            setattr(record, key, values.get(key, MISSING))
+        record.extra = None
+        for key, value in (rest or {}).items():
+            record[key] = value
+        return record
+    
+    def to_dict(self) -> dict:
+        """Plain JSON-ready dict, nested records included"""
+        data = {}
+        for key in self.FIELDS:
+            value = getattr(self, key)
+            if value is MISSING:
+                continue
+            load = self.CODECS.get(key, (None,))[0]
+            if load is not None:
+                value = load(value)
+            if isinstance(value, (Record, PlantList, Achievements, DailySeries)):
+                value = value.to_dict() if isinstance(value, (Record, DailySeries)) else value.to_list()
+            data[key] = value
+        if self.extra:
+            data.update(self.extra)
+        return data
+    
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._field_set = frozenset(cls.FIELDS)
+    
+    def __getitem__(self, key):
+        if key in self._field_set:
+            value = getattr(self, key)
+            if value is MISSING:
+                raise KeyError(key)
+            load = self.CODECS.get(key, (None,))[0]
+            return value if load is None else load(value)
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+    
+    def __setitem__(self, key, value):
+        if key in self._field_set:
+            store = self.CODECS.get(key, (None, None))[1]
+            setattr(self, key, value if store is None else store(value))
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+    
+    def __delitem__(self, key):
+        if key in self._field_set and getattr(self, key) is not MISSING:
+            setattr(self, key, MISSING)
+        elif self.extra is not None and key in self.extra:
+            del self.extra[key]
+        else:
+            raise KeyError(key)
+    
+    def __iter__(self):
+        for key in self.FIELDS:
+            if getattr(self, key) is not MISSING:
+                yield key
+        if self.extra:
+            yield from list(self.extra)
+    
+    def __len__(self):
+        return sum(getattr(self, key) is not MISSING for key in self.FIELDS) + \
+            len(self.extra or ())
+    
+    def __contains__(self, key):
+        if key in self._field_set:
+            return getattr(self, key) is not MISSING
+        return self.extra is not None and key in self.extra
+    
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    
+    def update(self, other=(), **kwargs):
+        if other is self:
+            # update_user(user_id, user) with the live record: nothing to do
+            other = ()
+        super().update(other, **kwargs)
+    
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = other.to_dict()
+        return isinstance(other, dict) and self.to_dict() == other
+    
+    __hash__ = None
+    
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+class Stats(Record):
+    __slots__ = ("total_focus_minutes", "total_plants", "current_streak",
+                 "longest_streak", "last_activity_date", "streak_freezes")
+    FIELDS = __slots__
+    CODECS = {"last_activity_date": DAY}
+
+class Preferences(Record):
+    __slots__ = ("session_duration", "favorite_plant")
+    FIELDS = __slots__
+    CODECS = {"favorite_plant": STRING}
+
+class Session(Record):
+    __slots__ = ("start_time", "duration_minutes", "plant_type", "status", "chat_id", "end_time")
+    FIELDS = __slots__
+    CODECS = {"start_time": TIMESTAMP, "end_time": TIMESTAMP,
+              "plant_type": SYMBOL, "status": STRING}
+
+# Plants always kept in memory, enough for the forest view
+RECENT_PLANTS = 10
+
+_PLANT_TYPE, _PLANT_GROWN_AT, _PLANT_MINUTES = map(itemgetter, ("type", "grown_at", "session_minutes"))
+
+class PlantList:
+    """List of plant dicts stored as parallel arrays
+
+    Reading yields fresh {"type", "grown_at", "session_minutes"} dicts, so
+    add plants with append(); editing a read dict changes nothing.
+    Plants that don't fit the arrays are kept as loaded in `odd`.
+
+    Per-species counters are kept up to date on append. archive() drops
+    the oldest plants from memory; `archived` and the counters still
+    include them.
+    """
+    __slots__ = ("types", "grown_at", "minutes", "odd", "counts", "archived")
+    
+    def __init__(self, plants=()):
+        self.types = array('H')
+        self.grown_at = array('q')
+        self.minutes = array('I')
+        self.odd = None
+        # Plants per species, indexed by symbol id
+        self.counts = array('I')
+        self.archived = 0
+        for plant in plants:
+            self.append(plant)
+    
+    def append(self, plant: dict):
+        if isinstance(plant, dict) and len(plant) == 3:
+            plant_type = plant.get("type")
+            moment = parse_timestamp(plant.get("grown_at"))
+            length = plant.get("session_minutes")
+            if isinstance(plant_type, str) and moment is not None and \
+                    type(length) is int and 0 <= length <= 0xFFFFFFFF:
+                type_id = symbol(plant_type)
+                if type_id <= 0xFFFF:
+                    self.add(type_id, moment, length)
+                    return
+        if self.odd is None:
+            self.odd = {}
+        self.odd[len(self.types)] = plant
+        self.types.append(0)
+        self.grown_at.append(0)
+        self.minutes.append(0)
+        if isinstance(plant, dict) and isinstance(plant.get("type"), str):
+            self._count(symbol(plant["type"]))
+    
+    def add(self, type_id: int, grown_at: int, minutes: int):
+        """Append a plant in stored form"""
+        self.types.append(type_id)
+        self.grown_at.append(grown_at)
+        self.minutes.append(minutes)
+        self._count(type_id)
+    
+    def _count(self, type_id: int, number: int = 1):
+        if type_id >= len(self.counts):
+            self.counts.extend([0] * (type_id + 1 - len(self.counts)))
+        self.counts[type_id] += number
+    
+    def count(self, plant_type: str) -> int:
+        """Plants of a species grown so far, archived ones included"""
+        type_id = _symbol_ids.get(plant_type)
+        return self.counts[type_id] if type_id is not None and type_id < len(self.counts) else 0
+    
+    def species_counts(self) -> dict:
+        return {SYMBOLS[type_id]: number for type_id, number in enumerate(self.counts) if number}
+    
+    @property
+    def total(self) -> int:
+        return self.archived + len(self.types)
+    
+    def recent(self, number: int = RECENT_PLANTS) -> list:
+        return self[-number:] if number else []
+    
+    def archive(self, keep: int = RECENT_PLANTS):
+        """Drop all but the last `keep` plants from memory
+
+        Returns the number of plants archived before and the dropped
+        plants, for the caller to put in cold storage.
+        """
+        number = len(self.types) - keep
+        if number <= 0:
+            return self.archived, []
+        plants = self[:number]
+        del self.types[:number]
+        del self.grown_at[:number]
+        del self.minutes[:number]
+        if self.odd is not None:
+            self.odd = {i - number: plant for i, plant in self.odd.items() if i >= number} or None
+        start = self.archived
+        self.archived += number
+        return start, plants
+    
+    def archive_summary(self) -> dict:
+        """What the counters hold for archived plants, to persist with the user"""
+        counts = array('I', self.counts)
+        for i, type_id in enumerate(self.types):
+            plant = self.odd.get(i) if self.odd is not None else None
+            if plant is None:
+                counts[type_id] -= 1
+            elif isinstance(plant, dict) and isinstance(plant.get("type"), str):
+                counts[symbol(plant["type"])] -= 1
+        return {"count": self.archived,
+                "species": {SYMBOLS[type_id]: number
+                            for type_id, number in enumerate(counts) if number}}
+    
+    def restore_archive(self, summary: dict):
+        self.archived += summary.get("count", 0)
+        for plant_type, number in summary.get("species", {}).items():
+            self._count(symbol(plant_type), number)
+    
+    def _plant(self, i: int):
+        if self.odd is not None and i in self.odd:
+            return self.odd[i]
+        return {"type": SYMBOLS[self.types[i]],
+                "grown_at": format_timestamp(self.grown_at[i]),
+                "session_minutes": self.minutes[i]}
+    
+    def __len__(self):
+        return len(self.types)
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._plant(j) for j in range(*i.indices(len(self.types)))]
+        if i < 0:
+            i += len(self.types)
+        if not 0 <= i < len(self.types):
+            raise IndexError("plant index out of range")
+        return self._plant(i)
+    
+    def __iter__(self):
+        for i in range(len(self.types)):
+            yield self._plant(i)
+    
+    def __eq__(self, other):
+        if isinstance(other, PlantList):
+            other = other.to_list()
+        return isinstance(other, list) and self.to_list() == other
+    
+    __hash__ = None
+    
+    def to_list(self) -> list:
+        return list(self)
+    
+    @classmethod
+    def from_columns(cls, columns: dict) -> "PlantList":
+        """Plants stored as {"type": [...], "grown_at": [...], "session_minutes": [...]}
+
+        Timestamps are microseconds since the epoch. Shards store the plant
+        list; this layout is only read, for files written in it.
+
+        Raises ValueError, TypeError or OverflowError if the columns are
+        malformed; arrays refuse non-integers and out-of-range values.
+        """
+        names, grown_at, minutes = columns["type"], columns["grown_at"], columns["session_minutes"]
+        if len(columns) != 3 or not type(names) is type(grown_at) is type(minutes) is list or \
+                not len(names) == len(grown_at) == len(minutes):
+            raise ValueError("bad plant columns")
+        for name in set(names).difference(_symbol_ids):
+            if type(name) is not str:
+                raise ValueError(f"bad plant type {name!r}")
+            symbol(name)
+        # fromlist() is much cheaper than building an array from an iterable
+        types, moments, lengths = array('H'), array('q'), array('I')
+        types.fromlist(list(map(_symbol_ids.__getitem__, names)))
+        moments.fromlist(grown_at)
+        lengths.fromlist(minutes)
+        return cls.from_arrays(types, moments, lengths)
+    
+    @classmethod
+    def from_list(cls, plants: list) -> "PlantList":
+        """Same as PlantList(plants), converting all plants at once
+
+        Goes one plant at a time when some plant doesn't fit the arrays
+        and has to be kept as loaded.
+        """
+        try:
+            names = list(map(_PLANT_TYPE, plants))
+            stamps = list(map(_PLANT_GROWN_AT, plants))
+            minutes = list(map(_PLANT_MINUTES, plants))
+        except (KeyError, TypeError, IndexError):
+            return cls(plants)
+        grown_at = parse_timestamps(stamps)
+        if grown_at is None or not set(map(type, plants)) <= {dict} or \
+                not set(map(len, plants)) <= {3} or \
+                not set(map(type, names)) <= {str} or not set(map(type, minutes)) <= {int}:
+            return cls(plants)
+        for name in set(names).difference(_symbol_ids):
+            symbol(name)
+        types, moments, lengths = array('H'), array('q'), array('I')
+        try:
+            types.fromlist(list(map(_symbol_ids.__getitem__, names)))
+            moments.fromlist(grown_at)
+            lengths.fromlist(minutes)
+        except OverflowError:
+            return cls(plants)
+        return cls.from_arrays(types, moments, lengths)
+    
+    @classmethod
+    def from_arrays(cls, types: array, grown_at: array, minutes: array) -> "PlantList":
+        """Plants in stored form: symbol ids ('H'), timestamps ('q'), minutes ('I')"""
+        plants = cls()
+        plants.types, plants.grown_at, plants.minutes = types, grown_at, minutes
+        if types:
+            counts = plants.counts
+            counts.fromlist([0] * (max(types) + 1))
+            for type_id, number in Counter(types).items():
+                counts[type_id] = number
+        return plants
+    
+    def __repr__(self):
+        return f"PlantList({self.to_list()!r})"
+
+class Achievements:
+    """Earned achievement ids as a bitmask over the catalog
+
+    Reads like the list it is stored as, in catalog order, with O(1)
+    membership. Ids the catalog doesn't know are kept in `other`.
+    """
+    __slots__ = ("mask", "other")
+    
+    def __init__(self, ach_ids=()):
+        self.mask = 0
+        self.other = None
+        self.extend(ach_ids)
+    
+    def append(self, ach_id):
+        bit = _ACHIEVEMENT_BITS.get(ach_id)
+        if bit is not None:
+            self.mask |= bit
+        elif ach_id not in (self.other or ()):
+            if type(ach_id) is str:
+                ach_id = sys.intern(ach_id)
+            self.other = (self.other or ()) + (ach_id,)
+    
+    def extend(self, ach_ids):
+        for ach_id in ach_ids:
+            self.append(ach_id)
+    
+    def __contains__(self, ach_id):
+        bit = _ACHIEVEMENT_BITS.get(ach_id)
+        if bit is not None:
+            return bool(self.mask & bit)
+        return ach_id in (self.other or ())
+    
+    def __len__(self):
+        return bin(self.mask).count("1") + len(self.other or ())
+    
+    def __iter__(self):
+        yield from _achievement_ids(self.mask)
+        yield from self.other or ()
+    
+    def __add__(self, other):
+        return self.to_list() + list(other)
+    
+    def __radd__(self, other):
+        return list(other) + self.to_list()
+    
+    def __eq__(self, other):
+        if isinstance(other, Achievements):
+            return self.mask == other.mask and set(self.other or ()) == set(other.other or ())
+        return isinstance(other, list) and self.to_list() == other
+    
+    __hash__ = None
+    
+    def to_list(self) -> list:
+        return list(self)
+    
+    def __repr__(self):
+        return f"Achievements({self.to_list()!r})"
+
+# Days of history kept by DailySeries, the longest of its windows
+SERIES_DAYS = 30
+# Rolling sums kept up to date, in days
+SERIES_WINDOWS = (7, 30)
+
+def day_number(day: date) -> int:
+    return day.toordinal() - _EPOCH_DAY
+
+class DailySeries:
+    """Focus minutes and plants per day over the last SERIES_DAYS days
+
+    Days live in ring buffers indexed by day number modulo SERIES_DAYS,
+    with a running (minutes, plants) sum per window in SERIES_WINDOWS, so
+    "the last 7 days" costs the same however long the history is. Adding
+    a day first drops the days that left each window. The best day ever
+    is tracked alongside.
+
+    Stored as {"day", "minutes", "plants", "best_day", "best_minutes"},
+    the lists oldest first and ending at "day".
+    """
+    __slots__ = ("day", "minutes", "plants", "sums", "best_day", "best_minutes")
+    
+    def __init__(self):
+        # Day number of the newest bucket; None while empty
+        self.day = None
+        self.minutes = array('I', bytes(4 * SERIES_DAYS))
+        self.plants = array('H', bytes(2 * SERIES_DAYS))
+        # Minutes and plants of each window in SERIES_WINDOWS, as of self.day
+        self.sums = array('q', bytes(16 * len(SERIES_WINDOWS)))
+        self.best_day = None
+        self.best_minutes = 0
+    
+    def _advance(self, day: int):
+        """Move the newest bucket to `day`, dropping the days that left the windows"""
+        if self.day is None or day - self.day >= SERIES_DAYS:
+            for i in range(SERIES_DAYS):
+                self.minutes[i] = self.plants[i] = 0
+            for i in range(len(self.sums)):
+                self.sums[i] = 0
+            self.day = day
+            return
+        for current in range(self.day + 1, day + 1):
+            for i, window in enumerate(SERIES_WINDOWS):
+                slot = (current - window) % SERIES_DAYS
+                self.sums[2 * i] -= self.minutes[slot]
+                self.sums[2 * i + 1] -= self.plants[slot]
+            slot = current % SERIES_DAYS
+            self.minutes[slot] = self.plants[slot] = 0
+        self.day = day
+    
+    def add(self, day: int, minutes: int, plants: int = 1):
+        """Count a session of `minutes` grown on `day` (a day number)"""
+        if self.day is None or day > self.day:
+            self._advance(day)
+        elif self.day - day >= SERIES_DAYS:
+            # Older than the history kept
+            return
+        slot = day % SERIES_DAYS
+        self.minutes[slot] += minutes
+        self.plants[slot] += plants
+        for i, window in enumerate(SERIES_WINDOWS):
+            if self.day - day < window:
+                self.sums[2 * i] += minutes
+                self.sums[2 * i + 1] += plants
+        if self.minutes[slot] > self.best_minutes:
+            self.best_day, self.best_minutes = day, self.minutes[slot]
+    
+    def totals(self, today: int, window: int) -> tuple:
+        """(minutes, plants) over the `window` days up to `today`"""
+        i = SERIES_WINDOWS.index(window)
+        if self.day is None or today - self.day >= window:
+            return 0, 0
+        minutes, plants = self.sums[2 * i], self.sums[2 * i + 1]
+        # Days that left the window since the newest bucket; at most `window`
+        for day in range(self.day - window + 1, today - window + 1):
+            minutes -= self.minutes[day % SERIES_DAYS]
+            plants -= self.plants[day % SERIES_DAYS]
+        return minutes, plants
+    
+    @classmethod
+    def from_plants(cls, plants) -> "DailySeries":
+        """Build the series from a plant history, for users from before it existed"""
+        if isinstance(plants, PlantList):
+            # Stored timestamps; no ISO strings to parse
+            grown = ((moment, minutes) for i, (moment, minutes)
+                     in enumerate(zip(plants.grown_at, plants.minutes))
+                     if plants.odd is None or i not in plants.odd)
+        else:
+            grown = ((parse_timestamp(plant.get("grown_at")), plant.get("session_minutes"))
+                     for plant in plants if isinstance(plant, dict))
+        days = {}
+        for moment, minutes in grown:
+            if moment is not None and type(minutes) is int:
+                total = days.get(moment // _DAY, (0, 0))
+                days[moment // _DAY] = total[0] + minutes, total[1] + 1
+        series = cls()
+        for day in sorted(days):
+            series.add(day, *days[day])
+        return series
+    
+    @classmethod
+    def from_dict(cls, data: dict) -> "DailySeries":
+        series = cls()
+        day = parse_day(data.get("day"))
+        if day is None and data.get("day") is not None:
+            raise ValueError(f"bad day {data['day']!r}")
+        if day is not None:
+            minutes = data.get("minutes") or []
+            plants = data.get("plants") or []
+            # Whole minutes, as in PlantList and the stats; floats, NaN and bools are refused
+            if any(type(value) is not int or value < 0 for value in list(minutes) + list(plants)):
+                raise ValueError(f"bad series {minutes!r} {plants!r}")
+            for offset in range(max(len(minutes), len(plants)) - 1, -1, -1):
+                # Entries are oldest first, the last one on `day`
+                series.add(day - offset,
+                           minutes[-1 - offset] if offset < len(minutes) else 0,
+                           plants[-1 - offset] if offset < len(plants) else 0)
+            series._advance(day)
+        best_day = parse_day(data.get("best_day"))
+        if best_day is not None:
+            best_minutes = data.get("best_minutes") or 0
+            if type(best_minutes) is not int or best_minutes < 0:
+                raise ValueError(f"bad best_minutes {best_minutes!r}")
+            series.best_day, series.best_minutes = best_day, best_minutes
+        return series
+    
+    def to_dict(self) -> dict:
+        data = {"day": None, "minutes": [], "plants": [],
+                "best_day": None if self.best_day is None else format_day(self.best_day),
+                "best_minutes": self.best_minutes}
+        if self.day is not None:
+            data["day"] = format_day(self.day)
+            slots = [day % SERIES_DAYS for day in range(self.day - SERIES_DAYS + 1, self.day + 1)]
+            # Leading empty days are left out
+            first = next((i for i, slot in enumerate(slots) if self.plants[slot]), len(slots))
+            data["minutes"] = [self.minutes[slot] for slot in slots[first:]]
+            data["plants"] = [self.plants[slot] for slot in slots[first:]]
+        return data
+    
+    def __eq__(self, other):
+        if isinstance(other, DailySeries):
+            other = other.to_dict()
+        return isinstance(other, dict) and self.to_dict() == other
+    
+    __hash__ = None
+    
+    def __repr__(self):
+        return f"DailySeries({self.to_dict()!r})"
+
+def daily_series(user) -> DailySeries:
+    """The user's series; built from the plants for users who don't have one yet"""
+    series = user.get("daily")
+    if isinstance(series, DailySeries):
+        return series
+    if isinstance(series, dict):
+        try:
+            return DailySeries.from_dict(series)
+        except (TypeError, ValueError, OverflowError):
+            pass
+    return DailySeries.from_plants(user.get("plants") or ())
+
+def _store_daily(value):
+    if isinstance(value, dict):
+        try:
+            return DailySeries.from_dict(value)
+        except (TypeError, ValueError, OverflowError):
+            # Kept as loaded; daily_series() rebuilds it from the plants
+            pass
+    return value
+
+def _store_record(cls):
+    return lambda value: cls.from_dict(value) if isinstance(value, dict) else value
+
+def _store_plants(value):
+    if isinstance(value, list):
+        return PlantList.from_list(value)
+    if isinstance(value, dict):
+        try:
+            return PlantList.from_columns(value)
+        except (KeyError, TypeError, ValueError, OverflowError):
+            # Kept as loaded
+            pass
+    return value
+
+def _store_session(value):
+    return Session.from_dict(value) if isinstance(value, dict) else value
+
+def _store_achievements(value):
+    return Achievements(value) if isinstance(value, list) else value
+
+class User(Record):
+    __slots__ = ("user_id", "created_at", "language", "plants", "current_session",
+                 "stats", "preferences", "achievements", "daily")
+    FIELDS = __slots__
+    CODECS = {
+        "created_at": TIMESTAMP,
+        "language": SYMBOL,
+        "plants": (None, _store_plants),
+        "current_session": (None, _store_session),
+        "stats": (None, _store_record(Stats)),
+        "preferences": (None, _store_record(Preferences)),
+        "achievements": (None, _store_achievements),
+        "daily": (None, _store_daily),
+    }
+    
+    @classmethod
+    def from_dict(cls, data):
+        return super().from_dict(data)._restore_archive()
+    
+    @classmethod
+    def from_stored(cls, values: dict, rest: dict = None):
+        return super().from_stored(values, rest)._restore_archive()
+    
+    def _restore_archive(self) -> "User":
+        # Archived plants live in cold storage; the user keeps their totals
+        if self.extra is not None and isinstance(self.plants, PlantList) and \
+                isinstance(self.extra.get("plants_archived"), dict):
+            self.plants.restore_archive(self.extra.pop("plants_archived"))
+            self.extra = self.extra or None
+        return self
+    
+    def to_dict(self) -> dict:
+        data = super().to_dict()
+        if isinstance(self.plants, PlantList) and self.plants.archived:
+            data["plants_archived"] = self.plants.archive_summary()
+        return data
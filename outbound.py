@@ -0,0 +1,458 @@
+"""Queue for messages the bot sends on its own
+
+Reminders, streak warnings and broadcasts go through OutboundQueue instead
+of calling the API from a handler or a timer. send_message() only stores
+the message in an SQLite outbox and returns; a dispatcher thread hands
+messages to a few workers that post them over one pooled HTTP session.
+
+Sending is paced by token buckets: one for the bot, kept under the MAX
+Bot API limit of 30 requests per second, and one per chat. Each chat gets
+its messages in order, one at a time. A 429 or 5xx response, or a network
+error, puts the message back with exponential backoff (a 429 also pauses
+the whole bot for its Retry-After); any other error drops it. Messages
+leave the outbox once sent, in batches, so whatever is pending when the
+bot stops is sent after the next start. Delivery is at least once: a
+message sent just before a crash may be sent again.
+
+    outbound = OutboundQueue(os.getenv("BOT_TOKEN"))
+    outbound.start()
+    outbound.send_message(chat_id, "text", attachments)
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+API_URL = "https://botapi.max.ru"
+
+# Requests per second for the whole bot. The API allows 30, and a full
+# bucket lets BURST + RATE through in the first second
+RATE = float(os.getenv("OUTBOUND_RATE", "25"))
+BURST = float(os.getenv("OUTBOUND_BURST", "5"))
+# Messages per second to one chat, after a burst of CHAT_BURST
+CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+CHAT_BURST = float(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+# Requests in flight; also the size of the connection pool
+WORKERS = int(os.getenv("OUTBOUND_WORKERS", "8"))
+# Attempts before a message is given up on
+MAX_ATTEMPTS = int(os.getenv("OUTBOUND_MAX_ATTEMPTS", "8"))
+# Backoff after the n-th failed attempt: BACKOFF_BASE * 2^(n-1), at most BACKOFF_MAX
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 300.0
+# Seconds a request may take
+TIMEOUT = 30.0
+# Sent messages are deleted from the outbox this often
+FLUSH_INTERVAL = 0.2
+# Longest sleep of the dispatcher
+MAX_WAIT = 60.0
+# Idle chats are forgotten this often, once their bucket has refilled
+PRUNE_INTERVAL = 60.0
+
+class TokenBucket:
+    """`rate` tokens a second, holding at most `burst`"""
+    __slots__ = ("rate", "burst", "tokens", "updated")
+    
+    def __init__(self, rate: float, burst: float, now: float = None):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic() if now is None else now
+    
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+    
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available, 0 if one is"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+    
+    def take(self, now: float) -> float:
+        """Take a token if one is available; otherwise the seconds to wait"""
+        wait = self.wait_time(now)
+        if not wait:
+            self.tokens -= 1
+        return wait
+    
+    def pause(self, now: float, seconds: float):
+        """No tokens for the next `seconds`"""
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+    
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+def outbox_path() -> str:
+    return os.getenv("OUTBOX_FILE") or \
+        os.path.splitext(os.getenv("DATA_FILE", "user_data.json"))[0] + ".outbox.db"
+
+class Outbox:
+    """Pending messages in SQLite; the connection is shared under `_lock`"""
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            user_id INTEGER,
+            body TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL
+        );
+    """
+    
+    def __init__(self, filepath: str = None):
+        self.filepath = filepath or outbox_path()
+        self.conn = sqlite3.connect(self.filepath, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+    
+    def add(self, messages: List[Tuple[Optional[int], Optional[int], dict]]) -> List[int]:
+        """Store (chat_id, user_id, body) messages in one transaction; their ids"""
+        now = time.time()
+        ids = []
+        with self._lock, self.conn:
+            for chat_id, user_id, body in messages:
+                cursor = self.conn.execute(
+                    "INSERT INTO outbox (chat_id, user_id, body, created_at) VALUES (?, ?, ?, ?)",
+                    (chat_id, user_id, json.dumps(body, ensure_ascii=False), now))
+                ids.append(cursor.lastrowid)
+        return ids
+    
+    def body(self, message_id: int) -> Optional[dict]:
+        with self._lock:
+            row = self.conn.execute("SELECT body FROM outbox WHERE id = ?", (message_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def set_attempts(self, message_id: int, attempts: int):
+        with self._lock, self.conn:
+            self.conn.execute("UPDATE outbox SET attempts = ? WHERE id = ?", (attempts, message_id))
+    
+    def delete(self, message_ids: List[int]):
+        with self._lock, self.conn:
+            self.conn.executemany("DELETE FROM outbox WHERE id = ?", ((i,) for i in message_ids))
+    
+    def pending(self) -> Iterable[Tuple[int, Optional[int], Optional[int], int]]:
+        """(id, chat_id, user_id, attempts) of every stored message, oldest first"""
+        with self._lock:
+            return self.conn.execute(
+                "SELECT id, chat_id, user_id, attempts FROM outbox ORDER BY id").fetchall()
+    
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+    
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+class _Chat:
+    """A recipient's queued messages, each [id, attempts, not_before, body]
+
+    The body of a message loaded from the outbox is read when it's sent.
+    """
+    __slots__ = ("queue", "bucket", "busy")
+    
+    def __init__(self, bucket: TokenBucket):
+        self.queue = deque()
+        self.bucket = bucket
+        self.busy = False
+
+class OutboundQueue:
+    """Paced, retried and persisted sending of messages"""
+    
+    def __init__(self, token: str, base_url: str = None, outbox: Outbox = None,
+                 rate: float = RATE, burst: float = BURST,
+                 chat_rate: float = CHAT_RATE, chat_burst: float = CHAT_BURST,
+                 workers: int = WORKERS, max_attempts: int = MAX_ATTEMPTS):
+        self.token = token
+        self.base_url = base_url or os.getenv("MAX_API_URL") or API_URL
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.bucket = TokenBucket(rate, burst)
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        # Opened on first use, so importing the bot creates no file
+        self._outbox = outbox
+        self._outbox_lock = threading.Lock()
+        # (chat_id, user_id) -> _Chat
+        self._chats = {}
+        # (ready, sequence, key) of chats with a message to send and none in flight
+        self._heap = []
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        # Messages in the chats' queues, including those in flight
+        self._queued = 0
+        # Outbox ids up to this one were loaded by start()
+        self._loaded_up_to = 0
+        # Ids of sent messages still in the outbox
+        self._done = []
+        # When idle chats were last forgotten
+        self._pruned = time.monotonic()
+        self._cond = threading.Condition()
+        self._started = False
+        self._closed = False
+        self._thread = None
+        self._pool = None
+        self._session = None
+    
+    @property
+    def outbox(self) -> Outbox:
+        if self._outbox is None:
+            with self._outbox_lock:
+                if self._outbox is None:
+                    self._outbox = Outbox()
+        return self._outbox
+    
+    def __len__(self):
+        """Messages waiting or in flight"""
+        with self._cond:
+            return self._queued
+    
+    def send_message(self, chat_id: int = None, text: str = "",
+                     attachments: List[Dict[str, Any]] = None, user_id: int = None) -> int:
+        """Queue a message to a chat, or to a user's dialog; returns its id"""
+        return self.send_many([(chat_id, user_id, text, attachments)])[0]
+    
+    def send_many(self, messages: Iterable[Tuple[Optional[int], Optional[int], str, Optional[list]]]) -> List[int]:
+        """Queue (chat_id, user_id, text, attachments) messages, stored in one transaction"""
+        rows = []
+        for chat_id, user_id, text, attachments in messages:
+            if (chat_id is None) == (user_id is None):
+                raise ValueError("A message needs either chat_id or user_id")
+            body = {"text": text}
+            if attachments:
+                body["attachments"] = attachments
+            rows.append((chat_id, user_id, body))
+        ids = self.outbox.add(rows)
+        with self._cond:
+            if self._started and not self._closed:
+                now = time.monotonic()
+                for message_id, (chat_id, user_id, body) in zip(ids, rows):
+                    if message_id <= self._loaded_up_to:
+                        # Stored before start() read the outbox, so already queued
+                        continue
+                    self._queue((chat_id, user_id), [message_id, 0, 0.0, body], now)
+        return ids
+    
+    def _queue(self, key, message: list, now: float):
+        chat = self._chats.get(key)
+        if chat is None:
+            chat = self._chats[key] = _Chat(TokenBucket(self.chat_rate, self.chat_burst, now))
+        chat.queue.append(message)
+        self._queued += 1
+        if len(chat.queue) == 1 and not chat.busy:
+            self._push(key, chat, now)
+    
+    def _push(self, key, chat: _Chat, now: float):
+        ready = max(now + chat.bucket.wait_time(now), chat.queue[0][2])
+        entry = (ready, next(self._sequence), key)
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            self._cond.notify_all()
+    
+    def start(self) -> int:
+        """Load what the outbox holds and start sending; returns how many messages"""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        with self._cond:
+            pending = self.outbox.pending()
+            self._session = session
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="outbound-worker")
+            now = time.monotonic()
+            for message_id, chat_id, user_id, attempts in pending:
+                self._queue((chat_id, user_id), [message_id, attempts, 0.0, None], now)
+                self._loaded_up_to = message_id
+            self._started = True
+        self._thread = threading.Thread(target=self._run, name="outbound", daemon=True)
+        self._thread.start()
+        return len(pending)
+    
+    def _next(self):
+        """Wait for a message that may be sent now; None when it's time to flush or stop"""
+        flush_by = time.monotonic() + FLUSH_INTERVAL if self._done else None
+        while not self._closed:
+            now = time.monotonic()
+            if flush_by is not None and now >= flush_by:
+                return None
+            if now - self._pruned >= PRUNE_INTERVAL:
+                self._prune(now)
+                self._pruned = now
+            wait = MAX_WAIT
+            if self._heap and self._in_flight < self.workers:
+                wait = self._heap[0][0] - now
+                if wait <= 0:
+                    wait = self.bucket.wait_time(now)
+                    if not wait:
+                        _, _, key = heapq.heappop(self._heap)
+                        chat = self._chats[key]
+                        wait = chat.bucket.take(now)
+                        if wait:
+                            self._push(key, chat, now)
+                            continue
+                        self.bucket.take(now)
+                        chat.busy = True
+                        self._in_flight += 1
+                        return key, chat.queue[0]
+            if flush_by is not None:
+                wait = min(wait, flush_by - now)
+            elif self._done:
+                flush_by = now + FLUSH_INTERVAL
+                wait = min(wait, FLUSH_INTERVAL)
+            if self._chats:
+                # Up in time to forget idle chats
+                wait = min(wait, self._pruned + PRUNE_INTERVAL - now)
+            self._cond.wait(min(wait, MAX_WAIT))
+        return None
+    
+    def _prune(self, now: float):
+        idle = [key for key, chat in self._chats.items()
+                if not chat.queue and not chat.busy and chat.bucket.full(now)]
+        for key in idle:
+            del self._chats[key]
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                job = self._next()
+                done, self._done = self._done, []
+                closed = self._closed
+            if done:
+                self.outbox.delete(done)
+            if job is not None:
+                self._pool.submit(self._deliver, *job)
+            elif closed:
+                return
+    
+    def _post(self, key, body: dict) -> requests.Response:
+        chat_id, user_id = key
+        params = {"access_token": self.token}
+        if chat_id is not None:
+            params["chat_id"] = chat_id
+        else:
+            params["user_id"] = user_id
+        return self._session.post(self.base_url + "/messages", params=params, json=body, timeout=TIMEOUT)
+    
+    def _backoff(self, attempts: int) -> float:
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+        # Jitter, so messages that failed together don't retry together
+        return delay * random.uniform(0.5, 1.0)
+    
+    def _attempt(self, key, message: list) -> Tuple[str, float]:
+        """Send one message; ("sent" | "retry" | "failed", seconds to wait before a retry)"""
+        body = message[3] or self.outbox.body(message[0])
+        if body is None:
+            # Deleted from the outbox by someone else
+            return "failed", 0.0
+        try:
+            response = self._post(key, body)
+        except requests.RequestException as e:
+            logger.warning("Sending message %s failed: %s", message[0], e)
+            return "retry", self._backoff(message[1] + 1)
+        if response.status_code < 400:
+            return "sent", 0.0
+        if response.status_code == 429:
+            try:
+                delay = float(response.headers.get("Retry-After", ""))
+            except ValueError:
+                delay = self._backoff(message[1] + 1)
+            with self._cond:
+                # The limit is the bot's, not just this chat's
+                self.bucket.pause(time.monotonic(), delay)
+            return "retry", delay
+        if response.status_code >= 500:
+            return "retry", self._backoff(message[1] + 1)
+        logger.warning("Message %s to %s rejected: HTTP %s %s",
+                       message[0], key, response.status_code, response.text[:200])
+        return "failed", 0.0
+    
+    def _deliver(self, key, message: list):
+        try:
+            outcome, delay = self._attempt(key, message)
+        except Exception:
+            logger.exception("Sending message %s failed", message[0])
+            outcome, delay = "retry", self._backoff(message[1] + 1)
+        if outcome == "retry":
+            message[1] += 1
+            if message[1] >= self.max_attempts:
+                logger.warning("Giving up on message %s to %s after %s attempts", message[0], key, message[1])
+                outcome = "failed"
+            else:
+                self.outbox.set_attempts(message[0], message[1])
+        with self._cond:
+            self._in_flight -= 1
+            chat = self._chats[key]
+            chat.busy = False
+            now = time.monotonic()
+            if outcome == "retry":
+                self.retried += 1
+                message[2] = now + delay
+            else:
+                if outcome == "sent":
+                    self.sent += 1
+                else:
+                    self.failed += 1
+                chat.queue.popleft()
+                self._queued -= 1
+                self._done.append(message[0])
+            if chat.queue and not self._closed:
+                self._push(key, chat, now)
+            self._cond.notify_all()
+    
+    def drain(self, timeout: float = None) -> bool:
+        """Wait until nothing is waiting or in flight; False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._queued:
+                remaining = 1.0 if deadline is None else min(1.0, deadline - time.monotonic())
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+    
+    def stats(self) -> dict:
+        with self._cond:
+            return {"queued": self._queued,
+                    "in_flight": self._in_flight, "chats": len(self._chats),
+                    "sent": self.sent, "retried": self.retried, "failed": self.failed}
+    
+    def close(self):
+        """Stop sending; messages in flight are finished, the rest wait in the outbox"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        if self._pool is not None:
+            self._pool.shutdown()
+        with self._cond:
+            done, self._done = self._done, []
+        if self._outbox is not None:
+            if done:
+                self._outbox.delete(done)
+            self._outbox.close()
+        if self._session is not None:
+            self._session.close()
@@ -1,4 +1,6 @@
 # Plant progression system with Russian names
+from bisect import bisect_right
+
 PLANT_SPECIES = {
     # FREE TIER - Basic plants
     "seedling": {
@@ -96,59 +98,110 @@ PLANT_SPECIES = {
     }
 }
 
-def get_available_plants(user_data: dict, is_premium: bool = False) -> list:
-    """Return list of plants user can currently grow"""
-    total_plants = user_data["stats"]["total_plants"]
-    available = []
+class _UnlockIndex:
+    """PLANT_SPECIES sorted by unlock threshold, with results cached per bucket
+
+    A bucket is how many distinct thresholds a plant count has reached;
+    every count in a bucket has the same plants available.
+    """
     
-    for plant_id, plant_info in PLANT_SPECIES.items():
-        # Check if unlocked by count
-        if total_plants >= plant_info["unlock_at"]:
-            # Check if premium required
-            if plant_info.get("premium", False) and not is_premium:
-                continue
-            available.append((plant_id, plant_info))
+    def __init__(self, species: dict):
+        ordered = sorted(species.items(), key=lambda item: item[1]["unlock_at"])
+        self.unlock_at = [info["unlock_at"] for _, info in ordered]
+        self.ordered = ordered
+        self.thresholds = sorted(set(self.unlock_at))
+        self.species = list(species.items())
+        # (bucket, premium) -> available plants in catalog order
+        self.available = {}
     
-    return available
+    def bucket(self, total_plants) -> int:
+        return bisect_right(self.thresholds, total_plants)
+    
+    def available_in(self, bucket: int, is_premium: bool) -> list:
+        key = (bucket, is_premium)
+        available = self.available.get(key)
+        if available is None:
+            reached = self.thresholds[bucket - 1] if bucket else None
+            available = [(plant_id, plant_info) for plant_id, plant_info in self.species
+                         if reached is not None and plant_info["unlock_at"] <= reached
+                         and (is_premium or not plant_info.get("premium", False))]
+            self.available[key] = available
+        return available
+
+_unlock_index = None
+# Bumped by catalog_changed(), for caches built from the catalog
+catalog_version = 0
+
+def _index() -> _UnlockIndex:
+    global _unlock_index
+    index = _unlock_index
+    if index is None:
+        index = _unlock_index = _UnlockIndex(PLANT_SPECIES)
+    return index
+
+def catalog_changed():
+    """Call after editing PLANT_SPECIES so lookups see the new catalog"""
+    global _unlock_index, catalog_version
+    _unlock_index = None
+    catalog_version += 1
+
+def unlock_bucket(total_plants: int) -> int:
+    """Users in the same bucket have the same plants unlocked"""
+    return _index().bucket(total_plants)
+
+def unlock_buckets() -> int:
+    """How many buckets there are, numbered from 0"""
+    return len(_index().thresholds) + 1
+
+def plants_in_bucket(bucket: int, is_premium: bool = False) -> list:
+    """Plants available to users in a bucket"""
+    return list(_index().available_in(bucket, is_premium))
+
+def get_available_plants(user_data: dict, is_premium: bool = False) -> list:
+    """Return list of plants user can currently grow"""
+    return plants_in_bucket(unlock_bucket(user_data["stats"]["total_plants"]), is_premium)
 
 def get_next_unlock(user_data: dict) -> dict:
     """Get info about next plant to unlock"""
     total_plants = user_data["stats"]["total_plants"]
-    
-    for plant_id, plant_info in sorted(PLANT_SPECIES.items(), 
-                                       key=lambda x: x[1]["unlock_at"]):
-        if total_plants < plant_info["unlock_at"]:
-            return {
-                "plant": plant_info,
-                "plants_needed": plant_info["unlock_at"] - total_plants
-            }
-    
-    return None
+    index = _index()
+    i = bisect_right(index.unlock_at, total_plants)
+    if i == len(index.ordered):
+        return None
+    plant_info = index.ordered[i][1]
+    return {
+        "plant": plant_info,
+        "plants_needed": plant_info["unlock_at"] - total_plants
+    }
 
-# Achievement system
+# Achievement system: each one is earned once a user's stat reaches its threshold
 ACHIEVEMENTS = {
     "first_plant": {
         "icon": "🏆",
         "name_ru": "Первый росток",
         "description_ru": "Вырастил первое растение",
-        "condition": lambda user: user["stats"]["total_plants"] >= 1
+        "stat": "total_plants",
+        "threshold": 1
     },
     "week_streak": {
         "icon": "🔥",
         "name_ru": "Неделя продуктивности",
         "description_ru": "Поддерживал серию 7 дней",
-        "condition": lambda user: user["stats"]["longest_streak"] >= 7
+        "stat": "longest_streak",
+        "threshold": 7
     },
     "forest_builder": {
         "icon": "🌲",
         "name_ru": "Строитель леса",
         "description_ru": "Вырастил 100 растений",
-        "condition": lambda user: user["stats"]["total_plants"] >= 100
+        "stat": "total_plants",
+        "threshold": 100
     },
     "focus_master": {
         "icon": "⏱️",
         "name_ru": "Мастер концентрации",
         "description_ru": "Накопил 1000 минут фокуса",
-        "condition": lambda user: user["stats"]["total_focus_minutes"] >= 1000
+        "stat": "total_focus_minutes",
+        "threshold": 1000
     }
 }
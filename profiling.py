@@ -0,0 +1,317 @@
+"""Profiling of live handlers, switched on while the bot runs
+
+Off by default; then the only cost is the check of `profiler.active` in
+the handler and database wrappers. Switched on, by the /profile admin
+command or SIGUSR2, for a number of seconds or of updates:
+
+- a sampling thread records, every PROFILE_INTERVAL seconds, the stack
+  of each thread that is inside a handler or a database method;
+- with trace=True each of those calls also runs under cProfile, which
+  counts every function call and slows the calls down noticeably.
+
+When the window ends two files are written to PROFILE_DIR:
+
+- profile-<time>.txt: per handler and callback payload (and per database
+  method called outside handlers) the number of calls, their latency
+  percentiles, the functions most often on top of the stack and, with
+  trace, the cProfile table;
+- profile-<time>.collapsed: the sampled stacks in the collapsed format
+  of flamegraph.pl, speedscope and similar tools, rooted at the label.
+
+    flamegraph.pl data/profiles/profile-20240501-120000.collapsed > flame.svg
+"""
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Iterator, Optional
+import cProfile
+import io
+import logging
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Defaults for a window started without arguments, e.g. by the signal
+PROFILE_SECONDS = float(os.getenv("PROFILE_SECONDS", "60"))
+PROFILE_UPDATES = int(os.getenv("PROFILE_UPDATES", "0"))
+# Seconds between stack samples
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+# Functions listed per label in the text report
+TOP_FUNCTIONS = 15
+
+_clock = time.perf_counter
+
+def profile_dir() -> str:
+    return os.getenv("PROFILE_DIR") or \
+        os.path.join(os.path.dirname(os.getenv("DATA_FILE", "user_data.json")), "profiles")
+
+def _percentile(values: list, share: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+class _Window:
+    """What one profiling run collected"""
+    
+    def __init__(self, seconds: float, updates: int, trace: bool, on_done: Optional[Callable]):
+        self.started = time.time()
+        self.deadline = _clock() + seconds if seconds else None
+        self.updates_left = updates or None
+        self.trace = trace
+        self.on_done = on_done
+        # label -> call durations in seconds
+        self.durations = {}
+        # label -> pstats.Stats of its calls, with trace
+        self.stats = {}
+        # (label, outermost frame, ..., innermost frame) -> samples
+        self.stacks = Counter()
+
+class Profiler:
+    """Profiles handlers and database calls while a window is open"""
+    
+    def __init__(self, directory: str = None, interval: float = None):
+        self.directory = directory
+        self.interval = interval or PROFILE_INTERVAL
+        # Checked on every call; everything else is only touched while on
+        self.active = False
+        self._window = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sampler = None
+        # thread ident -> (label, frame the profiled call was made from)
+        self._threads = {}
+        # code object -> frame name in the collapsed file
+        self._names = {}
+    
+    def start(self, seconds: float = None, updates: int = None, trace: bool = False,
+              on_done: Callable = None) -> bool:
+        """Open a window until `seconds` passed or `updates` were handled, whichever
+        comes first; on_done(result) after the files are written. False if already on
+        """
+        if seconds is None and updates is None:
+            seconds, updates = PROFILE_SECONDS, PROFILE_UPDATES
+        with self._lock:
+            if self.active:
+                return False
+            self._window = _Window(seconds, updates, trace, on_done)
+            self._stopped.clear()
+            self._sampler = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+            self.active = True
+        self._sampler.start()
+        logger.info("Profiling started: %s s, %s updates%s", seconds or "-", updates or "-",
+                    ", traced" if trace else "")
+        return True
+    
+    def stop(self) -> Optional[dict]:
+        """Close the window and write its files; None if it wasn't open"""
+        with self._lock:
+            if not self.active:
+                return None
+            self.active = False
+            window, self._window = self._window, None
+            sampler, self._sampler = self._sampler, None
+        self._stopped.set()
+        if sampler is not threading.current_thread():
+            sampler.join()
+        result = self._write(window)
+        logger.info("Profiling stopped: %s", result)
+        if window.on_done is not None:
+            try:
+                window.on_done(result)
+            except Exception:
+                logger.exception("Profiling callback failed")
+        return result
+    
+    def update(self, label: str, handler: Callable, context):
+        """Run a handler for one update inside the window"""
+        return self._run(label, True, handler, (context,), {})
+    
+    def call(self, label: str, function: Callable, *args, **kwargs):
+        """Run a call that isn't an update, such as a database write, inside the window"""
+        return self._run(label, False, function, args, kwargs)
+    
+    def iterate(self, label: str, iterator: Iterator) -> Iterator:
+        """Run a generator, such as a database scan, inside the window: one call
+        taking the time spent producing its items, not the time between them"""
+        window = self._window
+        if window is None:
+            yield from iterator
+            return
+        
+        profile = cProfile.Profile() if window.trace else None
+        entry = sys._getframe()
+        elapsed = None
+        try:
+            while True:
+                ident = threading.get_ident()
+                if ident in self._threads:
+                    # Nested: counted under the outer call's label
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                    yield item
+                    continue
+                if profile is not None:
+                    try:
+                        profile.enable()
+                    except ValueError:
+                        profile = None
+                self._threads[ident] = (label, entry)
+                started = _clock()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed = (elapsed or 0.0) + _clock() - started
+                    if profile is not None:
+                        profile.disable()
+                    del self._threads[ident]
+                yield item
+        finally:
+            if elapsed is not None:
+                self._record(window, label, False, elapsed, profile)
+    
+    def _run(self, label: str, is_update: bool, function: Callable, args: tuple, kwargs: dict):
+        window = self._window
+        ident = threading.get_ident()
+        if window is None or ident in self._threads:
+            # Off by now, or nested: counted under the outer call's label
+            return function(*args, **kwargs)
+        
+        profile = None
+        if window.trace:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler holds the interpreter's hook
+                profile = None
+        self._threads[ident] = (label, sys._getframe())
+        started = _clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = _clock() - started
+            if profile is not None:
+                profile.disable()
+            del self._threads[ident]
+            self._record(window, label, is_update, elapsed, profile)
+    
+    def _record(self, window: _Window, label: str, is_update: bool, elapsed: float, profile):
+        done = False
+        with self._lock:
+            if self._window is not window:
+                return
+            window.durations.setdefault(label, []).append(elapsed)
+            if profile is not None:
+                stats = window.stats.get(label)
+                if stats is None:
+                    window.stats[label] = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+            if is_update and window.updates_left is not None:
+                window.updates_left -= 1
+                done = window.updates_left <= 0
+        if done:
+            # Files are written off the handler's thread
+            threading.Thread(target=self.stop, name="profiler-stop", daemon=True).start()
+    
+    def _frame_name(self, code) -> str:
+        name = self._names.get(code)
+        if name is None:
+            name = self._names[code] = \
+                f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return name
+    
+    def _sample_loop(self):
+        window = self._window
+        if window is None:
+            # Stopped before the thread ran
+            return
+        while not self._stopped.wait(self.interval):
+            if window.deadline is not None and _clock() >= window.deadline:
+                self.stop()
+                return
+            frames = sys._current_frames()
+            for ident, (label, entry) in list(self._threads.items()):
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None and frame is not entry:
+                    if frame.f_code not in _OWN_CODE:
+                        stack.append(self._frame_name(frame.f_code))
+                    frame = frame.f_back
+                if frame is None:
+                    # The call ended between the two reads
+                    continue
+                stack.append(label)
+                with self._lock:
+                    window.stacks[tuple(reversed(stack))] += 1
+    
+    def _write(self, window: _Window) -> dict:
+        directory = self.directory or profile_dir()
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, "profile-" + datetime.fromtimestamp(window.started)
+                            .strftime("%Y%m%d-%H%M%S"))
+        with self._lock:
+            durations = {label: sorted(values) for label, values in window.durations.items()}
+            stacks = dict(window.stacks)
+        
+        # Samples per label, and per label the functions on top of the stack
+        samples = Counter()
+        on_top = {}
+        for stack, count in stacks.items():
+            samples[stack[0]] += count
+            on_top.setdefault(stack[0], Counter())[stack[-1]] += count
+        
+        report = io.StringIO()
+        report.write(f"Profiled from {datetime.fromtimestamp(window.started):%Y-%m-%d %H:%M:%S} "
+                     f"for {time.time() - window.started:.1f} s, one sample every "
+                     f"{self.interval * 1000:g} ms{', traced' if window.trace else ''}\n")
+        for label in sorted(durations, key=lambda label: -sum(durations[label])):
+            values = durations[label]
+            report.write(f"\n== {label}: {len(values)} calls, {sum(values):.3f} s, "
+                         f"p50 {_percentile(values, 0.5) * 1000:.2f} ms, "
+                         f"p95 {_percentile(values, 0.95) * 1000:.2f} ms, "
+                         f"p99 {_percentile(values, 0.99) * 1000:.2f} ms, "
+                         f"max {values[-1] * 1000:.2f} ms, {samples[label]} samples\n")
+            for name, count in on_top.get(label, Counter()).most_common(TOP_FUNCTIONS):
+                report.write(f"{count * 100 / samples[label]:6.1f}%  {name}\n")
+            stats = window.stats.get(label)
+            if stats is not None:
+                stats.stream = report
+                stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write(report.getvalue())
+        with open(base + ".collapsed", "w", encoding="utf-8") as f:
+            for stack, count in sorted(stacks.items()):
+                f.write(";".join(stack) + f" {count}\n")
+        return {"report": base + ".txt", "collapsed": base + ".collapsed",
+                "calls": sum(len(values) for values in durations.values()),
+                "samples": sum(samples.values())}
+
+# The process's profiler, used by the handler and database wrappers
+profiler = Profiler()
+
+# The profiler's own frames, left out of the stacks
+_OWN_CODE = frozenset((Profiler.update.__code__, Profiler.call.__code__, Profiler._run.__code__,
+                       Profiler.iterate.__code__))
+
+def install_signal(signum: int = None) -> bool:
+    """Toggle profiling with default settings on a signal (SIGUSR2); main thread only"""
+    if signum is None:
+        signum = getattr(signal, "SIGUSR2", None)
+        if signum is None:
+            # Windows
+            return False
+    
+    def toggle(signum, frame):
+        # Writing the files must not hold up the main thread
+        target = profiler.stop if profiler.active else profiler.start
+        threading.Thread(target=target, name="profiler-toggle", daemon=True).start()
+    
+    signal.signal(signum, toggle)
+    return True
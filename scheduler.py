@@ -0,0 +1,192 @@
+"""In-process timers for session reminders and expiry
+
+Scheduler keeps timers in a binary heap: adding one is O(log n) and
+cancelling is O(1), since a cancelled entry is only marked and skipped
+when it reaches the top. A single thread sleeps until the earliest timer
+is due, and callbacks run on a small pool so a slow one can't delay the
+rest.
+
+SessionTimers uses it to tell users when their session is over and to
+abandon sessions that were never completed. On startup it rebuilds its
+timers from the active sessions stored in the database.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Cancelled entries left in the heap before it is rebuilt without them
+COMPACT_MIN = 1024
+# Longest sleep, so a changed wall clock is noticed
+MAX_WAIT = 60.0
+
+class Scheduler:
+    """Timers keyed by any hashable; a new timer replaces one with the same key"""
+    
+    def __init__(self, workers: int = 4, name: str = "scheduler"):
+        self.name = name
+        # [due, sequence, key, callback, args]; callback is None once cancelled
+        self._heap = []
+        self._timers = {}
+        self._sequence = itertools.count()
+        self._cancelled = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-worker")
+    
+    def __len__(self):
+        with self._cond:
+            return len(self._timers)
+    
+    def schedule(self, key, due: float, callback, *args):
+        """Call callback(*args) at `due`, a time.time() timestamp"""
+        entry = [due, next(self._sequence), key, callback, args]
+        with self._cond:
+            self._cancel(key)
+            self._timers[key] = entry
+            heapq.heappush(self._heap, entry)
+            if self._heap[0] is entry:
+                # Earlier than what the thread sleeps for
+                self._cond.notify()
+    
+    def cancel(self, key) -> bool:
+        with self._cond:
+            return self._cancel(key)
+    
+    def _cancel(self, key) -> bool:
+        entry = self._timers.pop(key, None)
+        if entry is None:
+            return False
+        entry[3] = entry[4] = None
+        self._cancelled += 1
+        if self._cancelled > COMPACT_MIN and self._cancelled > len(self._heap) // 2:
+            self._heap = [entry for entry in self._heap if entry[3] is not None]
+            heapq.heapify(self._heap)
+            self._cancelled = 0
+        return True
+    
+    def _pop_due(self, now: float) -> list:
+        due = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            entry = heapq.heappop(heap)
+            if entry[3] is None:
+                self._cancelled -= 1
+                continue
+            del self._timers[entry[2]]
+            due.append((entry[3], entry[4]))
+        return due
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    now = time.time()
+                    # Skip cancelled entries so they don't decide the wait
+                    while self._heap and self._heap[0][3] is None:
+                        heapq.heappop(self._heap)
+                        self._cancelled -= 1
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+                    wait = min(self._heap[0][0] - now, MAX_WAIT) if self._heap else MAX_WAIT
+                    self._cond.wait(wait)
+                if self._closed:
+                    return
+                due = self._pop_due(time.time())
+            for callback, args in due:
+                self._pool.submit(self._call, callback, args)
+    
+    def _call(self, callback, args):
+        try:
+            callback(*args)
+        except Exception:
+            logger.exception("Timer callback failed")
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+    
+    def close(self):
+        """Stop firing timers; callbacks already running are finished"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self._pool.shutdown()
+
+def _timestamp(value: str) -> float:
+    return datetime.fromisoformat(value).timestamp()
+
+class SessionTimers:
+    """End-of-session reminders and expiry of sessions nobody completed"""
+    
+    def __init__(self, db, notify, expire_after: float = None, scheduler: Scheduler = None):
+        if expire_after is None:
+            # Counted from the end of the session
+            expire_after = float(os.getenv("SESSION_EXPIRE_HOURS", "24")) * 3600
+        self.db = db
+        # notify(user_id, session) when the session's time is up
+        self.notify = notify
+        self.expire_after = expire_after
+        self.scheduler = scheduler or Scheduler(name="session-timers")
+        # Users whose session has timers
+        self._watched = set()
+    
+    def __len__(self):
+        """Sessions being watched, i.e. active ones"""
+        return len(self._watched)
+    
+    def watch(self, user_id: str, session: dict):
+        """Set the timers of a session that just started or was loaded"""
+        start_time = session["start_time"]
+        end = _timestamp(start_time) + session["duration_minutes"] * 60
+        self.scheduler.schedule((user_id, "end"), end, self._ended, user_id, start_time)
+        self.scheduler.schedule((user_id, "expire"), end + self.expire_after,
+                                self._expired, user_id, start_time)
+        self._watched.add(user_id)
+    
+    def forget(self, user_id: str):
+        """Drop the timers of a completed or abandoned session"""
+        self.scheduler.cancel((user_id, "end"))
+        self.scheduler.cancel((user_id, "expire"))
+        self._watched.discard(user_id)
+    
+    def _active(self, user, start_time: str):
+        session = user.get("current_session")
+        if session and session["status"] == "active" and session["start_time"] == start_time:
+            return session
+        return None
+    
+    def _ended(self, user_id: str, start_time: str):
+        with self.db.locked(user_id) as user:
+            session = self._active(user, start_time)
+            session = dict(session) if session else None
+        if session is not None:
+            self.notify(user_id, session)
+    
+    def _expired(self, user_id: str, start_time: str):
+        with self.db.locked(user_id) as user:
+            if self._active(user, start_time):
+                logger.info("Session of user %s started at %s expired", user_id, start_time)
+                self.db.abandon_session(user_id)
+            self._watched.discard(user_id)
+    
+    def start(self) -> int:
+        """Rebuild timers from the stored sessions and start firing them"""
+        count = 0
+        for user_id, session in self.db.active_sessions():
+            self.watch(user_id, session)
+            count += 1
+        self.scheduler.start()
+        return count
+    
+    def close(self):
+        self.scheduler.close()
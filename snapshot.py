@@ -0,0 +1,377 @@
+"""Compact binary snapshot format for UserDatabase
+
+Layout, little-endian:
+    header   magic b"FFSNAP", version u16, user count u32,
+             string table offset u64, index offset u64
+    records  one per user, see SnapshotWriter.encode
+    strings  count u32, then (length u16, utf-8) - interned plant types,
+             languages and achievement ids
+    index    per user: id length u16, id utf-8, record offset u64, length u32
+"""
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+import json
+import mmap
+import os
+import struct
+import sys
+
+from models import (Achievements, PlantList, Stats, User, format_day, format_timestamp,
+                    parse_day, parse_timestamp, symbol)
+
+MAGIC = b"FFSNAP"
+VERSION = 1
+
+HEADER = struct.Struct("<6sHIQQ")
+STATS = struct.Struct("<IIHHiH")
+STATS_KEYS = ("total_focus_minutes", "total_plants", "current_streak",
+              "longest_streak", "last_activity_date", "streak_freezes")
+STATS_LIMITS = (0xFFFFFFFF, 0xFFFFFFFF, 0xFFFF, 0xFFFF, None, 0xFFFF)
+U8 = struct.Struct("<B")
+U16 = struct.Struct("<H")
+U32 = struct.Struct("<I")
+I64 = struct.Struct("<q")
+INDEX_ENTRY = struct.Struct("<QI")
+
+# Record kinds
+STRUCTURED, JSON_ONLY = 0, 1
+# Keys stored in dedicated fields; everything else goes to the JSON tail
+FIELDS = ("user_id", "created_at", "language", "plants", "stats", "achievements")
+NO_DATE = -1
+
+def _day(value) -> Optional[int]:
+    return NO_DATE if value is None else parse_day(value)
+
+def _dump(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def _array(typecode: str, data, position: int, count: int) -> Tuple[array, int]:
+    """`count` little-endian items at `position`, and the position after them"""
+    items = array(typecode)
+    end = position + items.itemsize * count
+    items.frombytes(data[position:end])
+    if sys.byteorder == "big":
+        items.byteswap()
+    return items, end
+
+def is_snapshot(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+class SnapshotWriter:
+    """Writes a snapshot to a temp file and renames it into place on close
+
+    Records copied raw from another snapshot stay valid as long as the
+    writer starts from that snapshot's string table.
+    """
+    
+    def __init__(self, path: str, strings: List[str] = ()):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.strings = list(strings)
+        self._string_ids = {value: i for i, value in enumerate(self.strings)}
+        self.locations = {}
+        self._file = open(self.tmp_path, 'wb')
+        self._file.write(bytes(HEADER.size))
+        self._position = HEADER.size
+    
+    def _intern(self, value) -> Optional[int]:
+        if not isinstance(value, str):
+            return None
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            if len(self.strings) > 0xFFFF:
+                return None
+            string_id = self._string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return string_id
+    
+    def encode(self, user_id: str, user: dict) -> bytes:
+        """Fixed-size fields where the data fits them exactly, JSON otherwise"""
+        return self._encode_structured(user_id, user) or \
+            U8.pack(JSON_ONLY) + _dump(user)
+    
+    def _encode_structured(self, user_id: str, user: dict) -> Optional[bytes]:
+        if any(key not in user for key in FIELDS) or user["user_id"] != user_id:
+            return None
+        
+        created_at = parse_timestamp(user["created_at"])
+        language = self._intern(user["language"])
+        stats = user["stats"]
+        if created_at is None or language is None or \
+                not isinstance(stats, dict) or set(stats) != set(STATS_KEYS):
+            return None
+        values = []
+        for key, limit in zip(STATS_KEYS, STATS_LIMITS):
+            value = _day(stats[key]) if limit is None else stats[key]
+            if value is None or (limit is not None and
+                                 (type(value) is not int or not 0 <= value <= limit)):
+                return None
+            values.append(value)
+        
+        columns = self._plant_columns(user["plants"])
+        if columns is None:
+            return None
+        types, grown_at, minutes = columns
+        
+        achievements = user["achievements"]
+        if not isinstance(achievements, list) or len(achievements) > 0xFFFF:
+            return None
+        achievement_ids = [self._intern(ach_id) for ach_id in achievements]
+        if None in achievement_ids:
+            return None
+        
+        count = len(types)
+        rest = {key: value for key, value in user.items() if key not in FIELDS}
+        return b"".join((
+            U8.pack(STRUCTURED),
+            I64.pack(created_at),
+            U16.pack(language),
+            STATS.pack(*values),
+            U32.pack(count),
+            struct.pack(f"<{count}H", *types),
+            struct.pack(f"<{count}q", *grown_at),
+            struct.pack(f"<{count}H", *minutes),
+            U16.pack(len(achievement_ids)),
+            struct.pack(f"<{len(achievement_ids)}H", *achievement_ids),
+            _dump(rest)
+        ))
+    
+    def _plant_columns(self, plants) -> Optional[tuple]:
+        """(type ids, timestamps, minutes) of a plant list"""
+        if not isinstance(plants, list):
+            return None
+        types, grown_at, minutes = [], [], []
+        for plant in plants:
+            if not isinstance(plant, dict) or len(plant) != 3:
+                return None
+            plant_type = self._intern(plant.get("type"))
+            moment = parse_timestamp(plant.get("grown_at"))
+            length = plant.get("session_minutes")
+            if plant_type is None or moment is None or \
+                    type(length) is not int or not 0 <= length <= 0xFFFF:
+                return None
+            types.append(plant_type)
+            grown_at.append(moment)
+            minutes.append(length)
+        return types, grown_at, minutes
+    
+    def add(self, user_id: str, user):
+        """Add a user dict, or raw record bytes encoded against our string table"""
+        body = user if isinstance(user, bytes) else self.encode(user_id, user)
+        self._file.write(body)
+        self.locations[user_id] = (self._position, len(body))
+        self._position += len(body)
+    
+    def close(self) -> Dict[str, Tuple[int, int]]:
+        """Finish the file and return (offset, length) of every record"""
+        strings_offset = self._position
+        chunks = [U32.pack(len(self.strings))]
+        for value in self.strings:
+            encoded = value.encode('utf-8')
+            chunks.append(U16.pack(len(encoded)) + encoded)
+        table = b"".join(chunks)
+        self._file.write(table)
+        
+        index_offset = strings_offset + len(table)
+        chunks = []
+        for user_id, (offset, length) in self.locations.items():
+            encoded = user_id.encode('utf-8')
+            chunks.append(U16.pack(len(encoded)) + encoded + INDEX_ENTRY.pack(offset, length))
+        self._file.write(b"".join(chunks))
+        
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, VERSION, len(self.locations),
+                                     strings_offset, index_offset))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.tmp_path, self.path)
+        return self.locations
+    
+    def abort(self):
+        self._file.close()
+        os.remove(self.tmp_path)
+
+class SnapshotReader:
+    """Memory-mapped snapshot; records are decoded only when asked for"""
+    
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, self._strings_offset, self._index_offset = \
+            HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a user data snapshot")
+        if version != VERSION:
+            self.close()
+            raise ValueError(f"Unsupported snapshot version {version} in {path}")
+        
+        self.strings = []
+        # String table entry -> models symbol id, filled as records need them
+        self._symbols = {}
+        position = self._strings_offset
+        (count,) = U32.unpack_from(self._map, position)
+        position += U32.size
+        for _ in range(count):
+            (length,) = U16.unpack_from(self._map, position)
+            position += U16.size
+            self.strings.append(self._map[position:position + length].decode('utf-8'))
+            position += length
+    
+    def iter_index(self) -> Iterator[Tuple[str, int, int]]:
+        """Yield (user_id, offset, length) in file order"""
+        data = self._map
+        position = self._index_offset
+        for _ in range(self.count):
+            (length,) = U16.unpack_from(data, position)
+            position += U16.size
+            user_id = data[position:position + length].decode('utf-8')
+            position += length
+            offset, length = INDEX_ENTRY.unpack_from(data, position)
+            position += INDEX_ENTRY.size
+            yield user_id, offset, length
+    
+    def index(self) -> Dict[str, Tuple[int, int]]:
+        """user_id -> (offset, length) of its record"""
+        return {user_id: (offset, length) for user_id, offset, length in self.iter_index()}
+    
+    def raw(self, offset: int, length: int) -> bytes:
+        return self._map[offset:offset + length]
+    
+    def _unpack(self, offset: int, length: int) -> Optional[tuple]:
+        """Fields of a structured record as stored, None for a JSON one
+
+        (created_at, language id, stats values, plant type ids,
+        timestamps, minutes, achievement ids, rest); the per-plant
+        fields and achievements are arrays read straight off the map.
+        """
+        data = self._map
+        end = offset + length
+        (kind,) = U8.unpack_from(data, offset)
+        position = offset + U8.size
+        if kind == JSON_ONLY:
+            return None
+        
+        (created_at,) = I64.unpack_from(data, position)
+        (language,) = U16.unpack_from(data, position + I64.size)
+        position += I64.size + U16.size
+        values = list(STATS.unpack_from(data, position))
+        position += STATS.size
+        
+        (count,) = U32.unpack_from(data, position)
+        position += U32.size
+        types, position = _array('H', data, position, count)
+        grown_at, position = _array('q', data, position, count)
+        minutes, position = _array('H', data, position, count)
+        
+        (count,) = U16.unpack_from(data, position)
+        position += U16.size
+        achievements, position = _array('H', data, position, count)
+        rest = json.loads(data[position:end])
+        return created_at, language, values, types, grown_at, minutes, achievements, rest
+    
+    def decode(self, user_id: str, offset: int, length: int) -> dict:
+        fields = self._unpack(offset, length)
+        if fields is None:
+            return json.loads(self._map[offset + U8.size:offset + length])
+        created_at, language, values, types, grown_at, minutes, achievements, rest = fields
+        strings = self.strings
+        values[4] = None if values[4] == NO_DATE else format_day(values[4])
+        
+        user = {
+            "user_id": user_id,
+            "created_at": format_timestamp(created_at),
+            "language": strings[language],
+            "plants": [{"type": strings[plant_type],
+                        "grown_at": format_timestamp(moment),
+                        "session_minutes": length}
+                       for plant_type, moment, length in zip(types, grown_at, minutes)]
+        }
+        # Keep the usual key order
+        if "current_session" in rest:
+            user["current_session"] = rest.pop("current_session")
+        user["stats"] = dict(zip(STATS_KEYS, values))
+        if "preferences" in rest:
+            user["preferences"] = rest.pop("preferences")
+        user["achievements"] = [strings[ach_id] for ach_id in achievements]
+        user.update(rest)
+        return user
+    
+    def decode_user(self, user_id: str, offset: int, length: int) -> User:
+        """The record as a models.User, built from the stored fields
+
+        Timestamps and plant arrays go into the model as they are, with
+        no ISO strings or plant dicts in between.
+        """
+        fields = self._unpack(offset, length)
+        if fields is None:
+            return User.from_dict(json.loads(self._map[offset + U8.size:offset + length]))
+        created_at, language, values, types, grown_at, minutes, achievements, rest = fields
+        symbol_ids = self._symbol_map(set(types) | {language})
+        type_ids, lengths = array('H'), array('I')
+        try:
+            type_ids.fromlist(list(map(symbol_ids.__getitem__, types)))
+        except OverflowError:
+            # More symbols than a plant array holds; PlantList keeps those as dicts
+            return User.from_dict(self.decode(user_id, offset, length))
+        lengths.fromlist(minutes.tolist())
+        if values[4] == NO_DATE:
+            values[4] = None
+        return User.from_stored({
+            "user_id": user_id,
+            "created_at": created_at,
+            "language": symbol_ids[language],
+            "plants": PlantList.from_arrays(type_ids, grown_at, lengths),
+            "stats": Stats.from_stored(dict(zip(STATS_KEYS, values))),
+            "achievements": Achievements(map(self.strings.__getitem__, achievements)),
+        }, rest)
+    
+    def _symbol_map(self, string_ids) -> dict:
+        """models symbol id of each of the given string table entries"""
+        known = self._symbols
+        for string_id in string_ids:
+            if string_id not in known:
+                known[string_id] = symbol(self.strings[string_id])
+        return known
+    
+    def __iter__(self) -> Iterator[Tuple[str, dict]]:
+        for user_id, offset, length in self.iter_index():
+            yield user_id, self.decode(user_id, offset, length)
+    
+    def users(self) -> Iterator[Tuple[str, User]]:
+        """Yield (user_id, models.User) in file order"""
+        for user_id, offset, length in self.iter_index():
+            yield user_id, self.decode_user(user_id, offset, length)
+    
+    def close(self):
+        self._map.close()
+        self._file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+def load(path: str) -> dict:
+    """Decode a whole snapshot into user dicts"""
+    with SnapshotReader(path) as reader:
+        return dict(reader)
+
+def load_users(path: str) -> dict:
+    """Decode a whole snapshot into models.User objects"""
+    with SnapshotReader(path) as reader:
+        return dict(reader.users())
+
+def write(path: str, users) -> Dict[str, Tuple[int, int]]:
+    """Write (user_id, user) pairs as a snapshot"""
+    writer = SnapshotWriter(path)
+    try:
+        for user_id, user in users:
+            writer.add(user_id, user)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.close()
@@ -0,0 +1,183 @@
+"""Nightly streak maintenance
+
+Streaks are otherwise only checked when a user comes back, so the streak
+of someone who stopped stays on display and freezes are never used. Once
+a day this job reads last_activity_date, current_streak and
+streak_freezes of every user into NumPy arrays and decides for all of them
+at once:
+
+- a streak with missed days is kept if the user has a freeze per missed
+  day; the freezes are used up and the missed days count as active;
+- otherwise it is broken and current_streak drops to 0;
+- a streak whose last active day was yesterday is at risk, and its user
+  is worth a reminder.
+
+Only users whose stats change are written back, in one batch, and only
+if they haven't been active since the arrays were read.
+
+    python streak_job.py [--date 2024-05-01] [--dry-run]
+
+Run it from cron while the bot is stopped, or let the bot run it with
+schedule(); a JSON data file must not be written by two processes.
+"""
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+
+from database import create_database
+
+logger = logging.getLogger(__name__)
+
+# Local hour the bot runs the job at, just after the day changes
+STREAK_JOB_HOUR = int(os.getenv("STREAK_JOB_HOUR", "0"))
+
+# Day number for users who were never active, far enough back to never match
+_NEVER = np.iinfo(np.int64).min // 2
+
+class Columns:
+    """The stats the job looks at, one array element per user"""
+    
+    def __init__(self, user_ids: List[str], last_active: np.ndarray,
+                 streak: np.ndarray, freezes: np.ndarray):
+        self.user_ids = user_ids
+        # Days since 1970-01-01; _NEVER when never active
+        self.last_active = last_active
+        self.streak = streak
+        self.freezes = freezes
+    
+    def __len__(self):
+        return len(self.user_ids)
+
+def _day_numbers(dates: list) -> np.ndarray:
+    """ISO dates (or None) to day numbers, parsed by NumPy in one call"""
+    days = np.array(dates, dtype="datetime64[D]")
+    numbers = days.astype(np.int64)
+    numbers[np.isnat(days)] = _NEVER
+    return numbers
+
+def load_columns(db) -> Columns:
+    """Read the streak stats of every user"""
+    user_ids = []
+    dates = []
+    streaks = []
+    freezes = []
+    for user_id, stats in db.iter_stats():
+        user_ids.append(user_id)
+        dates.append(stats.get("last_activity_date"))
+        streaks.append(stats.get("current_streak") or 0)
+        freezes.append(stats.get("streak_freezes") or 0)
+    return Columns(user_ids, _day_numbers(dates),
+                   np.array(streaks, dtype=np.int64), np.array(freezes, dtype=np.int64))
+
+class Plan:
+    """What the job does to each user; boolean masks and new values"""
+    
+    def __init__(self, columns: Columns, today: date):
+        today_number = (today - date(1970, 1, 1)).days
+        yesterday = today_number - 1
+        # Whole days without activity since the last active one
+        missed = yesterday - columns.last_active
+        active = columns.streak > 0
+        lapsed = active & (missed > 0)
+        
+        self.frozen = lapsed & (columns.freezes >= missed)
+        self.broken = lapsed & ~self.frozen
+        self.changed = self.frozen | self.broken
+        self.freezes_used = np.where(self.frozen, missed, 0)
+        self.streak = np.where(self.broken, 0, columns.streak)
+        self.freezes = columns.freezes - self.freezes_used
+        self.last_active = np.where(self.frozen, yesterday, columns.last_active)
+        # Nothing grown today yet; tomorrow it's broken or costs a freeze
+        self.at_risk = (self.streak > 0) & (self.last_active == yesterday)
+    
+    def summary(self) -> dict:
+        return {
+            "frozen": int(self.frozen.sum()),
+            "freezes_used": int(self.freezes_used.sum()),
+            "broken": int(self.broken.sum()),
+            "at_risk": int(self.at_risk.sum())
+        }
+
+def _iso_day(number) -> Optional[str]:
+    if number == _NEVER:
+        return None
+    return (date(1970, 1, 1) + timedelta(days=int(number))).isoformat()
+
+def apply(db, columns: Columns, plan: Plan) -> int:
+    """Write the changed users back; returns how many were written"""
+    def changes():
+        for i in np.flatnonzero(plan.changed):
+            # Users active since the columns were read are left alone
+            expected = {"last_activity_date": _iso_day(columns.last_active[i]),
+                        "current_streak": int(columns.streak[i])}
+            new = {"current_streak": int(plan.streak[i]),
+                   "streak_freezes": int(plan.freezes[i]),
+                   "last_activity_date": _iso_day(plan.last_active[i])}
+            yield columns.user_ids[i], expected, new
+    return db.update_stats(changes())
+
+def at_risk(columns: Columns, plan: Plan) -> List[str]:
+    """Users to remind that their streak ends unless they grow a plant today"""
+    return [columns.user_ids[i] for i in np.flatnonzero(plan.at_risk)]
+
+def run(db, today: date = None, dry_run: bool = False) -> dict:
+    """Run the job once; the summary includes the at-risk user ids"""
+    today = today or datetime.now().date()
+    started = time.perf_counter()
+    columns = load_columns(db)
+    loaded = time.perf_counter()
+    plan = Plan(columns, today)
+    planned = time.perf_counter()
+    written = 0 if dry_run else apply(db, columns, plan)
+    summary = dict(plan.summary(), users=len(columns), written=written,
+                   load_seconds=loaded - started, plan_seconds=planned - loaded,
+                   write_seconds=time.perf_counter() - planned)
+    logger.info("Streak job for %s: %s", today, summary)
+    summary["at_risk_users"] = at_risk(columns, plan)
+    return summary
+
+def _next_run(hour: int) -> float:
+    now = datetime.now()
+    moment = now.replace(hour=hour, minute=5, second=0, microsecond=0)
+    if moment <= now:
+        moment += timedelta(days=1)
+    return moment.timestamp()
+
+def schedule(scheduler, db, on_done=None, hour: int = None):
+    """Run the job every night on a Scheduler; on_done(summary) after each run"""
+    if hour is None:
+        hour = STREAK_JOB_HOUR
+    
+    def job():
+        try:
+            summary = run(db)
+            if on_done is not None:
+                on_done(summary)
+        finally:
+            scheduler.schedule("streak_job", _next_run(hour), job)
+    
+    scheduler.schedule("streak_job", _next_run(hour), job)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--date", type=date.fromisoformat, help="run as of this day (default: today)")
+    parser.add_argument("--dry-run", action="store_true", help="count without writing")
+    args = parser.parse_args()
+    
+    db = create_database()
+    try:
+        summary = run(db, args.date, args.dry_run)
+    finally:
+        db.close()
+    at_risk_users = summary.pop("at_risk_users")
+    for key, value in summary.items():
+        print(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}")
+    print(f"at risk: {len(at_risk_users)} users")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""AchievementIndex against the baseline scan of every achievement"""
+import random
+
+import pytest
+
+from achievements import IDS, AchievementIndex, ids_of, index, mask_of
+from plants import ACHIEVEMENTS
+
+# The conditions the catalog had before it listed stat and threshold
+BASELINE = {
+    "first_plant": lambda user: user["stats"]["total_plants"] >= 1,
+    "week_streak": lambda user: user["stats"]["longest_streak"] >= 7,
+    "forest_builder": lambda user: user["stats"]["total_plants"] >= 100,
+    "focus_master": lambda user: user["stats"]["total_focus_minutes"] >= 1000,
+}
+
+STATS = ("total_plants", "total_focus_minutes", "current_streak", "longest_streak")
+
+def scan(catalog: dict, stats: dict, earned: list, changed=None) -> list:
+    """New achievements the way check_achievements found them"""
+    return [ach_id for ach_id, info in catalog.items()
+            if ach_id not in earned and (changed is None or info["stat"] in changed)
+            and stats[info["stat"]] >= info["threshold"]]
+
+def random_stats(rng) -> dict:
+    return {stat: rng.choice([0, 1, 6, 7, 8, 99, 100, 999, 1000, rng.randrange(2000)])
+            for stat in STATS}
+
+def test_catalog_matches_baseline_conditions():
+    rng = random.Random(1)
+    for _ in range(500):
+        user = {"stats": random_stats(rng)}
+        expected = [ach_id for ach_id, condition in BASELINE.items() if condition(user)]
+        assert index.new_achievements(user["stats"], []) == expected
+
+@pytest.mark.parametrize("seed", range(5))
+def test_index_matches_full_scan(seed):
+    rng = random.Random(seed)
+    catalog = ACHIEVEMENTS
+    if seed:
+        # The same ids with other stats and thresholds, equal ones included
+        catalog = {ach_id: {"stat": rng.choice(STATS), "threshold": rng.choice([1, 7, 7, 100])}
+                   for ach_id in IDS}
+    achievement_index = AchievementIndex(catalog)
+    for _ in range(500):
+        stats = random_stats(rng)
+        earned = rng.sample(IDS, rng.randrange(len(IDS) + 1))
+        changed = rng.choice([None, (), rng.sample(STATS, rng.randrange(1, len(STATS) + 1))])
+        assert achievement_index.new_achievements(stats, earned, changed) == \
+            scan(catalog, stats, earned, changed)
+
+def test_missing_and_unknown_stats():
+    assert index.new_achievements({}, []) == []
+    assert index.new_achievements({"total_plants": 5, "streak_freezes": 9}, []) == ["first_plant"]
+    assert index.new_achievements({"total_plants": 5}, [], changed=["unknown"]) == []
+
+def test_masks():
+    rng = random.Random(2)
+    for _ in range(100):
+        earned = rng.sample(IDS, rng.randrange(len(IDS) + 1))
+        assert ids_of(mask_of(earned)) == [ach_id for ach_id in IDS if ach_id in earned]
+    assert mask_of(["removed_achievement"]) == 0
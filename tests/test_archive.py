@@ -0,0 +1,61 @@
+"""Plant archive: old plants move to cold storage, totals stay with the user"""
+import pytest
+
+from database import UserDatabase
+
+SPECIES = ["sprout", "oak", "oak", "sprout", "oak"]
+
+def grow(db, user_id: str, number: int) -> list:
+    for i in range(number):
+        db.start_session(user_id, 25, SPECIES[i % len(SPECIES)])
+        db.complete_session(user_id)
+    return [SPECIES[i % len(SPECIES)] for i in range(number)]
+
+def check(db, user_id: str, grown: list):
+    user = db.get_user(user_id)
+    plants = user["plants"]
+    assert plants.total == len(grown)
+    assert user["stats"]["total_plants"] == len(grown)
+    assert plants.species_counts() == {species: grown.count(species) for species in set(grown)}
+    assert plants.count("oak") == grown.count("oak")
+    assert plants.count("cactus") == 0
+    archived = list(db.archived_plants(user_id))
+    assert len(archived) == plants.archived
+    assert [plant["type"] for plant in archived + list(plants)] == grown
+
+@pytest.mark.parametrize("data_format", ["json", "binary"])
+def test_hot_plants_are_archived(tmp_path, monkeypatch, data_format):
+    monkeypatch.setenv("DATA_PLANTS_HOT", "12")
+    path = str(tmp_path / "users.json")
+    db = UserDatabase(path, data_format=data_format)
+    grown = grow(db, "1000", 31)
+    plants = db.get_user("1000")["plants"]
+    assert plants.archived > 0
+    assert len(plants) <= 12
+    check(db, "1000", grown)
+    db.close()
+    
+    # Counters come back from plants_archived, not from the archive file
+    db = UserDatabase(path, data_format=data_format)
+    assert db.get_user("1000")["plants"].archived == plants.archived
+    check(db, "1000", grown)
+    grown += grow(db, "1000", 4)
+    check(db, "1000", grown)
+    db.close()
+
+def test_archive_plants(tmp_path):
+    path = str(tmp_path / "users.json")
+    db = UserDatabase(path)
+    grown = {user_id: grow(db, user_id, number)
+             for user_id, number in [("1000", 2), ("1001", 14), ("1002", 23)]}
+    assert db.archive_plants(keep=3) == 2
+    assert db.archive_plants(keep=3) == 0
+    for user_id, species in grown.items():
+        assert len(db.get_user(user_id)["plants"]) == min(len(species), 3)
+        check(db, user_id, species)
+    db.close()
+    
+    db = UserDatabase(path)
+    for user_id, species in grown.items():
+        check(db, user_id, species)
+    db.close()
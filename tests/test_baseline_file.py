@@ -0,0 +1,97 @@
+"""user_data.json as the bot has always written it stays readable both ways"""
+import json
+
+import pytest
+
+from database import UserDatabase, _Shard
+from models import PlantList
+
+def baseline_user(user_id: str, plants: list) -> dict:
+    return {
+        "user_id": user_id,
+        "created_at": "2024-05-01T09:15:00.123456",
+        "language": "ru",
+        "plants": plants,
+        "current_session": None,
+        "stats": {"total_focus_minutes": sum(plant["session_minutes"] for plant in plants),
+                  "total_plants": len(plants), "current_streak": 1, "longest_streak": 3,
+                  "last_activity_date": "2024-05-03", "streak_freezes": 2},
+        "preferences": {"session_duration": 25, "favorite_plant": "🌱"},
+        "achievements": ["first_plant"] if plants else [],
+    }
+
+BASELINE = {
+    "1": baseline_user("1", [
+        {"type": "sprout", "grown_at": "2024-05-01T09:40:00.123456", "session_minutes": 25},
+        {"type": "oak", "grown_at": "2024-05-03T18:00:00", "session_minutes": 50},
+    ]),
+    "2": baseline_user("2", []),
+    # A plant the arrays can't hold is kept as it was
+    "3": baseline_user("3", [
+        {"type": "pine", "grown_at": "2024-05-02 07:00:00", "session_minutes": 15},
+    ]),
+}
+
+def plants_on_disk(path) -> dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        return {user_id: user["plants"] for user_id, user in json.load(f).items()}
+
+@pytest.mark.parametrize("cache_size", [0, 2])
+def test_baseline_file_loads_and_keeps_its_layout(tmp_path, cache_size):
+    path = tmp_path / "user_data.json"
+    path.write_text(json.dumps(BASELINE, ensure_ascii=False, indent=2), encoding='utf-8')
+    
+    db = UserDatabase(str(path), flush_interval_ms=0, cache_size=cache_size)
+    for user_id, user in BASELINE.items():
+        assert db.get_user(user_id).to_dict() == user
+    db.start_session("2", 25, "sprout")
+    db.complete_session("2")
+    db.close()
+    
+    # Still the plant lists any reader of user_data.json expects
+    stored = plants_on_disk(path)
+    assert {user_id: stored[user_id] for user_id in ("1", "3")} == \
+        {user_id: BASELINE[user_id]["plants"] for user_id in ("1", "3")}
+    assert [plant["type"] for plant in stored["2"]] == ["sprout"]
+    assert isinstance(stored["2"][0]["grown_at"], str)
+
+@pytest.mark.parametrize("cache_size", [0, 2])
+def test_plant_columns_are_rewritten_as_lists(tmp_path, cache_size):
+    path = str(tmp_path / "user_data.json")
+    columns = dict(BASELINE)
+    plants = PlantList.from_list(BASELINE["1"]["plants"])
+    columns["1"] = dict(BASELINE["1"], plants={
+        "type": ["sprout", "oak"], "grown_at": plants.grown_at.tolist(),
+        "session_minutes": [25, 50]})
+    # A shard written with plant columns, with an index matching it
+    shard = _Shard(path)
+    shard.write_index(shard.write_snapshot(columns.items()))
+    with open(shard.index_path, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    # Its header as written before INDEX_VERSION
+    lines[0] = f"# {shard._snapshot_stamp()}\n"
+    with open(shard.index_path, 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+    
+    db = UserDatabase(path, flush_interval_ms=0, cache_size=cache_size)
+    assert db.get_user("1").to_dict() == BASELINE["1"]
+    db.close()
+    assert plants_on_disk(path) == {user_id: user["plants"] for user_id, user in BASELINE.items()}
+
+def test_from_list_matches_one_plant_at_a_time():
+    plants = BASELINE["1"]["plants"] + [
+        {"type": "oak", "grown_at": "2024-05-03T18:00:00.000000", "session_minutes": 50},
+        {"type": "oak", "grown_at": "2024-05-03T18:00:00+00:00", "session_minutes": 50},
+        {"type": "oak", "grown_at": "2024-05-03T18:00:00", "session_minutes": True},
+        {"type": "oak", "grown_at": "2024-05-03T18:00:00", "session_minutes": -1},
+        {"type": "oak", "grown_at": "2024-02-30T18:00:00", "session_minutes": 25},
+        {"type": "oak", "grown_at": "2024-05-03T18:00:00", "session_minutes": 25, "x": 1},
+        {"type": "oak"},
+        "oak",
+    ]
+    for end in range(len(plants) + 1):
+        for start in range(end):
+            one_by_one, at_once = PlantList(plants[start:end]), PlantList.from_list(plants[start:end])
+            assert at_once.to_list() == one_by_one.to_list() == plants[start:end]
+            assert at_once.odd == one_by_one.odd
+            assert at_once.species_counts() == one_by_one.species_counts()
@@ -0,0 +1,97 @@
+"""Cluster partitioning: stable, total, and followed by the router and split"""
+from collections import Counter
+import os
+import queue
+import subprocess
+import sys
+
+import pytest
+
+import cluster
+from cluster import Supervisor, partition_of
+from database import UserDatabase
+from dispatch import update_key
+
+USER_IDS = [str(100000 + i) for i in range(5000)]
+
+def test_partition_is_total_and_even():
+    for count in range(1, 9):
+        partitions = Counter(partition_of(user_id, count) for user_id in USER_IDS)
+        assert set(partitions) == set(range(count))
+        assert sum(partitions.values()) == len(USER_IDS)
+        assert max(partitions.values()) < 1.2 * len(USER_IDS) / count
+
+def test_partition_is_stable_across_processes():
+    # Not hash(), which changes with PYTHONHASHSEED
+    script = ("import sys; from cluster import partition_of; "
+              "print([partition_of(user_id, 7) for user_id in sys.argv[1:]])")
+    outputs = set()
+    for seed in ("1", "2"):
+        environ = dict(os.environ, PYTHONHASHSEED=seed)
+        outputs.add(subprocess.run([sys.executable, "-c", script, *USER_IDS[:50]], env=environ,
+                                   cwd=os.path.dirname(cluster.__file__), check=True,
+                                   capture_output=True, text=True).stdout)
+    assert outputs == {f"{[partition_of(user_id, 7) for user_id in USER_IDS[:50]]}\n"}
+    # Fixed values, so a changed hash shows up as a failing test and not as
+    # users finding their data gone
+    assert [partition_of(user_id, 4) for user_id in ("1", "42", "100000", "user")] == [2, 2, 0, 3]
+    assert [partition_of(user_id, 7) for user_id in ("1", "42", "100000", "user")] == [2, 1, 0, 0]
+    assert partition_of("42", 1) == 0
+
+class _FakeWorker:
+    def __init__(self):
+        self.inbox = queue.Queue()
+
+def test_router_sends_a_user_to_one_worker():
+    supervisor = Supervisor(4)
+    supervisor._workers = [_FakeWorker() for _ in range(4)]
+    updates = []
+    for step in range(3):
+        for number in range(40):
+            user = {"user_id": 100000 + number}
+            updates.append([
+                {"update_type": "message_created", "message": {"sender": user, "body": {"text": "/start"}}},
+                {"update_type": "message_callback", "callback": {"user": user, "payload": "my_forest"}},
+                {"update_type": "bot_started", "user": user, "chat_id": 5},
+            ][step])
+    updates.append({"update_type": "bot_stopped", "chat_id": 100001})
+    updates.append({"update_type": "unknown"})
+    for update in updates:
+        supervisor.submit(update)
+    
+    received = {}
+    for index, worker in enumerate(supervisor._workers):
+        while not worker.inbox.empty():
+            kind, update = worker.inbox.get_nowait()
+            assert kind == "update"
+            received.setdefault(update_key(update), []).append((index, update))
+    # Updates without a user go to the first worker
+    assert [index for index, _ in received.pop(None)] == [0]
+    for key, entries in received.items():
+        assert {index for index, _ in entries} == {partition_of(key, 4)}
+    # In the order they came, per user
+    assert [update for _, update in received["100000"]] == updates[0:120:40]
+
+def test_split_puts_every_user_in_its_partition(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATA_FILE", str(tmp_path / "users.json"))
+    monkeypatch.delenv("DATA_BACKEND", raising=False)
+    db = UserDatabase(str(tmp_path / "users.json"))
+    for user_id in USER_IDS[:200]:
+        db.start_session(user_id, 25, "sprout")
+        db.complete_session(user_id)
+    db.close()
+    
+    read, written = cluster.split(3)
+    assert read == written and read.count == 200
+    seen = Counter()
+    for index in range(3):
+        db = UserDatabase(cluster.partition_path(str(tmp_path / "users.json"), index, 3))
+        for user_id, user in db.iter_users():
+            assert partition_of(user_id, 3) == index
+            assert user["stats"]["total_plants"] == 1
+            seen[user_id] += 1
+        db.close()
+    assert seen == Counter(USER_IDS[:200])
+    assert cluster.partition_counts(str(tmp_path / "users.json")) == {3}
+    with pytest.raises(ValueError):
+        cluster.split(3)
@@ -0,0 +1,56 @@
+"""DailySeries: 7- and 30-day windows against a plain per-day count"""
+import random
+
+import pytest
+
+from models import SERIES_DAYS, DailySeries
+
+def expected_totals(days: dict, today: int, window: int) -> tuple:
+    kept = [total for day, total in days.items() if today - window < day <= today]
+    return sum(minutes for minutes, plants in kept), sum(plants for minutes, plants in kept)
+
+def test_windows_roll_over_days_and_gaps():
+    rng = random.Random(7)
+    series = DailySeries()
+    days = {}
+    day = 19000
+    for _ in range(300):
+        # Mostly the same or the next day, sometimes a gap past both windows
+        day += rng.choice([0, 0, 1, 1, 2, 5, 8, 29, 31, 45])
+        minutes = rng.choice([15, 25, 50])
+        series.add(day, minutes)
+        total = days.get(day, (0, 0))
+        days[day] = total[0] + minutes, total[1] + 1
+        for today in (day, day + 1, day + 6, day + 7, day + 29, day + 30):
+            for window in (7, 30):
+                assert series.totals(today, window) == expected_totals(days, today, window)
+    best_day = max(days, key=lambda day: (days[day][0], -day))
+    assert (series.best_day, series.best_minutes) == (best_day, days[best_day][0])
+
+def test_old_days_are_ignored():
+    series = DailySeries()
+    series.add(20000, 25)
+    series.add(20000 - SERIES_DAYS, 50)
+    assert series.totals(20000, 30) == (25, 1)
+
+def test_dict_round_trip():
+    series = DailySeries()
+    for day, minutes in ((20000, 25), (20003, 50), (20003, 15), (20010, 25)):
+        series.add(day, minutes)
+    data = series.to_dict()
+    assert data["minutes"] == [25, 0, 0, 65, 0, 0, 0, 0, 0, 0, 25]
+    loaded = DailySeries.from_dict(data)
+    assert loaded == series
+    for window in (7, 30):
+        assert loaded.totals(20012, window) == series.totals(20012, window)
+
+@pytest.mark.parametrize("field, value", [
+    ("minutes", [25, 1.5]), ("minutes", [float("nan")]), ("minutes", [True]),
+    ("minutes", [-5]), ("plants", ["1"]), ("best_minutes", 2.5), ("best_minutes", -1),
+])
+def test_from_dict_refuses_non_int(field, value):
+    data = {"day": "2024-05-01", "minutes": [25], "plants": [1],
+            "best_day": "2024-05-01", "best_minutes": 25}
+    data[field] = value
+    with pytest.raises(ValueError):
+        DailySeries.from_dict(data)
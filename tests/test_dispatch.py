@@ -0,0 +1,111 @@
+"""Dispatcher: per-user order, per-user limit and a full queue blocking submit"""
+import random
+import threading
+import time
+
+from dispatch import Dispatcher
+
+def wait_until(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+class Handler:
+    """Records handled updates; updates with a "gate" wait for it"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.handled = {}
+        self.running = set()
+        self.overlapped = False
+    
+    def __call__(self, update: dict):
+        user_id = update["user_id"]
+        with self.lock:
+            self.overlapped |= user_id in self.running
+            self.running.add(user_id)
+        if "gate" in update:
+            assert update["gate"].wait(5)
+        else:
+            time.sleep(random.random() / 1000)
+        with self.lock:
+            self.running.discard(user_id)
+            self.handled.setdefault(user_id, []).append(update["n"])
+
+def test_user_order_across_workers():
+    handler = Handler()
+    dispatcher = Dispatcher(handler, workers=4, max_pending=1000, max_pending_per_user=100)
+    for n in range(50):
+        for user_id in range(6):
+            assert dispatcher.submit({"user_id": user_id, "n": n})
+    assert dispatcher.join(10)
+    dispatcher.close()
+    assert handler.handled == {user_id: list(range(50)) for user_id in range(6)}
+    assert not handler.overlapped
+    assert dispatcher.stats()["processed"] == 300
+
+def test_user_limit_drops_updates():
+    handler = Handler()
+    gate = threading.Event()
+    dispatcher = Dispatcher(handler, workers=2, max_pending=100, max_pending_per_user=3)
+    assert dispatcher.submit({"user_id": 1, "n": 0, "gate": gate})
+    wait_until(lambda: handler.running)
+    assert all(dispatcher.submit({"user_id": 1, "n": n}) for n in range(1, 4))
+    assert not dispatcher.submit({"user_id": 1, "n": 4})
+    # Other users are not affected
+    assert dispatcher.submit({"user_id": 2, "n": 0})
+    gate.set()
+    assert dispatcher.join(5)
+    dispatcher.close()
+    assert handler.handled == {1: [0, 1, 2, 3], 2: [0]}
+    assert dispatcher.stats()["dropped"] == 1
+
+def test_full_queue_blocks_submit():
+    handler = Handler()
+    gate = threading.Event()
+    dispatcher = Dispatcher(handler, workers=1, max_pending=2, max_pending_per_user=10)
+    assert dispatcher.submit({"user_id": 1, "n": 0, "gate": gate})
+    assert dispatcher.submit({"user_id": 2, "n": 0})
+    submitted = threading.Event()
+    thread = threading.Thread(target=lambda: dispatcher.submit({"user_id": 3, "n": 0})
+                              and submitted.set())
+    thread.start()
+    wait_until(lambda: dispatcher.stats()["blocked"] == 1)
+    assert not submitted.wait(0.05)
+    gate.set()
+    assert submitted.wait(5)
+    thread.join()
+    assert dispatcher.join(5)
+    dispatcher.close()
+    assert handler.handled == {1: [0], 2: [0], 3: [0]}
+
+def test_user_limit_checked_after_blocking():
+    handler = Handler()
+    gates = {user_id: threading.Event() for user_id in (1, 2, 3)}
+    dispatcher = Dispatcher(handler, workers=3, max_pending=4, max_pending_per_user=2)
+    for user_id, gate in gates.items():
+        assert dispatcher.submit({"user_id": user_id, "n": 0, "gate": gate})
+    wait_until(lambda: len(handler.running) == 3)
+    assert dispatcher.submit({"user_id": 1, "n": 1})
+    
+    # Both fit the user's limit when they start waiting for a free slot
+    results = []
+    threads = [threading.Thread(target=lambda n=n: results.append(
+        dispatcher.submit({"user_id": 1, "n": n}))) for n in (2, 3)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: dispatcher.stats()["blocked"] == 2)
+    gates[2].set()
+    wait_until(lambda: results)
+    # User 1 is still busy with update 0, so its queue is now full
+    gates[3].set()
+    wait_until(lambda: len(results) == 2)
+    assert sorted(results) == [False, True]
+    gates[1].set()
+    for thread in threads:
+        thread.join()
+    assert dispatcher.join(5)
+    dispatcher.close()
+    assert handler.handled[1][:2] == [0, 1] and len(handler.handled[1]) == 3
+    assert dispatcher.stats()["dropped"] == 1
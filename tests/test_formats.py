@@ -0,0 +1,57 @@
+"""Each DATA_FORMAT round trip, and switching between them"""
+import pytest
+
+import snapshot
+from database import UserDatabase
+from models import User
+from test_journal import USER_IDS, fill
+
+def open_db(path, **kwargs):
+    return UserDatabase(str(path), flush_interval_ms=0, **kwargs)
+
+def users_of(db) -> dict:
+    return {user_id: db.get_user(user_id).to_dict() for user_id in USER_IDS}
+
+def fill_all(db) -> dict:
+    fill(db)
+    # A running session and a key the models do not know
+    db.start_session(USER_IDS[3], 50, "pine", chat_id=3)
+    with db.locked(USER_IDS[4]) as user:
+        user["temp_duration"] = 50
+        db.update_user(USER_IDS[4], user)
+    return users_of(db)
+
+@pytest.mark.parametrize("data_format", ["json", "binary"])
+@pytest.mark.parametrize("journal", [False, True])
+@pytest.mark.parametrize("cache_size", [0, 3])
+def test_round_trip(tmp_path, data_format, journal, cache_size):
+    path = tmp_path / "users.json"
+    db = open_db(path, data_format=data_format, journal=journal)
+    expected = fill_all(db)
+    db.close()
+    
+    db = open_db(path, data_format=data_format, journal=journal, cache_size=cache_size)
+    assert users_of(db) == expected
+    db.close()
+
+def test_switching_format_keeps_users(tmp_path):
+    path = tmp_path / "users.json"
+    db = open_db(path)
+    expected = fill_all(db)
+    db.close()
+    for data_format in ("binary", "json", "binary"):
+        db = open_db(path, data_format=data_format)
+        assert users_of(db) == expected
+        db.close()
+
+def test_snapshot_users_match_their_dicts(tmp_path):
+    path = tmp_path / "users.json"
+    db = open_db(path, data_format="binary")
+    expected = fill_all(db)
+    db.close()
+    
+    with snapshot.SnapshotReader(str(tmp_path / "users.snap")) as reader:
+        for user_id, offset, length in reader.iter_index():
+            assert reader.decode_user(user_id, offset, length).to_dict() == expected[user_id]
+            assert User.from_dict(reader.decode(user_id, offset, length)).to_dict() == \
+                expected[user_id]
@@ -0,0 +1,58 @@
+"""UserDatabase journal: replaying the log on start and cutting off a torn tail"""
+import os
+
+from database import UserDatabase
+
+USER_IDS = [str(1000 + i) for i in range(10)]
+
+def summary(user) -> tuple:
+    return (user["language"], [plant["type"] for plant in user["plants"]],
+            user["stats"]["total_plants"], list(user["achievements"]))
+
+def summaries(db) -> dict:
+    return {user_id: summary(db.get_user(user_id)) for user_id in USER_IDS}
+
+def fill(db) -> dict:
+    for i, user_id in enumerate(USER_IDS):
+        for j in range(i % 3):
+            db.start_session(user_id, 25, "oak" if j else "sprout")
+            db.complete_session(user_id)
+        user = db.get_user(user_id)
+        user["language"] = "en" if i % 2 else "ru"
+        user["achievements"].append(f"test_{i}")
+        db.update_user(user_id, user)
+    return summaries(db)
+
+def test_journal_replay(tmp_path):
+    path = str(tmp_path / "users.json")
+    db = UserDatabase(path, journal=True)
+    expected = fill(db)
+    db.close()
+    assert os.path.getsize(path + ".log") > 0
+    
+    db = UserDatabase(path, journal=True)
+    assert summaries(db) == expected
+    db.close()
+
+def test_torn_tail_is_cut_off(tmp_path):
+    path = str(tmp_path / "users.json")
+    db = UserDatabase(path, journal=True)
+    expected = fill(db)
+    db.close()
+    size = os.path.getsize(path + ".log")
+    # A crash in the middle of an append
+    with open(path + ".log", "ab") as f:
+        f.write(b'{"id":"1000","user":{"user_id":"1000","lang')
+    
+    db = UserDatabase(path, journal=True)
+    assert summaries(db) == expected
+    assert os.path.getsize(path + ".log") == size
+    # Records appended after the cut stay readable
+    db.start_session("1000", 25, "oak")
+    db.complete_session("1000")
+    expected["1000"] = summary(db.get_user("1000"))
+    db.close()
+    
+    db = UserDatabase(path, journal=True)
+    assert summaries(db) == expected
+    db.close()
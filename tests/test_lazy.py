@@ -0,0 +1,39 @@
+"""Lazy loading: the LRU cache and the .idx index"""
+import os
+
+from database import UserDatabase
+from test_journal import USER_IDS, fill, summaries
+
+def test_lazy_round_trip(tmp_path):
+    path = str(tmp_path / "users.json")
+    for journal in (False, True):
+        db = UserDatabase(path, journal=journal, cache_size=3)
+        expected = fill(db)
+        assert len(db.data) <= 3
+        db.close()
+        
+        db = UserDatabase(path, journal=journal, cache_size=3)
+        assert summaries(db) == expected
+        db.close()
+    assert os.path.exists(path + ".idx")
+
+def test_index_rebuilt_for_replaced_snapshot(tmp_path):
+    path = tmp_path / "users.json"
+    db = UserDatabase(str(path))
+    fill(db)
+    db.close()
+    # Writes the .idx for the snapshot
+    UserDatabase(str(path), cache_size=3).close()
+    
+    # A snapshot of the same size written over it, as a restore might do
+    raw = path.read_bytes()
+    path.write_bytes(raw.replace(b'"1000"', b'"2000"'))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+    assert os.path.getsize(path) == len(raw)
+    
+    db = UserDatabase(str(path), cache_size=3)
+    assert "2000" in db.shards[0].index
+    assert "1000" not in db.shards[0].index
+    assert db.get_user("2000")["achievements"] == ["test_0"]
+    db.close()
@@ -0,0 +1,95 @@
+"""Leaderboard ranks and top lists against a sorted list"""
+import random
+
+import pytest
+
+from leaderboard import MAX_SCORE, FenwickTree, Leaderboard
+
+def expected_top(scores: dict, n: int) -> list:
+    ordered = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:n]
+    return [(expected_rank(scores, score), user_id, score) for user_id, score in ordered]
+
+def expected_rank(scores: dict, score: int) -> int:
+    return 1 + sum(other > score for other in scores.values())
+
+def check(leaderboard: Leaderboard, model: dict):
+    assert len(leaderboard) == len(model["total_plants"])
+    for stat, scores in model.items():
+        for n in (1, 3, 10, len(scores) + 1):
+            assert leaderboard.top(stat, n) == expected_top(scores, n)
+        for user_id, score in scores.items():
+            assert leaderboard.rank(stat, user_id) == (expected_rank(scores, score), score, len(scores))
+    assert leaderboard.rank("total_plants", "nobody") is None
+
+@pytest.mark.parametrize("seed", range(4))
+def test_matches_sorted_list(seed):
+    rng = random.Random(seed)
+    stats = ("total_plants", "longest_streak")
+    leaderboard = Leaderboard(stats)
+    model = {stat: {} for stat in stats}
+    user_ids = [str(1000 + i) for i in range(40)]
+    # Few distinct scores, so most users tie
+    high = rng.choice([5, 50, 3000])
+    for step in range(600):
+        user_id = rng.choice(user_ids)
+        if rng.random() < 0.1:
+            leaderboard.remove(user_id)
+            for scores in model.values():
+                scores.pop(user_id, None)
+        else:
+            # Scores go up and down, past the tree's first size too
+            values = {stat: rng.randrange(high) for stat in stats}
+            leaderboard.update(user_id, values)
+            for stat, scores in model.items():
+                scores[user_id] = values[stat]
+        if step % 50 == 0:
+            check(leaderboard, model)
+    check(leaderboard, model)
+    
+    # A rebuild from the entries gives the same boards
+    rebuilt = Leaderboard(stats)
+    rebuilt.rebuild((user_id, {"stats": values}) for user_id, values in leaderboard.entries()
+                    if values["total_plants"])
+    model = {stat: {user_id: score for user_id, score in scores.items()
+                    if model["total_plants"][user_id]} for stat, scores in model.items()}
+    check(rebuilt, model)
+
+def test_ties_share_a_rank():
+    leaderboard = Leaderboard(("total_plants",))
+    for user_id, score in [("b", 5), ("a", 5), ("c", 7), ("d", 1), ("e", 5)]:
+        leaderboard.update(user_id, {"total_plants": score})
+    assert leaderboard.top("total_plants", 4) == [(1, "c", 7), (2, "a", 5), (2, "b", 5), (2, "e", 5)]
+    assert leaderboard.rank("total_plants", "d") == (5, 1, 5)
+    # The leader drops to the bottom
+    leaderboard.update("c", {"total_plants": 0})
+    assert leaderboard.top("total_plants", 2) == [(1, "a", 5), (1, "b", 5)]
+    assert leaderboard.rank("total_plants", "c") == (5, 0, 5)
+
+def test_odd_scores():
+    leaderboard = Leaderboard(("total_plants",))
+    for user_id, score in [("a", None), ("b", -3), ("c", "7"), ("d", MAX_SCORE + 10), ("e", MAX_SCORE)]:
+        leaderboard.update(user_id, {"total_plants": score})
+    assert leaderboard.top("total_plants", 5) == [
+        (1, "d", MAX_SCORE), (1, "e", MAX_SCORE), (3, "a", 0), (3, "b", 0), (3, "c", 0)]
+
+def test_rebuild_leaves_out_users_without_plants():
+    leaderboard = Leaderboard()
+    users = [("a", {"stats": {"total_plants": 2, "total_focus_minutes": 50, "longest_streak": 1}}),
+             ("b", {"stats": {"total_plants": 0, "total_focus_minutes": 0, "longest_streak": 0}})]
+    assert leaderboard.rebuild(users) == 1
+    assert leaderboard.rank("total_focus_minutes", "b") is None
+
+def test_fenwick_tree():
+    rng = random.Random(5)
+    counts = [rng.randrange(4) for _ in range(3000)]
+    tree = FenwickTree.from_counts(counts)
+    assert tree.counts()[:len(counts)] == counts
+    total = sum(counts)
+    ordered = sorted(score for score, count in enumerate(counts) for _ in range(count))
+    for k in range(1, total + 1, 7):
+        assert tree.kth(k) == ordered[k - 1]
+    for score in range(0, 3100, 13):
+        assert tree.count_at_most(score) == sum(counts[:score + 1])
+    tree.add(5000, 2)
+    assert tree.kth(total + 2) == 5000
+    assert tree.count_at_most(4999) == total
@@ -0,0 +1,79 @@
+"""migrate.py: export between formats, verify and resume"""
+import os
+
+import pytest
+
+import migrate
+from database import UserDatabase
+from test_journal import USER_IDS, fill, summaries
+
+@pytest.fixture
+def source(tmp_path):
+    path = str(tmp_path / "user_data.json")
+    db = UserDatabase(path)
+    fill(db)
+    db.close()
+    return path
+
+def test_round_trip_through_every_format(tmp_path, source):
+    expected = migrate.scan(source, "json")
+    assert expected.count == len(USER_IDS)
+    steps = [(source, "json", str(tmp_path / "users.db"), "sqlite", 1),
+             (str(tmp_path / "users.db"), "sqlite", str(tmp_path / "users.jsonl"), "jsonl", 1),
+             (str(tmp_path / "users.jsonl"), "jsonl", str(tmp_path / "sharded.json"), "sharded", 4)]
+    for path, kind, destination, destination_kind, shards in steps:
+        read, written = migrate.export(path, destination, kind, destination_kind,
+                                       shards=shards, batch=3)
+        assert read == expected
+        assert written == expected
+        assert not os.path.exists(destination + ".checkpoint")
+    
+    # The shards open as a regular sharded database
+    db = UserDatabase(str(tmp_path / "user_data.json"))
+    expected_users = summaries(db)
+    db.close()
+    db = UserDatabase(str(tmp_path / "sharded.json"), shards=4)
+    assert summaries(db) == expected_users
+    db.close()
+
+def test_verify_notices_a_changed_user(tmp_path, source):
+    destination = str(tmp_path / "users.jsonl")
+    migrate.export(source, destination, "json", "jsonl")
+    assert migrate.scan(destination, "jsonl") == migrate.scan(source, "json")
+    
+    with open(destination, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    lines[0] = lines[0].replace('"language":"ru"', '"language":"en"')
+    with open(destination, 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+    assert migrate.scan(destination, "jsonl") != migrate.scan(source, "json")
+
+SINKS = {"jsonl": migrate.JsonlSink, "sharded": migrate.ShardedSink, "sqlite": migrate.SqliteSink}
+
+@pytest.mark.parametrize("kind, shards", [("jsonl", 1), ("sharded", 3), ("sqlite", 1)])
+def test_interrupted_export_resumes(tmp_path, monkeypatch, source, kind, shards):
+    destination = str(tmp_path / ("users.db" if kind == "sqlite" else f"users.{kind}"))
+    write = SINKS[kind].write
+    written = []
+    
+    def crash_after_seven(self, user_id, user):
+        if len(written) == 7:
+            raise KeyboardInterrupt
+        written.append(user_id)
+        write(self, user_id, user)
+    
+    monkeypatch.setattr(SINKS[kind], "write", crash_after_seven)
+    with pytest.raises(KeyboardInterrupt):
+        migrate.export(source, destination, "json", kind, shards=shards, batch=3)
+    assert os.path.exists(destination + ".checkpoint")
+    
+    # Picks up after the sixth user, the last checkpoint
+    written.clear()
+    monkeypatch.setattr(SINKS[kind], "write", lambda self, user_id, user: (
+        written.append(user_id), write(self, user_id, user)))
+    read, stored = migrate.export(source, destination, "json", kind, shards=shards,
+                                  batch=3, resume=True)
+    assert written == USER_IDS[6:]
+    assert read == stored == migrate.scan(source, "json")
+    assert stored.count == len(USER_IDS)
+    assert not os.path.exists(destination + ".checkpoint")
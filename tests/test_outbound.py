@@ -0,0 +1,161 @@
+"""OutboundQueue: pacing, retries with backoff and forgetting idle chats"""
+import threading
+import time
+
+import pytest
+import requests
+
+import outbound
+from outbound import Outbox, OutboundQueue, TokenBucket
+
+def response(status: int, headers: dict = None) -> requests.Response:
+    result = requests.Response()
+    result.status_code = status
+    result.headers.update(headers or {})
+    result._content = b""
+    return result
+
+class FakeApi:
+    """Stands in for OutboundQueue._post; answers or raises from a script per chat, then 200"""
+    
+    def __init__(self, script: dict = None):
+        self.script = {chat_id: list(statuses) for chat_id, statuses in (script or {}).items()}
+        self.lock = threading.Lock()
+        # (monotonic time, chat_id, text, status)
+        self.calls = []
+    
+    def __call__(self, key, body: dict) -> requests.Response:
+        chat_id = key[0]
+        with self.lock:
+            statuses = self.script.get(chat_id)
+            answer = statuses.pop(0) if statuses else 200
+            if isinstance(answer, Exception):
+                self.calls.append((time.monotonic(), chat_id, body["text"], None))
+                raise answer
+            if not isinstance(answer, tuple):
+                answer = (answer, None)
+            self.calls.append((time.monotonic(), chat_id, body["text"], answer[0]))
+        return response(*answer)
+    
+    def times(self, chat_id=None) -> list:
+        return [at for at, chat, _, _ in self.calls if chat_id is None or chat == chat_id]
+
+@pytest.fixture
+def make_queue(tmp_path):
+    queues = []
+    
+    def make(api: FakeApi, **settings) -> OutboundQueue:
+        queue = OutboundQueue("token", outbox=Outbox(str(tmp_path / "outbox.db")), **settings)
+        queue._post = api
+        queues.append(queue)
+        return queue
+    
+    yield make
+    for queue in queues:
+        queue.close()
+
+def test_token_bucket():
+    bucket = TokenBucket(10, 3, now=0.0)
+    assert [bucket.take(0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take(0.0) == pytest.approx(0.1)
+    assert bucket.take(0.05) == pytest.approx(0.05)
+    assert bucket.take(0.1) == 0.0
+    # Refills up to the burst only
+    assert bucket.full(10.0) and bucket.tokens == 3
+    bucket.pause(10.0, 0.5)
+    assert bucket.wait_time(10.0) == pytest.approx(0.6)
+    assert bucket.wait_time(10.61) == 0.0
+
+def test_bot_and_chat_rates(make_queue):
+    api = FakeApi()
+    queue = make_queue(api, rate=40, burst=1, chat_rate=10, chat_burst=1)
+    queue.start()
+    queue.send_many([(chat_id, None, f"{chat_id}:{n}", None)
+                     for n in range(4) for chat_id in (1, 2, 3)])
+    assert queue.drain(10)
+    # Each chat in order, a message per 0.1s
+    for chat_id in (1, 2, 3):
+        assert [text for _, chat, text, _ in api.calls if chat == chat_id] == \
+            [f"{chat_id}:{n}" for n in range(4)]
+        times = api.times(chat_id)
+        assert min(b - a for a, b in zip(times, times[1:])) >= 0.08
+    # The whole bot, a message per 0.025s after the first
+    times = api.times()
+    assert times[-1] - times[0] >= 0.3 - 0.02
+    assert queue.stats()["sent"] == 12
+
+def test_retries_with_backoff(make_queue, monkeypatch):
+    monkeypatch.setattr(outbound, "BACKOFF_BASE", 0.05)
+    api = FakeApi({1: [503, (429, {"Retry-After": "0.2"}), requests.ConnectionError("reset")],
+                   2: [400]})
+    queue = make_queue(api)
+    queue.start()
+    queue.send_message(1, "retried")
+    queue.send_message(1, "after")
+    queue.send_message(2, "rejected")
+    assert queue.drain(10)
+    assert [(text, status) for _, chat, text, status in api.calls if chat == 1] == \
+        [("retried", 503), ("retried", 429), ("retried", None), ("retried", 200), ("after", 200)]
+    times = api.times(1)
+    # Backoff with jitter: 0.025-0.05s, then Retry-After, then 0.1-0.2s
+    assert times[1] - times[0] >= 0.02
+    assert times[2] - times[1] >= 0.19
+    assert times[3] - times[2] >= 0.095
+    # A 4xx other than 429 is not retried
+    assert [status for _, chat, _, status in api.calls if chat == 2] == [400]
+    stats = queue.stats()
+    assert (stats["sent"], stats["retried"], stats["failed"], stats["queued"]) == (2, 3, 1, 0)
+    queue.close()
+    outbox = Outbox(queue.outbox.filepath)
+    assert len(outbox) == 0
+    outbox.close()
+
+def test_gives_up_after_max_attempts(make_queue, monkeypatch):
+    monkeypatch.setattr(outbound, "BACKOFF_BASE", 0.01)
+    api = FakeApi({1: [500] * 10})
+    queue = make_queue(api, max_attempts=3)
+    queue.start()
+    queue.send_message(1, "doomed")
+    assert queue.drain(10)
+    assert len(api.calls) == 3
+    assert queue.stats()["failed"] == 1
+
+def test_unsent_messages_wait_in_the_outbox(make_queue, monkeypatch):
+    monkeypatch.setattr(outbound, "BACKOFF_BASE", 60)
+    api = FakeApi({1: [503]})
+    queue = make_queue(api)
+    queue.start()
+    queue.send_message(1, "later")
+    queue.send_message(2, "now")
+    deadline = time.monotonic() + 5
+    while queue.stats()["retried"] + queue.stats()["sent"] < 2:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    queue.close()
+    
+    api = FakeApi()
+    queue = make_queue(api)
+    assert queue.start() == 1
+    assert queue.drain(10)
+    assert [text for _, _, text, _ in api.calls] == ["later"]
+
+def test_idle_chats_are_forgotten(make_queue, monkeypatch):
+    monkeypatch.setattr(outbound, "PRUNE_INTERVAL", 0.2)
+    api = FakeApi()
+    queue = make_queue(api, rate=1000, burst=10, chat_rate=100, chat_burst=1)
+    queue.start()
+    queue.send_many([(chat_id, None, "hi", None) for chat_id in range(10)])
+    assert queue.drain(5)
+    assert queue.stats()["chats"] == 10
+    # One chat keeps the queue busy, so _next never waits long
+    deadline = time.monotonic() + 5
+    while queue.stats()["chats"] > 1:
+        assert time.monotonic() < deadline, "idle chats were never forgotten"
+        queue.send_message(99, "busy")
+        time.sleep(0.01)
+    assert queue.drain(5)
+    # And without traffic too
+    deadline = time.monotonic() + 5
+    while queue.stats()["chats"]:
+        assert time.monotonic() < deadline, "idle chats were never forgotten"
+        time.sleep(0.01)
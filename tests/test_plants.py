@@ -0,0 +1,79 @@
+"""Unlock lookups against the linear scans they replaced"""
+import random
+
+import pytest
+
+import plants
+from plants import PLANT_SPECIES, catalog_changed, get_available_plants, get_next_unlock
+
+def baseline_available(user_data: dict, is_premium: bool = False) -> list:
+    total_plants = user_data["stats"]["total_plants"]
+    available = []
+    for plant_id, plant_info in PLANT_SPECIES.items():
+        if total_plants >= plant_info["unlock_at"]:
+            if plant_info.get("premium", False) and not is_premium:
+                continue
+            available.append((plant_id, plant_info))
+    return available
+
+def baseline_next_unlock(user_data: dict) -> dict:
+    total_plants = user_data["stats"]["total_plants"]
+    for plant_id, plant_info in sorted(PLANT_SPECIES.items(),
+                                       key=lambda x: x[1]["unlock_at"]):
+        if total_plants < plant_info["unlock_at"]:
+            return {
+                "plant": plant_info,
+                "plants_needed": plant_info["unlock_at"] - total_plants
+            }
+    return None
+
+def check_against_baseline(totals):
+    for total_plants in totals:
+        user = {"stats": {"total_plants": total_plants}}
+        for is_premium in (False, True):
+            assert get_available_plants(user, is_premium) == baseline_available(user, is_premium)
+        assert get_next_unlock(user) == baseline_next_unlock(user)
+
+@pytest.fixture
+def catalog():
+    saved = dict(PLANT_SPECIES)
+    yield PLANT_SPECIES
+    PLANT_SPECIES.clear()
+    PLANT_SPECIES.update(saved)
+    catalog_changed()
+
+def test_lookups_match_baseline():
+    check_against_baseline(list(range(-1, 130)) + [10 ** 6])
+
+def test_buckets():
+    totals = range(-1, 130)
+    buckets = [plants.unlock_bucket(total) for total in totals]
+    assert buckets == sorted(buckets)
+    assert set(buckets) == set(range(plants.unlock_buckets()))
+    for total, bucket in zip(totals, buckets):
+        user = {"stats": {"total_plants": total}}
+        assert plants.plants_in_bucket(bucket, True) == baseline_available(user, True)
+
+def test_catalog_changed(catalog):
+    user = {"stats": {"total_plants": 5}}
+    before = get_available_plants(user)
+    version = plants.catalog_version
+    catalog["fern"] = {"emoji": "🌿", "name_ru": "Папоротник", "name_en": "Fern",
+                       "tier": "free", "unlock_at": 5}
+    # Cached until told
+    assert get_available_plants(user) == before
+    catalog_changed()
+    assert plants.catalog_version == version + 1
+    assert ("fern", catalog["fern"]) in get_available_plants(user)
+    check_against_baseline(range(-1, 130))
+
+def test_random_catalogs_match_baseline(catalog):
+    rng = random.Random(3)
+    species = list(catalog.items())
+    for _ in range(20):
+        catalog.clear()
+        for plant_id, info in rng.sample(species, rng.randrange(len(species) + 1)):
+            catalog[plant_id] = dict(info, unlock_at=rng.choice([0, 5, 5, 20, 50]),
+                                     premium=rng.random() < 0.3)
+        catalog_changed()
+        check_against_baseline(range(-1, 60))
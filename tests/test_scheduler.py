@@ -0,0 +1,126 @@
+"""Scheduler timers and SessionTimers reminding and expiring sessions"""
+import threading
+import time
+
+import pytest
+
+from database import UserDatabase
+from scheduler import Scheduler, SessionTimers
+
+@pytest.fixture
+def scheduler():
+    scheduler = Scheduler(workers=2)
+    scheduler.start()
+    yield scheduler
+    scheduler.close()
+
+def test_timer_fires(scheduler):
+    fired = threading.Event()
+    calls = []
+    scheduler.schedule("a", time.time() + 0.02, lambda *args: calls.append(args) or fired.set(), 1, 2)
+    assert len(scheduler) == 1
+    assert fired.wait(5)
+    assert calls == [(1, 2)]
+    assert len(scheduler) == 0
+
+def test_cancelled_timer_never_fires(scheduler):
+    calls = []
+    done = threading.Event()
+    scheduler.schedule("a", time.time() + 0.02, calls.append, "a")
+    assert scheduler.cancel("a")
+    assert not scheduler.cancel("a")
+    scheduler.schedule("b", time.time() + 0.05, done.set)
+    assert done.wait(5)
+    time.sleep(0.02)
+    assert calls == []
+    assert len(scheduler) == 0
+
+def test_reschedule_replaces_timer(scheduler):
+    calls = []
+    done = threading.Event()
+    scheduler.schedule("a", time.time() + 60, calls.append, "old")
+    # Earlier than the timer the thread is sleeping for
+    scheduler.schedule("a", time.time() + 0.02, calls.append, "new")
+    scheduler.schedule("b", time.time() + 0.01, calls.append, "first")
+    scheduler.schedule("b", time.time() + 0.05, calls.append, "later")
+    scheduler.schedule("c", time.time() + 0.1, done.set)
+    assert len(scheduler) == 3
+    assert done.wait(5)
+    time.sleep(0.02)
+    assert calls == ["new", "later"]
+
+def test_cancelled_entries_are_compacted(monkeypatch):
+    monkeypatch.setattr("scheduler.COMPACT_MIN", 10)
+    scheduler = Scheduler(workers=1)
+    for i in range(100):
+        scheduler.schedule(i, time.time() + 60, print)
+    for i in range(80):
+        scheduler.cancel(i)
+    assert len(scheduler) == 20
+    assert len(scheduler._heap) < 60
+    scheduler.close()
+
+@pytest.fixture
+def db(tmp_path):
+    db = UserDatabase(str(tmp_path / "users.json"))
+    yield db
+    db.close()
+
+def session_timers(db, expire_after: float):
+    notified = []
+    timers = SessionTimers(db, lambda user_id, session: notified.append((user_id, session)),
+                           expire_after=expire_after, scheduler=Scheduler(workers=2))
+    assert timers.start() == 0
+    return timers, notified
+
+def test_session_reminded_then_expired(db):
+    timers, notified = session_timers(db, expire_after=0.2)
+    session = db.start_session("1000", 25, "oak")
+    # Ends right away, expires 0.2s later
+    timers.watch("1000", {**session, "duration_minutes": 0})
+    assert len(timers) == 1
+    
+    deadline = time.time() + 5
+    while db.get_user("1000")["current_session"] is not None:
+        assert time.time() < deadline
+        time.sleep(0.01)
+    timers.close()
+    assert [(user_id, session["start_time"]) for user_id, session in notified] == \
+        [("1000", session["start_time"])]
+    assert len(timers) == 0
+    assert db.get_user("1000")["stats"]["total_plants"] == 0
+
+def test_expiry_waits_for_user_lock(db):
+    timers, notified = session_timers(db, expire_after=0)
+    session = db.start_session("1000", 25, "oak")
+    with db.locked("1000") as user:
+        timers.watch("1000", {**session, "duration_minutes": 0})
+        time.sleep(0.1)
+        # Both timers are due, but a handler holds the user
+        assert user["current_session"]["status"] == "active"
+        assert not notified
+    deadline = time.time() + 5
+    while db.get_user("1000")["current_session"] is not None:
+        assert time.time() < deadline
+        time.sleep(0.01)
+    timers.close()
+
+def test_finished_sessions_are_left_alone(db):
+    timers, notified = session_timers(db, expire_after=0.05)
+    # Both sessions end 0.2s from now
+    session = db.start_session("1000", 25, "oak")
+    timers.watch("1000", {**session, "duration_minutes": 0.2 / 60})
+    session = db.start_session("1001", 25, "oak")
+    timers.watch("1001", {**session, "duration_minutes": 0.2 / 60})
+    # Completed: its timers are cancelled
+    db.complete_session("1000")
+    timers.forget("1000")
+    # Replaced by a new session the old timers don't know about
+    time.sleep(0.001)
+    second = db.start_session("1001", 25, "sprout")
+    time.sleep(0.5)
+    timers.close()
+    assert notified == []
+    assert len(timers) == 0
+    assert db.get_user("1000")["stats"]["total_plants"] == 1
+    assert db.get_user("1001")["current_session"]["start_time"] == second["start_time"]
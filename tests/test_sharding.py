@@ -0,0 +1,43 @@
+"""UserDatabase shards: records still in a log survive DATA_JOURNAL and DATA_SHARDS changes"""
+import os
+
+from database import UserDatabase
+from test_journal import USER_IDS, fill, summaries
+
+def test_journal_switched_off_keeps_logged_records(tmp_path):
+    path = str(tmp_path / "users.json")
+    db = UserDatabase(path, journal=True)
+    expected = fill(db)
+    db.close()
+    assert os.path.getsize(path + ".log") > 0
+    
+    # The log is folded into the snapshot and removed
+    db = UserDatabase(path, journal=False)
+    assert summaries(db) == expected
+    db.close()
+    assert not os.path.exists(path + ".log")
+    
+    db = UserDatabase(path, journal=False)
+    assert summaries(db) == expected
+    db.close()
+
+def test_shard_count_change_keeps_logged_records(tmp_path):
+    path = str(tmp_path / "users.json")
+    db = UserDatabase(path, journal=True)
+    expected = fill(db)
+    db.close()
+    
+    # The single file is down to its log, never compacted
+    for shards in (4, 3, 1):
+        db = UserDatabase(path, journal=True, shards=shards)
+        assert summaries(db) == expected
+        # Leave a log behind in the new shards as well
+        db.start_session(USER_IDS[shards], 25, "oak")
+        db.complete_session(USER_IDS[shards])
+        expected = summaries(db)
+        db.close()
+    
+    db = UserDatabase(path, journal=False, shards=2)
+    assert summaries(db) == expected
+    db.close()
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".log")]
@@ -0,0 +1,43 @@
+"""SQLiteUserDatabase: round trip and plants read on use"""
+from database import SQLiteUserDatabase
+from test_journal import USER_IDS, fill, summaries
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "users.db")
+    db = SQLiteUserDatabase(path)
+    expected = fill(db)
+    db.close()
+    
+    db = SQLiteUserDatabase(path)
+    assert summaries(db) == expected
+    assert db.count_users() == len(USER_IDS)
+    db.close()
+
+def test_plants_read_on_use(tmp_path):
+    db = SQLiteUserDatabase(str(tmp_path / "users.db"))
+    for plant_type in ("sprout", "oak", "pine"):
+        db.start_session("1", 25, plant_type)
+        db.complete_session("1")
+    
+    statements = []
+    db.conn.set_trace_callback(statements.append)
+    user = db.get_user("1")
+    assert not [statement for statement in statements if "FROM plants" in statement]
+    assert len(user["plants"]) == 3
+    assert [plant["type"] for plant in user["plants"][-2:]] == ["oak", "pine"]
+    
+    # Writing the user back leaves the history as it was
+    db.update_user("1", user)
+    assert [plant["type"] for plant in dict(db.iter_users())["1"]["plants"]] == \
+        ["sprout", "oak", "pine"]
+    db.close()
+
+def test_plants_from_another_database_are_copied(tmp_path):
+    source = SQLiteUserDatabase(str(tmp_path / "source.db"))
+    source.start_session("1", 25, "oak")
+    source.complete_session("1")
+    target = SQLiteUserDatabase(str(tmp_path / "target.db"))
+    target.import_users([("1", source.get_user("1"))])
+    assert [plant["type"] for plant in target.get_user("1")["plants"]] == ["oak"]
+    source.close()
+    target.close()
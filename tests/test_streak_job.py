@@ -0,0 +1,91 @@
+"""Nightly streak job on a fixed set of users"""
+from datetime import date
+
+import pytest
+
+import streak_job
+from database import SQLiteUserDatabase, UserDatabase
+
+TODAY = date(2024, 5, 10)
+
+# user_id -> (last_activity_date, current_streak, streak_freezes)
+USERS = {
+    "active_today": ("2024-05-10", 5, 0),
+    "active_yesterday": ("2024-05-09", 3, 0),
+    "missed_one_frozen": ("2024-05-08", 4, 1),
+    "missed_two_one_freeze": ("2024-05-07", 4, 1),
+    "missed_two_frozen": ("2024-05-07", 2, 3),
+    "lapsed_long_ago": ("2024-04-01", 10, 0),
+    "no_streak": ("2024-05-01", 0, 2),
+    "never_active": (None, 0, 0),
+}
+
+# What the changed users hold afterwards
+EXPECTED = {
+    "missed_one_frozen": ("2024-05-09", 4, 0),
+    "missed_two_one_freeze": ("2024-05-07", 0, 1),
+    "missed_two_frozen": ("2024-05-09", 2, 1),
+    "lapsed_long_ago": ("2024-04-01", 0, 0),
+}
+
+def streak_stats(db, user_id: str) -> tuple:
+    stats = db.get_user(user_id)["stats"]
+    return stats["last_activity_date"], stats["current_streak"], stats["streak_freezes"]
+
+@pytest.fixture(params=["json", "sqlite"])
+def db(request, tmp_path):
+    if request.param == "sqlite":
+        db = SQLiteUserDatabase(str(tmp_path / "users.db"))
+    else:
+        db = UserDatabase(str(tmp_path / "users.json"))
+    for user_id, (last_active, streak, freezes) in USERS.items():
+        user = db.get_user(user_id)
+        user["stats"]["last_activity_date"] = last_active
+        user["stats"]["current_streak"] = streak
+        user["stats"]["longest_streak"] = streak
+        user["stats"]["streak_freezes"] = freezes
+        db.update_user(user_id, user)
+    yield db
+    db.close()
+
+def test_streak_job(db, monkeypatch):
+    written = []
+    update_stats = db.update_stats
+    
+    def recorded(changes):
+        changes = list(changes)
+        written.extend(user_id for user_id, _, _ in changes)
+        return update_stats(changes)
+    
+    monkeypatch.setattr(db, "update_stats", recorded)
+    summary = streak_job.run(db, TODAY)
+    assert sorted(summary.pop("at_risk_users")) == \
+        ["active_yesterday", "missed_one_frozen", "missed_two_frozen"]
+    assert {key: summary[key] for key in ("users", "frozen", "freezes_used", "broken",
+                                          "at_risk", "written")} == \
+        {"users": 8, "frozen": 2, "freezes_used": 3, "broken": 2, "at_risk": 3, "written": 4}
+    assert sorted(written) == sorted(EXPECTED)
+    for user_id, values in USERS.items():
+        assert streak_stats(db, user_id) == EXPECTED.get(user_id, values), user_id
+    
+    # A second run the same day has nothing left to do
+    written.clear()
+    summary = streak_job.run(db, TODAY)
+    assert summary["written"] == 0 and written == []
+
+def test_dry_run_writes_nothing(db):
+    summary = streak_job.run(db, TODAY, dry_run=True)
+    assert summary["broken"] == 2 and summary["written"] == 0
+    for user_id, values in USERS.items():
+        assert streak_stats(db, user_id) == values
+
+def test_users_active_since_reading_are_left_alone(db):
+    columns = streak_job.load_columns(db)
+    plan = streak_job.Plan(columns, TODAY)
+    # Grows a plant before the plan is written
+    user = db.get_user("lapsed_long_ago")
+    user["stats"]["last_activity_date"] = TODAY.isoformat()
+    user["stats"]["current_streak"] = 1
+    db.update_user("lapsed_long_ago", user)
+    assert streak_job.apply(db, columns, plan) == 3
+    assert streak_stats(db, "lapsed_long_ago") == ("2024-05-10", 1, 0)